@@ -0,0 +1,160 @@
+import io
+import zipfile
+from contextlib import closing
+from sqlmodel import Session, select
+
+from models import Documento, DocumentoTexto, Processo
+from armazenamento import obter_armazenamento, hash_da_chave
+from limpeza import agendar_exclusao
+from envios import buscar_envio, chave_em_uso, esquecer_donos
+from documentos import invalidar_documento
+
+# Os vários PDFs de um processo (petição, contestação, decisões...).
+# Processo.arquivo_pdf continua sendo o documento principal, o que o resumo e o chat leem.
+
+TAMANHO_BLOCO_ZIP = 1024 * 1024
+
+
+def registrar_documento(session: Session, processo: Processo, envio, nome: str = None) -> Documento:
+    """Acrescenta o arquivo à lista do processo (o mesmo conteúdo não entra duas vezes). O commit fica com quem chamou."""
+    documento = session.exec(
+        select(Documento).where(Documento.processo_id == processo.id, Documento.chave == envio.chave)
+    ).first()
+    if documento:
+        return documento
+
+    documento = Documento(
+        processo_id=processo.id,
+        chave=envio.chave,
+        nome=nome or envio.nome_original,
+        hash_conteudo=envio.hash_conteudo,
+        tamanho=envio.tamanho
+    )
+    session.add(documento)
+    return documento
+
+
+def listar_documentos(session: Session, processo: Processo) -> list:
+    documentos = session.exec(
+        select(Documento).where(Documento.processo_id == processo.id).order_by(Documento.enviado_em)
+    ).all()
+
+    # Anexo de antes desta tabela existir: entra na lista na primeira consulta
+    if processo.arquivo_pdf and processo.arquivo_pdf not in {d.chave for d in documentos}:
+        envio = buscar_envio(session, hash_da_chave(processo.arquivo_pdf))
+        documento = Documento(
+            processo_id=processo.id,
+            chave=processo.arquivo_pdf,
+            nome=envio.nome_original if envio else processo.arquivo_pdf.rsplit("/", 1)[-1],
+            hash_conteudo=envio.hash_conteudo if envio else None,
+            tamanho=envio.tamanho if envio else None
+        )
+        session.add(documento)
+        documentos = [documento, *documentos]
+
+    # Número de páginas de quem já teve o texto lido
+    sem_paginas = {d.chave: d for d in documentos if d.total_paginas is None}
+    if sem_paginas:
+        lidos = session.exec(
+            select(DocumentoTexto).where(DocumentoTexto.chave.in_(sem_paginas), DocumentoTexto.status == "pronto")
+        ).all()
+        for texto in lidos:
+            sem_paginas[texto.chave].total_paginas = texto.total_paginas
+            session.add(sem_paginas[texto.chave])
+
+    if session.new or session.dirty:
+        session.commit()
+        for documento in documentos:
+            session.refresh(documento)
+    return documentos
+
+
+def apagar_se_orfao(session: Session, chave: str, exceto_processo_id: int = None):
+    """
+    Agenda a exclusão do objeto (e apaga o texto e o envio guardados dele) se nenhum
+    processo ou documento ainda aponta para ele. O commit fica com quem chamou:
+    a exclusão no armazenamento só acontece se a transação for confirmada (limpeza.py).
+    """
+    if not chave or chave_em_uso(session, chave, exceto_processo_id=exceto_processo_id):
+        return
+    agendar_exclusao(session, chave)
+    invalidar_documento(session, chave)
+    envio = buscar_envio(session, hash_da_chave(chave))
+    if envio:
+        esquecer_donos(session, envio.hash_conteudo)
+        session.delete(envio)
+
+
+def remover_documento(session: Session, processo: Processo, documento: Documento):
+    """Tira o documento do processo. Se era o principal, o mais recente que sobrou assume."""
+    chave = documento.chave
+    session.delete(documento)
+    session.flush()
+
+    if processo.arquivo_pdf == chave:
+        restante = session.exec(
+            select(Documento).where(Documento.processo_id == processo.id).order_by(Documento.enviado_em.desc())
+        ).first()
+        processo.arquivo_pdf = restante.chave if restante else None
+        session.add(processo)
+        session.flush()
+
+    apagar_se_orfao(session, chave)
+    session.commit()
+
+
+class _SaidaZip(io.RawIOBase):
+    """Destino do ZipFile que só acumula o que foi escrito desde a última retirada."""
+
+    def __init__(self):
+        self._pendente = bytearray()
+        self._posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._pendente += dados
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def retirar(self) -> bytes:
+        dados = bytes(self._pendente)
+        self._pendente.clear()
+        return dados
+
+
+def _nomes_unicos(itens: list) -> list:
+    vistos = set()
+    resultado = []
+    for numero, (nome, chave) in enumerate(itens, 1):
+        nome = (nome or chave.rsplit("/", 1)[-1]).replace("/", "_")
+        if nome in vistos:
+            nome = f"{numero:02d} - {nome}"
+        vistos.add(nome)
+        resultado.append((nome, chave))
+    return resultado
+
+
+def gerar_zip(itens: list):
+    """
+    Gera o ZIP de [(nome, chave)] em pedaços, lendo cada objeto do armazenamento em blocos:
+    a memória usada não depende do tamanho do processo. PDFs já são comprimidos, então vão sem compressão.
+    """
+    armazenamento = obter_armazenamento()
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, mode="w", compression=zipfile.ZIP_STORED) as pacote:
+        for nome, chave in _nomes_unicos(itens):
+            try:
+                with closing(armazenamento.abrir(chave)) as origem, pacote.open(nome, mode="w", force_zip64=True) as destino:
+                    for bloco in iter(lambda: origem.read(TAMANHO_BLOCO_ZIP), b""):
+                        destino.write(bloco)
+                        yield saida.retirar()
+            except Exception as e:
+                print(f"Erro ao colocar {chave} no ZIP: {e}")
+                pacote.writestr(f"{nome}.erro.txt", f"Não foi possível incluir este arquivo: {e}")
+            yield saida.retirar()
+    yield saida.retirar()
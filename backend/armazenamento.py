@@ -0,0 +1,331 @@
+import os
+import hmac
+import base64
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from dotenv import load_dotenv
+
+from security import SECRET_KEY
+
+load_dotenv()
+
+# Onde ficam os anexos. ARMAZENAMENTO escolhe:
+#   "s3"    - bucket da AWS (padrão)
+#   "local" - pasta no próprio servidor (instalação num servidor só, ou testes sem AWS)
+
+ARMAZENAMENTO = os.getenv("ARMAZENAMENTO", "s3").lower()
+ARMAZENAMENTO_PASTA = os.getenv(
+    "ARMAZENAMENTO_PASTA",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+)
+# Endereço público da API, usado nos links de download do armazenamento local
+API_URL_PUBLICA = os.getenv("API_URL_PUBLICA", "http://localhost:8000").rstrip("/")
+
+# Links de download: assinados com LINK_VALIDADE e reaproveitados enquanto ainda valem mais que LINK_MARGEM
+LINK_VALIDADE = int(os.getenv("LINK_VALIDADE", "3600"))  # segundos
+LINK_MARGEM = int(os.getenv("LINK_MARGEM", "600"))  # segundos mínimos de validade de um link reaproveitado
+LINK_CACHE_MAX_ITENS = int(os.getenv("LINK_CACHE_MAX_ITENS", "5000"))
+
+# Upload em partes (multipart) para o S3: tamanho de cada parte e quantas sobem ao mesmo tempo
+UPLOAD_PARTE_MB = int(os.getenv("UPLOAD_PARTE_MB", "8"))
+UPLOAD_CONCORRENCIA = int(os.getenv("UPLOAD_CONCORRENCIA", "4"))
+
+TRANSFERENCIA = TransferConfig(
+    multipart_threshold=UPLOAD_PARTE_MB * 1024 * 1024,
+    multipart_chunksize=UPLOAD_PARTE_MB * 1024 * 1024,
+    max_concurrency=UPLOAD_CONCORRENCIA,
+    use_threads=True
+)
+
+
+def nome_bucket():
+    """Bucket configurado no .env (lido na hora, como no resto do sistema)."""
+    return os.getenv("AWS_BUCKET_NAME")
+
+
+class ArmazenamentoS3:
+    nome = "s3"
+
+    def __init__(self):
+        # Cliente único do S3, compartilhado pela API e pelos módulos de apoio
+        self.cliente = boto3.client('s3',
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_REGION"),
+            config=Config(signature_version='s3v4')
+        )
+
+    def enviar(self, arquivo, chave: str):
+        """Aceita também fluxos sem seek: o boto3 vai lendo e mandando as partes em paralelo."""
+        self.cliente.upload_fileobj(arquivo, nome_bucket(), chave, Config=TRANSFERENCIA)
+
+    def mover(self, origem: str, destino: str):
+        # Cópia feita pelo próprio S3 (em partes, se for grande), sem os bytes passarem por aqui
+        self.cliente.copy({"Bucket": nome_bucket(), "Key": origem}, nome_bucket(), destino, Config=TRANSFERENCIA)
+        self.apagar(origem)
+
+    def ler(self, chave: str):
+        """Devolve (bytes, etag)."""
+        resposta = self.cliente.get_object(Bucket=nome_bucket(), Key=chave)
+        return resposta['Body'].read(), (resposta.get("ETag") or "").strip('"') or None
+
+    def caminho_local(self, chave: str):
+        return None
+
+    def abrir(self, chave: str):
+        """Corpo do objeto para ler em blocos (read), sem baixar tudo de uma vez."""
+        return self.cliente.get_object(Bucket=nome_bucket(), Key=chave)["Body"]
+
+    def apagar(self, chave: str):
+        self.cliente.delete_object(Bucket=nome_bucket(), Key=chave)
+
+    def apagar_varios(self, chaves: list) -> dict:
+        """Apaga em lotes de até 1000 chaves (delete_objects). Devolve {chave: erro} do que falhou."""
+        erros = {}
+        for i in range(0, len(chaves), 1000):
+            lote = chaves[i:i + 1000]
+            try:
+                resposta = self.cliente.delete_objects(
+                    Bucket=nome_bucket(),
+                    Delete={"Objects": [{"Key": chave} for chave in lote], "Quiet": True}
+                )
+            except Exception as e:
+                erros.update({chave: str(e) for chave in lote})
+                continue
+            for erro in resposta.get("Errors", []):
+                erros[erro["Key"]] = f"{erro.get('Code')}: {erro.get('Message')}"
+        return erros
+
+    def listar(self, prefixo: str):
+        """(chave, modificado_em em UTC) de cada objeto com o prefixo."""
+        paginas = self.cliente.get_paginator("list_objects_v2").paginate(Bucket=nome_bucket(), Prefix=prefixo)
+        for pagina in paginas:
+            for objeto in pagina.get("Contents", []):
+                yield objeto["Key"], objeto["LastModified"].astimezone(timezone.utc).replace(tzinfo=None)
+
+    def link_download(self, chave: str, expira_em: int = 3600) -> str:
+        return self.cliente.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": nome_bucket(), "Key": chave},
+            ExpiresIn=expira_em
+        )
+
+    def link_envio(self, chave: str, tamanho: int, hash_conteudo: str, expira_em: int = 900) -> dict:
+        """
+        URL pré-assinada para o cliente mandar o PDF direto ao S3 (PUT), sem passar pela API.
+        Tamanho e SHA-256 entram na assinatura: o S3 recusa um corpo diferente do declarado.
+        """
+        checksum = base64.b64encode(bytes.fromhex(hash_conteudo)).decode()
+        url = self.cliente.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": nome_bucket(),
+                "Key": chave,
+                "ContentLength": tamanho,
+                "ContentType": "application/pdf",
+                "ChecksumSHA256": checksum
+            },
+            ExpiresIn=expira_em
+        )
+        return {
+            "url": url,
+            "metodo": "PUT",
+            "cabecalhos": {"Content-Type": "application/pdf", "x-amz-checksum-sha256": checksum}
+        }
+
+    def conferir(self, chave: str):
+        """{"tamanho", "sha256"} do objeto guardado, ou None se ele não existe."""
+        try:
+            cabecalho = self.cliente.head_object(Bucket=nome_bucket(), Key=chave, ChecksumMode="ENABLED")
+        except self.cliente.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        checksum = cabecalho.get("ChecksumSHA256")
+        if checksum and "-" not in checksum:
+            sha256 = base64.b64decode(checksum).hex()
+        else:
+            # Objeto enviado sem checksum: o hash é calculado lendo o objeto em blocos
+            hasher = hashlib.sha256()
+            corpo = self.cliente.get_object(Bucket=nome_bucket(), Key=chave)["Body"]
+            for bloco in corpo.iter_chunks(1024 * 1024):
+                hasher.update(bloco)
+            sha256 = hasher.hexdigest()
+        return {"tamanho": cabecalho["ContentLength"], "sha256": sha256}
+
+
+class ArmazenamentoLocal:
+    """
+    Arquivos numa pasta do servidor. A extração lê o PDF direto do disco (mmap, sem copiar para a memória)
+    e o download sai por um link assinado servido pela própria API (FileResponse).
+    """
+    nome = "local"
+
+    def __init__(self, pasta: str = ARMAZENAMENTO_PASTA):
+        self.pasta = os.path.abspath(pasta)
+        os.makedirs(self.pasta, exist_ok=True)
+
+    def caminho_local(self, chave: str) -> str:
+        caminho = os.path.abspath(os.path.join(self.pasta, chave))
+        # A chave nunca pode sair da pasta (ex: "../../etc/passwd")
+        if os.path.commonpath([caminho, self.pasta]) != self.pasta:
+            raise ValueError(f"Chave inválida: {chave}")
+        return caminho
+
+    def enviar(self, arquivo, chave: str):
+        destino = self.caminho_local(chave)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Grava num temporário da mesma pasta e troca de uma vez: ninguém lê arquivo pela metade
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(destino), suffix=".tmp")
+        try:
+            with os.fdopen(descritor, "wb") as saida:
+                shutil.copyfileobj(arquivo, saida, 1024 * 1024)
+            os.replace(temporario, destino)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def ler(self, chave: str):
+        with open(self.caminho_local(chave), "rb") as f:
+            return f.read(), None
+
+    def abrir(self, chave: str):
+        return open(self.caminho_local(chave), "rb")
+
+    def mover(self, origem: str, destino: str):
+        caminho = self.caminho_local(destino)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        os.replace(self.caminho_local(origem), caminho)
+
+    def apagar(self, chave: str):
+        try:
+            os.remove(self.caminho_local(chave))
+        except FileNotFoundError:
+            pass
+
+    def apagar_varios(self, chaves: list) -> dict:
+        erros = {}
+        for chave in chaves:
+            try:
+                self.apagar(chave)
+            except Exception as e:
+                erros[chave] = str(e)
+        return erros
+
+    def listar(self, prefixo: str):
+        pasta = self.caminho_local(prefixo)
+        for raiz, _, arquivos in os.walk(pasta):
+            for nome in arquivos:
+                caminho = os.path.join(raiz, nome)
+                chave = os.path.relpath(caminho, self.pasta).replace(os.sep, "/")
+                yield chave, datetime.utcfromtimestamp(os.path.getmtime(caminho))
+
+    def link_envio(self, chave: str, tamanho: int, hash_conteudo: str, expira_em: int = 900) -> dict:
+        # Não há para onde mandar direto: no armazenamento local o upload passa pela API (/anexo/fluxo)
+        raise NotImplementedError("Upload direto só existe no armazenamento S3")
+
+    def conferir(self, chave: str):
+        caminho = self.caminho_local(chave)
+        if not os.path.exists(caminho):
+            return None
+        hasher = hashlib.sha256()
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(bloco)
+        return {"tamanho": os.path.getsize(caminho), "sha256": hasher.hexdigest()}
+
+    def link_download(self, chave: str, expira_em: int = 3600) -> str:
+        expira = int(time.time()) + expira_em
+        return f"{API_URL_PUBLICA}/arquivos/{quote(chave)}?expira={expira}&assinatura={assinar_link(chave, expira)}"
+
+
+def assinar_link(chave: str, expira: int) -> str:
+    return hmac.new(SECRET_KEY.encode(), f"{chave}:{expira}".encode(), hashlib.sha256).hexdigest()
+
+
+def conferir_link(chave: str, expira: int, assinatura: str) -> bool:
+    return expira >= time.time() and hmac.compare_digest(assinar_link(chave, expira), assinatura or "")
+
+
+ARMAZENAMENTOS = {
+    "s3": ArmazenamentoS3,
+    "local": ArmazenamentoLocal,
+}
+
+_armazenamento = None
+_trava = threading.Lock()
+
+
+def obter_armazenamento():
+    """Instancia o armazenamento escolhido em ARMAZENAMENTO uma única vez."""
+    global _armazenamento
+    if _armazenamento is None:
+        with _trava:
+            if _armazenamento is None:
+                if ARMAZENAMENTO not in ARMAZENAMENTOS:
+                    raise RuntimeError(f"ARMAZENAMENTO desconhecido: {ARMAZENAMENTO}")
+                _armazenamento = ARMAZENAMENTOS[ARMAZENAMENTO]()
+    return _armazenamento
+
+
+_links = OrderedDict()  # (armazenamento, bucket, chave, usuario) -> (url, expira_em)
+_trava_links = threading.Lock()
+
+
+def link_download(chave: str, usuario_id: int = None) -> tuple:
+    """
+    Link de download com cache: a mesma chave, para o mesmo usuário, devolve o link já assinado
+    enquanto ele ainda valer mais que LINK_MARGEM segundos. Devolve (url, segundos de validade).
+    """
+    armazenamento = obter_armazenamento()
+    chave_cache = (armazenamento.nome, nome_bucket(), chave, usuario_id)
+    agora = time.time()
+
+    with _trava_links:
+        item = _links.get(chave_cache)
+        if item and item[1] - agora > LINK_MARGEM:
+            _links.move_to_end(chave_cache)
+            return item[0], int(item[1] - agora)
+
+    url = armazenamento.link_download(chave, expira_em=LINK_VALIDADE)
+    with _trava_links:
+        _links[chave_cache] = (url, agora + LINK_VALIDADE)
+        _links.move_to_end(chave_cache)
+        while len(_links) > LINK_CACHE_MAX_ITENS:
+            _links.popitem(last=False)
+    return url, LINK_VALIDADE
+
+
+def descartar_links(chave: str):
+    """Esquece os links de um objeto apagado."""
+    with _trava_links:
+        for chave_cache in [c for c in _links if c[2] == chave]:
+            del _links[chave_cache]
+
+
+# Arquivos enviados pela API ficam num caminho derivado do conteúdo (SHA-256):
+# o mesmo PDF anexado em vários processos é um único objeto no bucket.
+PREFIXO_CONTEUDO = "conteudo/"
+# Uploads em andamento, antes de o hash ser conhecido
+PREFIXO_RECEBENDO = "recebendo/"
+
+
+def chave_conteudo(hash_conteudo: str) -> str:
+    return f"{PREFIXO_CONTEUDO}{hash_conteudo}.pdf"
+
+
+def hash_da_chave(chave: str):
+    """O hash de uma chave de conteúdo, ou None para anexos antigos (<processo>/<nome do arquivo>)."""
+    if chave and chave.startswith(PREFIXO_CONTEUDO) and chave.endswith(".pdf"):
+        return chave[len(PREFIXO_CONTEUDO):-len(".pdf")]
+    return None
@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from fastapi import Depends, HTTPException
+from sqlmodel import Session, select
+
+from database import engine
+from models import Usuario, UsuarioAtual
+from security import oauth2_scheme, decodificar_token
+
+# Usuário da requisição como dependência do FastAPI (Depends(obter_usuario_atual)).
+# O token traz o id ("uid"), e o registro fica num cache curto em memória:
+# a maioria das requisições não consulta o banco só para saber quem é o usuário.
+
+USUARIOS_CACHE_TTL = int(os.getenv("USUARIOS_CACHE_TTL", "60"))  # segundos
+USUARIOS_CACHE_MAX_ITENS = int(os.getenv("USUARIOS_CACHE_MAX_ITENS", "1000"))
+
+_cache = OrderedDict()  # id -> (UsuarioAtual, expira_em)
+_trava = threading.Lock()
+
+
+def _do_cache(usuario_id: int):
+    agora = time.time()
+    with _trava:
+        item = _cache.get(usuario_id)
+        if item and item[1] > agora:
+            _cache.move_to_end(usuario_id)
+            return item[0]
+        if item:
+            del _cache[usuario_id]
+    return None
+
+
+def _guardar(usuario: UsuarioAtual):
+    with _trava:
+        _cache[usuario.id] = (usuario, time.time() + USUARIOS_CACHE_TTL)
+        _cache.move_to_end(usuario.id)
+        while len(_cache) > USUARIOS_CACHE_MAX_ITENS:
+            _cache.popitem(last=False)
+
+
+def esquecer_usuario(usuario_id: int = None):
+    """Chamar sempre que o registro do usuário mudar (ex: 2FA ativado). Sem id, esquece todos."""
+    with _trava:
+        if usuario_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(usuario_id, None)
+
+
+def obter_usuario_atual(token: str = Depends(oauth2_scheme)) -> UsuarioAtual:
+    payload = decodificar_token(token)
+    if not payload or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Token inválido ou expirado")
+
+    email, usuario_id = payload["sub"], payload.get("uid")
+    usuario = _do_cache(usuario_id) if usuario_id else None
+    if usuario is None:
+        with Session(engine) as session:
+            if usuario_id:
+                registro = session.get(Usuario, usuario_id)
+            else:
+                # Token emitido antes de o id entrar no token
+                registro = session.exec(select(Usuario).where(Usuario.email == email)).first()
+            if registro:
+                usuario = UsuarioAtual(id=registro.id, email=registro.email, is_2fa_enabled=registro.is_2fa_enabled)
+
+        if usuario is None:
+            raise HTTPException(status_code=401, detail="Usuário não encontrado")
+        _guardar(usuario)
+
+    # O id do token tem que ser da mesma conta do e-mail
+    if usuario.email != email:
+        raise HTTPException(status_code=401, detail="Token inválido ou expirado")
+    return usuario
@@ -0,0 +1,101 @@
+import os
+import time
+import argparse
+import tempfile
+import threading
+from sqlalchemy import text
+from sqlmodel import create_engine
+
+from database import criar_engine, DATABASE_URL
+
+# Escritas concorrentes no banco, com o engine padrão (como era antes) e com o perfil de database.py.
+# Cada thread faz transações curtas de INSERT, como as rotas do uvicorn. Mede escritas/s e quantas
+# falharam (ex: "database is locked" no SQLite).
+# Uso: python bench_banco.py [--threads 8] [--escritas 200] [--url sqlite:///outro.db]
+# Sem --url, usa um SQLite temporário. Com Postgres, a tabela bench_escrita é criada e apagada no fim.
+
+
+def engine_padrao(url: str):
+    """Como database.py criava o engine antes dos perfis."""
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url)
+
+
+def medir(engine, threads: int, escritas: int) -> dict:
+    with engine.begin() as conexao:
+        conexao.execute(text("DROP TABLE IF EXISTS bench_escrita"))
+        conexao.execute(text("CREATE TABLE bench_escrita (id INTEGER PRIMARY KEY, thread INTEGER, texto VARCHAR(200))"))
+
+    erros = []
+    trava = threading.Lock()
+    proximo_id = iter(range(1, threads * escritas + 1))
+
+    def escrever(numero):
+        for _ in range(escritas):
+            with trava:
+                id_linha = next(proximo_id)
+            try:
+                with engine.begin() as conexao:
+                    conexao.execute(
+                        text("INSERT INTO bench_escrita (id, thread, texto) VALUES (:id, :thread, :texto)"),
+                        {"id": id_linha, "thread": numero, "texto": "x" * 150}
+                    )
+            except Exception as e:
+                with trava:
+                    erros.append(str(e).splitlines()[0])
+
+    trabalhadores = [threading.Thread(target=escrever, args=(n,)) for n in range(threads)]
+    inicio = time.perf_counter()
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    segundos = time.perf_counter() - inicio
+
+    with engine.begin() as conexao:
+        gravadas = conexao.execute(text("SELECT COUNT(*) FROM bench_escrita")).scalar()
+        conexao.execute(text("DROP TABLE bench_escrita"))
+    engine.dispose()
+
+    return {
+        "gravadas": gravadas,
+        "erros": len(erros),
+        "primeiro_erro": erros[0] if erros else None,
+        "segundos": round(segundos, 2),
+        "escritas_por_segundo": round(gravadas / segundos, 1) if segundos else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Escritas concorrentes: engine padrão x perfil de database.py.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--escritas", type=int, default=200, help="Transações por thread")
+    parser.add_argument("--url", help=f"Banco a testar (o da aplicação é {DATABASE_URL})")
+    args = parser.parse_args()
+
+    pasta = None
+    url = args.url
+    if not url:
+        pasta = tempfile.TemporaryDirectory(prefix="bench-banco-")
+        url = f"sqlite:///{os.path.join(pasta.name, 'bench.db')}"
+
+    print(f"Banco: {url} | {args.threads} threads x {args.escritas} transações")
+    print(f"{'engine':<8} {'gravadas':>9} {'erros':>6} {'segundos':>9} {'escritas/s':>11}")
+    for nome, engine in (("padrao", engine_padrao(url)), ("perfil", criar_engine(url))):
+        # Cada engine começa de um arquivo novo: o modo WAL fica gravado no arquivo do SQLite
+        if pasta:
+            for sufixo in ("", "-wal", "-shm"):
+                caminho = os.path.join(pasta.name, "bench.db" + sufixo)
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+        resultado = medir(engine, args.threads, args.escritas)
+        print(
+            f"{nome:<8} {resultado['gravadas']:>9} {resultado['erros']:>6} "
+            f"{resultado['segundos']:>9.2f} {resultado['escritas_por_segundo']:>11.1f}"
+        )
+        if resultado["primeiro_erro"]:
+            print(f"         primeiro erro: {resultado['primeiro_erro']}")
+
+    if pasta:
+        pasta.cleanup()
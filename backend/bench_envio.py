@@ -0,0 +1,78 @@
+import os
+import io
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+
+from armazenamento import obter_armazenamento, ARMAZENAMENTO, UPLOAD_PARTE_MB, UPLOAD_CONCORRENCIA, PREFIXO_RECEBENDO
+from envios import receber_arquivo, receber_fluxo
+
+# Vazão dos uploads no armazenamento configurado (ARMAZENAMENTO=local ou s3), por tamanho de arquivo:
+#   inteiro - como era antes: o corpo todo é guardado (memória/disco) e só depois enviado
+#   fluxo   - receber_fluxo(): as partes vão ao armazenamento enquanto o corpo chega
+# Uso: python bench_envio.py [--tamanhos 8,32,128] [--repeticoes 3]
+# Os objetos criados ficam em recebendo/ e são apagados no fim.
+
+TAMANHO_PARTE_REDE = 64 * 1024  # pedaços em que o corpo chega pela rede
+
+
+def _conteudo(megas: int) -> bytes:
+    # Bytes aleatórios: compressão ou deduplicação no caminho não melhoram a medida
+    return os.urandom(megas * 1024 * 1024)
+
+
+async def _partes(conteudo: bytes):
+    for inicio in range(0, len(conteudo), TAMANHO_PARTE_REDE):
+        yield conteudo[inicio:inicio + TAMANHO_PARTE_REDE]
+        await asyncio.sleep(0)
+
+
+def enviar_inteiro(conteudo: bytes) -> str:
+    chave = f"{PREFIXO_RECEBENDO}bench-{uuid.uuid4().hex}.pdf"
+    _, _, temporario = receber_arquivo(io.BytesIO(conteudo))
+    with temporario:
+        obter_armazenamento().enviar(temporario, chave)
+    return chave
+
+
+def enviar_fluxo(conteudo: bytes) -> str:
+    _, _, chave = asyncio.run(receber_fluxo(_partes(conteudo)))
+    return chave
+
+
+def medir(funcao, conteudo: bytes, repeticoes: int, chaves: list) -> float:
+    """Melhor tempo entre as repetições, em segundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        chaves.append(funcao(conteudo))
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede a vazão dos uploads (MB/s) no armazenamento configurado.")
+    parser.add_argument("--tamanhos", default="8,32,128", help="Tamanhos dos arquivos em MB, separados por vírgula")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        tamanhos = [int(t) for t in args.tamanhos.split(",") if t.strip()]
+    except ValueError:
+        sys.exit("--tamanhos deve ser uma lista de números (MB).")
+
+    print(f"Armazenamento: {ARMAZENAMENTO} | partes de {UPLOAD_PARTE_MB} MB, {UPLOAD_CONCORRENCIA} em paralelo")
+    print(f"{'MB':>6} {'modo':<8} {'segundos':>9} {'MB/s':>8} {'ms/MB':>8}")
+    chaves = []
+    try:
+        for megas in tamanhos:
+            conteudo = _conteudo(megas)
+            for modo, funcao in (("inteiro", enviar_inteiro), ("fluxo", enviar_fluxo)):
+                segundos = medir(funcao, conteudo, args.repeticoes, chaves)
+                print(f"{megas:>6} {modo:<8} {segundos:>9.2f} {megas / segundos:>8.1f} {1000 * segundos / megas:>8.1f}")
+    finally:
+        erros = obter_armazenamento().apagar_varios(chaves)
+        if erros:
+            print(f"Não foi possível apagar {len(erros)} objeto(s) de teste em {PREFIXO_RECEBENDO}.")
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+from llm import estimar_tokens
+
+# Busca local (BM25) nos trechos do PDF, para mandar à IA só o que interessa à pergunta.
+
+CHAT_TAMANHO_TRECHO = int(os.getenv("CHAT_TAMANHO_TRECHO", "1200"))  # caracteres por trecho
+CHAT_SOBREPOSICAO_TRECHO = int(os.getenv("CHAT_SOBREPOSICAO_TRECHO", "200"))
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", "8"))
+CHAT_ORCAMENTO_TOKENS = int(os.getenv("CHAT_ORCAMENTO_TOKENS", "4000"))
+INDICES_EM_MEMORIA = int(os.getenv("INDICES_EM_MEMORIA", "32"))
+
+STOPWORDS = {
+    "a", "ao", "aos", "as", "ate", "com", "como", "da", "das", "de", "do", "dos", "e", "ela", "elas",
+    "ele", "eles", "em", "entre", "era", "essa", "esse", "esta", "este", "eu", "foi", "ha", "isso",
+    "isto", "ja", "la", "lhe", "mais", "mas", "me", "mesmo", "meu", "na", "nas", "nao", "nem", "no",
+    "nos", "num", "numa", "o", "os", "ou", "para", "pela", "pelas", "pelo", "pelos", "por", "qual",
+    "quais", "quando", "que", "quem", "se", "sem", "ser", "seu", "seus", "so", "sua", "suas", "tem",
+    "ter", "um", "uma", "umas", "uns", "voce", "sao", "sobre", "foram", "tambem", "onde", "houve",
+}
+
+# Plurais trocados pela forma singular numa "radicalização" leve (tudo já sem acento)
+PLURAIS = (("oes", "ao"), ("aes", "ao"), ("ores", "or"), ("ais", "al"), ("eis", "el"), ("ns", "m"))
+
+_RE_PALAVRA = re.compile(r"\w+")
+
+
+def _sem_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def _radical(palavra: str) -> str:
+    """Junta singular/plural, masculino/feminino e advérbios em -mente (ex: partes/parte, autora/autor)."""
+    if len(palavra) <= 3 or palavra.isdigit():
+        return palavra
+    for sufixo, troca in PLURAIS:
+        if palavra.endswith(sufixo):
+            palavra = palavra[:-len(sufixo)] + troca
+            break
+    else:
+        if palavra.endswith("s") and not palavra.endswith("ss"):
+            palavra = palavra[:-1]
+    if palavra.endswith("mente") and len(palavra) > 7:
+        palavra = palavra[:-5]
+    if len(palavra) > 3 and palavra[-1] in "aeo":
+        palavra = palavra[:-1]
+    return palavra
+
+
+def normalizar(texto: str) -> list:
+    """Minúsculas, sem acento, sem stopwords e com radical leve."""
+    palavras = _RE_PALAVRA.findall(_sem_acentos(texto.lower()))
+    return [_radical(p) for p in palavras if p not in STOPWORDS and (len(p) > 1 or p.isdigit())]
+
+
+def dividir_trechos(paginas: list) -> list:
+    """Quebra cada página em janelas sobrepostas. Devolve [(numero_pagina, texto), ...]."""
+    passo = max(CHAT_TAMANHO_TRECHO - CHAT_SOBREPOSICAO_TRECHO, 1)
+    trechos = []
+    for numero, texto in enumerate(paginas, start=1):
+        texto = texto.strip()
+        if not texto:
+            continue
+        for inicio in range(0, len(texto), passo):
+            trechos.append((numero, texto[inicio:inicio + CHAT_TAMANHO_TRECHO]))
+            if inicio + CHAT_TAMANHO_TRECHO >= len(texto):
+                break
+    return trechos
+
+
+class IndiceBM25:
+    def __init__(self, trechos: list, k1: float = 1.5, b: float = 0.75):
+        self.trechos = trechos
+        self.k1 = k1
+        self.b = b
+        self.frequencias = [Counter(normalizar(texto)) for _, texto in trechos]
+        self.tamanhos = [sum(f.values()) for f in self.frequencias]
+        self.tamanho_medio = (sum(self.tamanhos) / len(self.tamanhos)) if self.tamanhos else 0
+
+        documentos_com_termo = Counter()
+        for frequencia in self.frequencias:
+            documentos_com_termo.update(frequencia.keys())
+        total = len(trechos)
+        self.idf = {
+            termo: math.log(1 + (total - n + 0.5) / (n + 0.5))
+            for termo, n in documentos_com_termo.items()
+        }
+
+    def buscar(self, consulta: str, top_k: int) -> list:
+        """Devolve [(pontuação, índice_do_trecho), ...] do mais relevante para o menos."""
+        termos = [t for t in set(normalizar(consulta)) if t in self.idf]
+        if not termos:
+            return []
+
+        pontuacoes = []
+        for i, frequencia in enumerate(self.frequencias):
+            pontos = 0.0
+            normalizacao = self.k1 * (1 - self.b + self.b * self.tamanhos[i] / (self.tamanho_medio or 1))
+            for termo in termos:
+                f = frequencia.get(termo)
+                if f:
+                    pontos += self.idf[termo] * f * (self.k1 + 1) / (f + normalizacao)
+            if pontos > 0:
+                pontuacoes.append((pontos, i))
+
+        pontuacoes.sort(reverse=True)
+        return pontuacoes[:top_k]
+
+
+_indices = OrderedDict()
+_trava_indices = threading.Lock()
+
+
+def obter_indice(documento) -> IndiceBM25:
+    """Índice do documento, guardado em memória (LRU) pelo hash do conteúdo."""
+    chave = documento.hash_conteudo or documento.chave
+    with _trava_indices:
+        indice = _indices.get(chave)
+        if indice is not None:
+            _indices.move_to_end(chave)
+            return indice
+
+    indice = IndiceBM25(dividir_trechos(json.loads(documento.paginas)))
+
+    with _trava_indices:
+        _indices[chave] = indice
+        while len(_indices) > INDICES_EM_MEMORIA:
+            _indices.popitem(last=False)
+    return indice
+
+
+def selecionar_contexto(documento, pergunta: str, top_k=None, orcamento_tokens=None) -> dict:
+    """
+    Escolhe os trechos mais relevantes para a pergunta, sem passar do orçamento de tokens.
+    Se a pergunta não tiver termos do documento (ex: "resuma"), usa o começo do processo.
+    Os trechos voltam na ordem de leitura, marcados com o número da página.
+    """
+    top_k = CHAT_TOP_K if top_k is None else top_k
+    orcamento_tokens = CHAT_ORCAMENTO_TOKENS if orcamento_tokens is None else orcamento_tokens
+
+    indice = obter_indice(documento)
+    encontrados = [i for _, i in indice.buscar(pergunta or "", top_k)]
+    if not encontrados:
+        encontrados = list(range(min(top_k, len(indice.trechos))))
+
+    escolhidos = []
+    tokens = 0
+    for i in encontrados:
+        custo = estimar_tokens(indice.trechos[i][1])
+        if escolhidos and tokens + custo > orcamento_tokens:
+            break
+        escolhidos.append(i)
+        tokens += custo
+
+    escolhidos.sort()
+    texto = "\n\n".join(f"[Página {indice.trechos[i][0]}]\n{indice.trechos[i][1]}" for i in escolhidos)
+
+    return {
+        "texto": texto,
+        "tokens_estimados": tokens,
+        "paginas": sorted({indice.trechos[i][0] for i in escolhidos}),
+        "total_trechos": len(indice.trechos),
+    }
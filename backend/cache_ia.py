@@ -0,0 +1,213 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from database import engine
+from models import RespostaIACache
+from llm import gerar, gerar_async, gerar_stream_async, modelo_padrao
+
+# Cache das respostas da IA, na frente de toda chamada ao provedor (llm.py).
+# Chave: (modelo, template do prompt, hash do documento, pergunta).
+# Ao mudar o texto de um prompt, mude também o id do template (ex: "resumo_processo:v2").
+
+CACHE_IA_MAX_ITENS = int(os.getenv("CACHE_IA_MAX_ITENS", "512"))
+CACHE_IA_TTL = int(os.getenv("CACHE_IA_TTL", str(24 * 3600)))  # segundos
+CACHE_IA_BANCO = os.getenv("CACHE_IA_BANCO", "0") == "1"  # segunda camada no banco (SQLite/Postgres)
+
+_memoria = OrderedDict()  # chave -> (hash_documento, resposta, latencia, expira_em)
+_trava = threading.Lock()
+
+estatisticas = {
+    "acertos_memoria": 0,
+    "acertos_banco": 0,
+    "falhas": 0,
+    "segundos_economizados": 0.0,
+}
+
+
+def _chave(modelo: str, template: str, hash_documento: str, pergunta: str) -> str:
+    pergunta = " ".join((pergunta or "").lower().split())
+    bruto = "\x1f".join([modelo, template, hash_documento or "", pergunta])
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+def _contar(campo: str, valor=1):
+    with _trava:
+        estatisticas[campo] += valor
+
+
+def _guardar_memoria(chave, hash_documento, resposta, latencia, expira_em):
+    with _trava:
+        _memoria[chave] = (hash_documento, resposta, latencia, expira_em)
+        _memoria.move_to_end(chave)
+        while len(_memoria) > CACHE_IA_MAX_ITENS:
+            _memoria.popitem(last=False)
+
+
+def buscar(chave: str):
+    """Devolve a resposta guardada ou None. Procura na memória e depois no banco."""
+    agora = time.time()
+    with _trava:
+        item = _memoria.get(chave)
+        if item and item[3] > agora:
+            _memoria.move_to_end(chave)
+            estatisticas["acertos_memoria"] += 1
+            estatisticas["segundos_economizados"] += item[2]
+            return item[1]
+        if item:
+            del _memoria[chave]
+
+    if CACHE_IA_BANCO:
+        with Session(engine) as session:
+            linha = session.exec(select(RespostaIACache).where(RespostaIACache.chave == chave)).first()
+            if linha and linha.expira_em > datetime.utcnow():
+                restante = (linha.expira_em - datetime.utcnow()).total_seconds()
+                _guardar_memoria(chave, linha.hash_documento, linha.resposta, linha.latencia, agora + restante)
+                _contar("acertos_banco")
+                _contar("segundos_economizados", linha.latencia)
+                return linha.resposta
+
+    _contar("falhas")
+    return None
+
+
+def guardar(chave: str, resposta: str, latencia: float, modelo: str, template: str, hash_documento: str):
+    _guardar_memoria(chave, hash_documento, resposta, latencia, time.time() + CACHE_IA_TTL)
+
+    if CACHE_IA_BANCO:
+        with Session(engine) as session:
+            linha = session.exec(select(RespostaIACache).where(RespostaIACache.chave == chave)).first()
+            linha = linha or RespostaIACache(chave=chave, template=template, modelo=modelo, resposta="", expira_em=datetime.utcnow())
+            linha.hash_documento = hash_documento
+            linha.resposta = resposta
+            linha.latencia = latencia
+            linha.expira_em = datetime.utcnow() + timedelta(seconds=CACHE_IA_TTL)
+            try:
+                session.add(linha)
+                session.commit()
+            except IntegrityError:
+                # Outro worker gravou a mesma resposta ao mesmo tempo
+                session.rollback()
+
+
+def invalidar_respostas(hash_documento: str):
+    """Esquece todas as respostas geradas a partir deste documento (ex: anexo trocado)."""
+    if not hash_documento:
+        return
+    with _trava:
+        for chave in [c for c, item in _memoria.items() if item[0] == hash_documento]:
+            del _memoria[chave]
+
+    if CACHE_IA_BANCO:
+        with Session(engine) as session:
+            for linha in session.exec(select(RespostaIACache).where(RespostaIACache.hash_documento == hash_documento)).all():
+                session.delete(linha)
+            session.commit()
+
+
+def obter_estatisticas() -> dict:
+    with _trava:
+        dados = dict(estatisticas)
+        dados["itens_memoria"] = len(_memoria)
+    consultas = dados["acertos_memoria"] + dados["acertos_banco"] + dados["falhas"]
+    dados["taxa_acerto"] = round((dados["acertos_memoria"] + dados["acertos_banco"]) / consultas, 3) if consultas else 0.0
+    dados["segundos_economizados"] = round(dados["segundos_economizados"], 2)
+    return dados
+
+
+def descartar(template: str, hash_documento: str, pergunta: str = "", modelo: str = None):
+    """Tira do cache uma resposta que não serviu (ex: JSON inválido), para não ser devolvida de novo."""
+    chave = _chave(modelo or modelo_padrao(), template, hash_documento, pergunta)
+    with _trava:
+        _memoria.pop(chave, None)
+
+    if CACHE_IA_BANCO:
+        with Session(engine) as session:
+            for linha in session.exec(select(RespostaIACache).where(RespostaIACache.chave == chave)).all():
+                session.delete(linha)
+            session.commit()
+
+
+def gerar_texto(prompt: str, template: str, hash_documento: str, pergunta: str = "", modelo: str = None, esquema=None) -> str:
+    """Igual a llm.gerar(prompt), mas responde do cache quando a mesma pergunta já foi feita."""
+    return gerar_texto_com_origem(prompt, template, hash_documento, pergunta, modelo, esquema)[0]
+
+
+def gerar_texto_com_origem(prompt: str, template: str, hash_documento: str, pergunta: str = "", modelo: str = None, esquema=None):
+    """Como gerar_texto, devolvendo (texto, veio_do_cache)."""
+    modelo = modelo or modelo_padrao()
+    chave = _chave(modelo, template, hash_documento, pergunta)
+
+    resposta = buscar(chave)
+    if resposta is not None:
+        return resposta, True
+
+    inicio = time.perf_counter()
+    resposta = gerar(prompt, modelo=modelo, esquema=esquema)
+    if resposta:
+        guardar(chave, resposta, time.perf_counter() - inicio, modelo, template, hash_documento)
+    return resposta, False
+
+
+async def gerar_texto_async(prompt: str, template: str, hash_documento: str, pergunta: str = "", modelo: str = None, esquema=None) -> str:
+    modelo = modelo or modelo_padrao()
+    chave = _chave(modelo, template, hash_documento, pergunta)
+
+    # Com a camada do banco ligada, a consulta vai para uma thread para não travar o event loop
+    if CACHE_IA_BANCO:
+        resposta = await run_in_threadpool(buscar, chave)
+    else:
+        resposta = buscar(chave)
+    if resposta is not None:
+        return resposta
+
+    inicio = time.perf_counter()
+    resposta = await gerar_async(prompt, modelo=modelo, esquema=esquema)
+    if resposta:
+        latencia = time.perf_counter() - inicio
+        if CACHE_IA_BANCO:
+            await run_in_threadpool(guardar, chave, resposta, latencia, modelo, template, hash_documento)
+        else:
+            guardar(chave, resposta, latencia, modelo, template, hash_documento)
+    return resposta
+
+
+async def gerar_texto_stream_async(prompt: str, template: str, hash_documento: str, pergunta: str = "", modelo: str = None):
+    """
+    Versão em stream: devolve os pedaços de texto conforme chegam.
+    Numa resposta já guardada, devolve tudo de uma vez. Só guarda no cache se o stream terminar inteiro.
+    """
+    modelo = modelo or modelo_padrao()
+    chave = _chave(modelo, template, hash_documento, pergunta)
+
+    if CACHE_IA_BANCO:
+        resposta = await run_in_threadpool(buscar, chave)
+    else:
+        resposta = buscar(chave)
+    if resposta is not None:
+        yield resposta
+        return
+
+    inicio = time.perf_counter()
+    partes = []
+    fluxo = gerar_stream_async(prompt, modelo=modelo)
+    try:
+        async for parte in fluxo:
+            partes.append(parte)
+            yield parte
+    finally:
+        await fluxo.aclose()
+
+    resposta = "".join(partes)
+    if resposta:
+        latencia = time.perf_counter() - inicio
+        if CACHE_IA_BANCO:
+            await run_in_threadpool(guardar, chave, resposta, latencia, modelo, template, hash_documento)
+        else:
+            guardar(chave, resposta, latencia, modelo, template, hash_documento)
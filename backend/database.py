@@ -1,4 +1,5 @@
 import os
+from sqlalchemy import event
 from sqlmodel import SQLModel, create_engine
 
 # Tenta pegar o endereço do banco das Variáveis de Ambiente (Nuvem)
@@ -9,10 +10,76 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///advocacia.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# connect_args só é necessário para SQLite
-connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+# Postgres: pool de conexões
+DB_POOL_TAMANHO = int(os.getenv("DB_POOL_TAMANHO", "10"))  # conexões mantidas abertas
+DB_POOL_EXTRA = int(os.getenv("DB_POOL_EXTRA", "20"))  # conexões além do pool nos picos
+DB_POOL_ESPERA = int(os.getenv("DB_POOL_ESPERA", "30"))  # segundos esperando uma conexão livre
+DB_POOL_RECICLAR = int(os.getenv("DB_POOL_RECICLAR", "1800"))  # segundos até reabrir uma conexão
+DB_TEMPO_MAX_CONSULTA_MS = int(os.getenv("DB_TEMPO_MAX_CONSULTA_MS", "30000"))  # statement_timeout (0 = sem limite)
+
+# SQLite: WAL deixa leituras e uma escrita acontecerem juntas; busy_timeout espera a trava em vez de falhar
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL é seguro com WAL
+
+
+def _perfil_postgres() -> dict:
+    connect_args = {}
+    if DB_TEMPO_MAX_CONSULTA_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_TEMPO_MAX_CONSULTA_MS}"
+    return {
+        "pool_size": DB_POOL_TAMANHO,
+        "max_overflow": DB_POOL_EXTRA,
+        "pool_timeout": DB_POOL_ESPERA,
+        "pool_recycle": DB_POOL_RECICLAR,
+        "pool_pre_ping": True,  # conexão derrubada pelo servidor é trocada antes de dar erro na rota
+        "connect_args": connect_args,
+    }
+
+
+def _perfil_sqlite() -> dict:
+    # check_same_thread: a mesma conexão do pool é usada por threads diferentes do uvicorn
+    return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+
+
+def _configurar_sqlite(engine, em_memoria: bool):
+    @event.listens_for(engine, "connect")
+    def aplicar_pragmas(conexao, _):
+        cursor = conexao.cursor()
+        if not em_memoria:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+def criar_engine(url: str = DATABASE_URL):
+    """Engine com o perfil do banco da URL (Postgres ou SQLite), lido das variáveis de ambiente."""
+    if url.startswith("sqlite"):
+        engine = create_engine(url, **_perfil_sqlite())
+        _configurar_sqlite(engine, em_memoria=":memory:" in url or url.rstrip("/") == "sqlite:")
+        return engine
+    if url.startswith("postgresql"):
+        return create_engine(url, **_perfil_postgres())
+    return create_engine(url)
+
+
+engine = criar_engine()
+
+
+def estatisticas_pool() -> dict:
+    """Como está o pool de conexões agora (em uso, livres, extras)."""
+    pool = engine.pool
+    estatisticas = {"banco": engine.dialect.name, "pool": type(pool).__name__, "status": pool.status()}
+    for campo, metodo in (("tamanho", "size"), ("livres", "checkedin"), ("em_uso", "checkedout"), ("extras", "overflow")):
+        if hasattr(pool, metodo):
+            estatisticas[campo] = getattr(pool, metodo)()
+    return estatisticas
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+
+from models import DocumentoTexto
+from extracao import extrair_paginas
+from cache_ia import invalidar_respostas
+
+# Pasta do cache em disco: um JSON por conteúdo (hash), reaproveitado mesmo se o arquivo mudar de nome
+PASTA_CACHE_TEXTO = os.getenv(
+    "PASTA_CACHE_TEXTO",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_textos")
+)
+
+
+def calcular_hash(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def calcular_hash_arquivo(caminho: str) -> str:
+    """SHA-256 de um arquivo no disco, lido em blocos."""
+    hasher = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(bloco)
+    return hasher.hexdigest()
+
+
+def _caminho_cache(hash_conteudo: str) -> str:
+    return os.path.join(PASTA_CACHE_TEXTO, f"{hash_conteudo}.json")
+
+
+def ler_cache_disco(hash_conteudo: str):
+    try:
+        with open(_caminho_cache(hash_conteudo), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def salvar_cache_disco(hash_conteudo: str, paginas: list):
+    try:
+        os.makedirs(PASTA_CACHE_TEXTO, exist_ok=True)
+        destino = _caminho_cache(hash_conteudo)
+        temporario = f"{destino}.{os.getpid()}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(paginas, f, ensure_ascii=False)
+        # Troca atômica: quem estiver lendo nunca vê um arquivo pela metade
+        os.replace(temporario, destino)
+    except OSError as e:
+        print(f"Não foi possível gravar o cache de texto em disco: {e}")
+
+
+def ler_texto_pdf(conteudo, ao_progredir=None, hash_conteudo: str = None):
+    """
+    Devolve (hash, páginas) do PDF, usando o cache em disco quando o conteúdo já foi lido.
+    `conteudo` são os bytes ou o caminho do arquivo (armazenamento local).
+    """
+    if hash_conteudo is None:
+        hash_conteudo = calcular_hash(conteudo) if isinstance(conteudo, (bytes, bytearray)) else calcular_hash_arquivo(conteudo)
+
+    paginas = ler_cache_disco(hash_conteudo)
+    if paginas is None:
+        paginas = extrair_paginas(conteudo, ao_progredir=ao_progredir)
+        salvar_cache_disco(hash_conteudo, paginas)
+
+    return hash_conteudo, paginas
+
+
+def buscar_documento(session: Session, chave: str):
+    """Só consulta o banco (uma linha pelo índice da chave). Não baixa nada."""
+    return session.exec(select(DocumentoTexto).where(DocumentoTexto.chave == chave)).first()
+
+
+def registrar_documento_pendente(session: Session, chave: str):
+    """
+    Cria a linha do documento como "pendente".
+    Devolve None se outra requisição já registrou a mesma chave.
+    """
+    documento = DocumentoTexto(chave=chave, status="pendente")
+    try:
+        session.add(documento)
+        session.commit()
+        session.refresh(documento)
+        return documento
+    except IntegrityError:
+        session.rollback()
+        return None
+
+
+def paginas_documento(documento: DocumentoTexto) -> list:
+    return json.loads(documento.paginas)
+
+
+def texto_documento(documento: DocumentoTexto, limite_paginas=None) -> str:
+    paginas = paginas_documento(documento)
+    if limite_paginas is not None:
+        paginas = paginas[:limite_paginas]
+    return "".join(paginas)
+
+
+def invalidar_documento(session: Session, chave: str):
+    """
+    Apaga o texto guardado para `chave` e as respostas da IA geradas a partir dele.
+    O commit fica por conta de quem chamou.
+    """
+    for documento in session.exec(select(DocumentoTexto).where(DocumentoTexto.chave == chave)).all():
+        invalidar_respostas(documento.hash_conteudo)
+        session.delete(documento)
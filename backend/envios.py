@@ -0,0 +1,354 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import hashlib
+import tempfile
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+
+from database import engine
+from models import ArquivoEnviado, EnvioUsuario, Processo, Documento
+from armazenamento import obter_armazenamento, chave_conteudo, PREFIXO_RECEBENDO
+from limpeza import cancelar_exclusoes
+
+# Uploads identificados pelo conteúdo. O PDF enviado no auto preenchimento fica guardado,
+# e o processo criado em seguida pode anexá-lo só pelo hash, sem mandar os bytes de novo.
+# O arquivo é um só para todos, mas anexar pelo hash só vale para quem já mandou os bytes (EnvioUsuario).
+
+TAMANHO_BLOCO = 1024 * 1024
+ENVIO_MEMORIA_MAX = int(os.getenv("ENVIO_MEMORIA_MAX", str(8 * 1024 * 1024)))  # acima disso vai para disco
+UPLOAD_TAMANHO_MAX = int(os.getenv("UPLOAD_TAMANHO_MAX_MB", "100")) * 1024 * 1024
+UPLOAD_BLOCOS_EM_ESPERA = int(os.getenv("UPLOAD_BLOCOS_EM_ESPERA", "8"))  # blocos de 1 MB entre a rede e o S3
+UPLOAD_LINK_VALIDADE = int(os.getenv("UPLOAD_LINK_VALIDADE", "900"))  # segundos para usar o link de upload direto
+
+RE_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ArquivoGrandeDemais(Exception):
+    pass
+
+
+def receber_arquivo(fluxo):
+    """
+    Lê o upload em blocos, calculando o SHA-256 enquanto copia.
+    Devolve (hash, tamanho, temporario); quem chamou fecha o temporário.
+    """
+    hasher = hashlib.sha256()
+    tamanho = 0
+    temporario = tempfile.SpooledTemporaryFile(max_size=ENVIO_MEMORIA_MAX)
+    while True:
+        bloco = fluxo.read(TAMANHO_BLOCO)
+        if not bloco:
+            break
+        tamanho += len(bloco)
+        if tamanho > UPLOAD_TAMANHO_MAX:
+            temporario.close()
+            raise ArquivoGrandeDemais()
+        hasher.update(bloco)
+        temporario.write(bloco)
+    temporario.seek(0)
+    return hasher.hexdigest(), tamanho, temporario
+
+
+class FluxoAssincrono:
+    """
+    Liga o corpo da requisição (lido no loop async) ao upload do armazenamento (numa thread):
+    o boto3 chama read() e vai mandando as partes ao S3 enquanto o resto ainda chega pela rede.
+    A fila é curta de propósito: se o S3 atrasar, a leitura do cliente espera (memória limitada).
+    Deve ser criado dentro do loop (a fila é do asyncio; a thread do upload a lê pelo loop).
+    """
+
+    def __init__(self, max_blocos: int = UPLOAD_BLOCOS_EM_ESPERA):
+        self._loop = asyncio.get_running_loop()
+        self._fila = asyncio.Queue(maxsize=max_blocos)
+        self._sobra = b""
+        self._fim = False
+        self._erro = None
+        self.leitura_encerrada = False
+
+    async def colocar(self, bloco):
+        if self.leitura_encerrada:
+            raise RuntimeError("O envio ao armazenamento foi interrompido")
+        # Com a fila cheia, espera o read() da thread liberar espaço
+        await self._fila.put(bloco)
+        if self.leitura_encerrada:
+            raise RuntimeError("O envio ao armazenamento foi interrompido")
+
+    async def terminar(self):
+        await self.colocar(None)
+
+    def _esvaziar(self):
+        while not self._fila.empty():
+            self._fila.get_nowait()
+
+    def _liberar(self):
+        self.leitura_encerrada = True
+        self._esvaziar()  # acorda um colocar() que esperava espaço
+
+    def encerrar_leitura(self):
+        """Chamado pela thread do upload quando ela termina (bem ou mal)."""
+        self._loop.call_soon_threadsafe(self._liberar)
+
+    def abortar(self, erro: BaseException):
+        """Faz o próximo read() falhar; o boto3 então cancela o upload em partes (abort_multipart_upload)."""
+        self._erro = erro
+        self._esvaziar()
+        self._fila.put_nowait(None)
+
+    def read(self, tamanho: int = -1) -> bytes:
+        partes, total = [self._sobra], len(self._sobra)
+        while not self._fim and (tamanho < 0 or total < tamanho):
+            if self._erro is not None:
+                raise IOError("Upload cancelado") from self._erro
+            bloco = asyncio.run_coroutine_threadsafe(self._fila.get(), self._loop).result()
+            if self._erro is not None:
+                raise IOError("Upload cancelado") from self._erro
+            if bloco is None:
+                self._fim = True
+                break
+            partes.append(bloco)
+            total += len(bloco)
+
+        dados = b"".join(partes)
+        if tamanho < 0:
+            self._sobra = b""
+            return dados
+        self._sobra = dados[tamanho:]
+        return dados[:tamanho]
+
+
+async def receber_fluxo(partes) -> tuple:
+    """
+    Manda o corpo da requisição ao armazenamento enquanto ele chega, sem guardar o arquivo inteiro.
+    O hash só é conhecido no fim, então o objeto sobe para recebendo/<uuid>.pdf e depois
+    finalizar_fluxo() o move para a chave de conteúdo.
+    Devolve (hash, tamanho, chave temporária). Se o cliente desconectar ou passar do limite,
+    o upload é cancelado e nada fica no armazenamento.
+    """
+    armazenamento = obter_armazenamento()
+    chave = f"{PREFIXO_RECEBENDO}{uuid.uuid4().hex}.pdf"
+    fluxo = FluxoAssincrono()
+    hasher = hashlib.sha256()
+    tamanho = 0
+
+    def enviar():
+        try:
+            armazenamento.enviar(fluxo, chave)
+        finally:
+            fluxo.encerrar_leitura()
+
+    envio = asyncio.get_running_loop().run_in_executor(None, enviar)
+    try:
+        bloco = bytearray()
+        async for parte in partes:
+            tamanho += len(parte)
+            if tamanho > UPLOAD_TAMANHO_MAX:
+                raise ArquivoGrandeDemais()
+            hasher.update(parte)
+            bloco += parte
+            if len(bloco) >= TAMANHO_BLOCO:
+                await fluxo.colocar(bytes(bloco))
+                bloco.clear()
+        if bloco:
+            await fluxo.colocar(bytes(bloco))
+        await fluxo.terminar()
+        await envio
+    except BaseException as e:
+        # Cliente desconectou (ClientDisconnect), arquivo grande demais ou falha no S3
+        fluxo.abortar(e)
+        await asyncio.gather(envio, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, _apagar_silencioso, chave)
+        raise
+
+    return hasher.hexdigest(), tamanho, chave
+
+
+def _apagar_silencioso(chave: str):
+    try:
+        obter_armazenamento().apagar(chave)
+    except Exception as e:
+        print(f"Não foi possível apagar o upload incompleto {chave}: {e}")
+
+
+def finalizar_fluxo(session: Session, hash_conteudo: str, tamanho: int, chave_temporaria: str, nome_original: str = None, usuario_id: int = None):
+    """
+    Move o upload recebido por receber_fluxo() para a chave do conteúdo.
+    Se o mesmo conteúdo já estava guardado, só descarta o temporário. Devolve (envio, novo).
+    """
+    envio, novo = _finalizar_fluxo(session, hash_conteudo, tamanho, chave_temporaria, nome_original)
+    registrar_dono(session, envio, usuario_id)
+    return envio, novo
+
+
+def _finalizar_fluxo(session: Session, hash_conteudo: str, tamanho: int, chave_temporaria: str, nome_original: str = None):
+    armazenamento = obter_armazenamento()
+    envio = buscar_envio(session, hash_conteudo)
+    if envio:
+        _apagar_silencioso(chave_temporaria)
+        return envio, False
+
+    chave = chave_conteudo(hash_conteudo)
+    cancelar_exclusoes(session, chave)
+    session.commit()
+    armazenamento.mover(chave_temporaria, chave)
+
+    envio = ArquivoEnviado(hash_conteudo=hash_conteudo, chave=chave, nome_original=nome_original, tamanho=tamanho)
+    try:
+        session.add(envio)
+        session.commit()
+        session.refresh(envio)
+        return envio, True
+    except IntegrityError:
+        session.rollback()
+        return buscar_envio(session, hash_conteudo), False
+
+
+def buscar_envio(session: Session, hash_conteudo: str, usuario_id: int = None):
+    """
+    O envio guardado com este conteúdo. Com usuario_id, só se esse usuário já mandou os bytes:
+    sem isso, qualquer um anexaria (e baixaria) o PDF de outro escritório sabendo o hash.
+    """
+    if not hash_conteudo:
+        return None
+    envio = session.exec(select(ArquivoEnviado).where(ArquivoEnviado.hash_conteudo == hash_conteudo)).first()
+    if envio and usuario_id is not None and not usuario_enviou(session, envio, usuario_id):
+        return None
+    return envio
+
+
+def usuario_enviou(session: Session, envio: ArquivoEnviado, usuario_id: int) -> bool:
+    if session.exec(select(EnvioUsuario.id).where(
+        EnvioUsuario.usuario_id == usuario_id,
+        EnvioUsuario.hash_conteudo == envio.hash_conteudo
+    )).first():
+        return True
+    # Anexos de antes do registro de quem enviou: vale o arquivo já estar num processo do usuário
+    documento = session.exec(select(Documento.id).join(Processo, Documento.processo_id == Processo.id).where(
+        Documento.chave == envio.chave,
+        Processo.usuario_id == usuario_id
+    )).first()
+    principal = session.exec(select(Processo.id).where(
+        Processo.arquivo_pdf == envio.chave,
+        Processo.usuario_id == usuario_id
+    )).first()
+    return documento is not None or principal is not None
+
+
+def registrar_dono(session: Session, envio: ArquivoEnviado, usuario_id: int = None):
+    """Anota que o usuário mandou os bytes deste conteúdo (com commit)."""
+    if not envio or usuario_id is None:
+        return
+    if session.exec(select(EnvioUsuario.id).where(
+        EnvioUsuario.usuario_id == usuario_id,
+        EnvioUsuario.hash_conteudo == envio.hash_conteudo
+    )).first():
+        return
+    try:
+        session.add(EnvioUsuario(usuario_id=usuario_id, hash_conteudo=envio.hash_conteudo))
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+    # O commit expira o envio; quem chamou ainda usa os campos, às vezes já fora da sessão
+    session.refresh(envio)
+
+
+def esquecer_donos(session: Session, hash_conteudo: str):
+    """O envio foi apagado: ninguém mais tem o conteúdo guardado. O commit fica com quem chamou."""
+    for registro in session.exec(select(EnvioUsuario).where(EnvioUsuario.hash_conteudo == hash_conteudo)).all():
+        session.delete(registro)
+
+
+def armazenar_envio(session: Session, hash_conteudo: str, tamanho: int, arquivo, nome_original: str = None, usuario_id: int = None):
+    """
+    Envia o arquivo ao armazenamento, a menos que o mesmo conteúdo já esteja lá.
+    Com usuario_id, registra quem enviou. Devolve (envio, novo).
+    """
+    envio, novo = _armazenar_envio(session, hash_conteudo, tamanho, arquivo, nome_original)
+    registrar_dono(session, envio, usuario_id)
+    return envio, novo
+
+
+def _armazenar_envio(session: Session, hash_conteudo: str, tamanho: int, arquivo, nome_original: str = None):
+    envio = buscar_envio(session, hash_conteudo)
+    if envio:
+        return envio, False
+
+    chave = chave_conteudo(hash_conteudo)
+    # Uma exclusão agendada do mesmo conteúdo não pode apagar o arquivo que vai subir agora
+    cancelar_exclusoes(session, chave)
+    session.commit()
+    obter_armazenamento().enviar(arquivo, chave)
+
+    envio = ArquivoEnviado(hash_conteudo=hash_conteudo, chave=chave, nome_original=nome_original, tamanho=tamanho)
+    try:
+        session.add(envio)
+        session.commit()
+        session.refresh(envio)
+        return envio, True
+    except IntegrityError:
+        # Outra requisição guardou o mesmo arquivo ao mesmo tempo (mesmo objeto, nada a desfazer)
+        session.rollback()
+        return buscar_envio(session, hash_conteudo), False
+
+
+def guardar_envio(hash_conteudo: str, tamanho: int, arquivo, nome_original: str = None, usuario_id: int = None) -> ArquivoEnviado:
+    """armazenar_envio com sessão própria, para rodar numa thread separada."""
+    with Session(engine) as session:
+        return armazenar_envio(session, hash_conteudo, tamanho, arquivo, nome_original, usuario_id)[0]
+
+
+def chave_envio_direto(hash_conteudo: str, usuario_id: int) -> str:
+    """Onde o cliente põe o PDF pelo link pré-assinado: uma chave por usuário, nunca a de conteúdo."""
+    return f"{PREFIXO_RECEBENDO}{usuario_id}-{hash_conteudo}.pdf"
+
+
+def registrar_envio_direto(session: Session, hash_conteudo: str, usuario_id: int, nome_original: str = None):
+    """
+    Registra o PDF que o usuário mandou direto ao armazenamento (link_envio), depois de conferir
+    que o objeto dele existe e que tamanho e SHA-256 batem. O conteúdo já guardado por outro usuário
+    não conta: só o objeto na chave deste usuário prova que ele tem os bytes.
+    Devolve o envio, ou None se não bateu.
+    """
+    envio = buscar_envio(session, hash_conteudo, usuario_id=usuario_id)
+    if envio:
+        return envio
+
+    chave_temporaria = chave_envio_direto(hash_conteudo, usuario_id)
+    objeto = obter_armazenamento().conferir(chave_temporaria)
+    if not objeto:
+        return None
+    if objeto["sha256"] != hash_conteudo or objeto["tamanho"] > UPLOAD_TAMANHO_MAX:
+        _apagar_silencioso(chave_temporaria)
+        return None
+
+    # Daqui em diante é igual ao upload em fluxo: move para a chave de conteúdo (ou descarta, se já existe)
+    envio, _ = finalizar_fluxo(session, hash_conteudo, objeto["tamanho"], chave_temporaria, nome_original, usuario_id)
+    return envio
+
+
+def dados_extraidos(hash_conteudo: str):
+    """Resultado do auto preenchimento já calculado para este conteúdo, ou None."""
+    with Session(engine) as session:
+        envio = buscar_envio(session, hash_conteudo)
+        return json.loads(envio.dados_extraidos) if envio and envio.dados_extraidos else None
+
+
+def salvar_dados_extraidos(hash_conteudo: str, dados: dict):
+    with Session(engine) as session:
+        envio = buscar_envio(session, hash_conteudo)
+        if envio:
+            envio.dados_extraidos = json.dumps(dados, ensure_ascii=False)
+            session.add(envio)
+            session.commit()
+
+
+def chave_em_uso(session: Session, chave: str, exceto_processo_id: int = None) -> bool:
+    """Se algum outro processo (ou documento de processo) ainda aponta para o mesmo objeto."""
+    instrucao = select(Processo.id).where(Processo.arquivo_pdf == chave)
+    documentos = select(Documento.id).where(Documento.chave == chave)
+    if exceto_processo_id is not None:
+        instrucao = instrucao.where(Processo.id != exceto_processo_id)
+        documentos = documentos.where(Documento.processo_id != exceto_processo_id)
+    return session.exec(instrucao).first() is not None or session.exec(documentos).first() is not None
@@ -0,0 +1,135 @@
+import os
+import io
+import math
+import mmap
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pypdf import PdfReader
+
+# Serviço único de extração de texto dos PDFs.
+# O trabalho pesado (pypdf segura o GIL) roda em processos separados, então
+# um PDF enorme não trava as outras requisições do mesmo worker.
+
+EXTRACAO_WORKERS = int(os.getenv("EXTRACAO_WORKERS", str(os.cpu_count() or 2)))
+EXTRACAO_TIMEOUT = float(os.getenv("EXTRACAO_TIMEOUT", "120"))  # segundos por documento
+EXTRACAO_MIN_PAGINAS_LOTE = int(os.getenv("EXTRACAO_MIN_PAGINAS_LOTE", "5"))
+
+_pool = None
+_trava_pool = threading.Lock()
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _trava_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACAO_WORKERS)
+        return _pool
+
+
+def encerrar_pool(terminar_processos: bool = False):
+    """
+    Descarta o pool; o próximo uso cria outro. Usado no desligamento da API, quando um processo
+    filho morreu (ex: PDF corrompido derrubou o pypdf) e, com terminar_processos, quando um PDF
+    passou do tempo: o filho preso no pypdf é encerrado em vez de continuar ocupando a vaga.
+    """
+    global _pool
+    with _trava_pool:
+        if _pool is None:
+            return
+        processos = list((_pool._processes or {}).values()) if terminar_processos else []
+        _pool.shutdown(wait=False, cancel_futures=True)
+        for processo in processos:
+            processo.terminate()
+        _pool = None
+
+
+@contextmanager
+def _abrir(fonte):
+    """
+    Os bytes do PDF, ou o caminho de um arquivo no disco. Com o caminho, cada processo filho
+    mapeia o arquivo (mmap) em vez de receber uma cópia dos bytes pelo pool.
+    """
+    if isinstance(fonte, (bytes, bytearray)):
+        yield io.BytesIO(fonte)
+        return
+    with open(fonte, "rb") as arquivo, mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        yield mapa
+
+
+def _vazio(fonte) -> bool:
+    if isinstance(fonte, (bytes, bytearray)):
+        return not fonte
+    return os.path.getsize(fonte) == 0  # mmap não aceita arquivo vazio
+
+
+def _contar_paginas(fonte) -> int:
+    with _abrir(fonte) as dados:
+        return len(PdfReader(dados).pages)
+
+
+def _extrair_intervalo(fonte, inicio: int, fim: int) -> list:
+    """Roda dentro do processo filho: extrai as páginas [inicio, fim)."""
+    with _abrir(fonte) as dados:
+        leitor = PdfReader(dados)
+        return [leitor.pages[i].extract_text() or "" for i in range(inicio, fim)]
+
+
+def _dividir_paginas(total: int) -> list:
+    """Divide as páginas em intervalos contíguos, um por processo (sem lotes minúsculos)."""
+    tamanho = max(EXTRACAO_MIN_PAGINAS_LOTE, math.ceil(total / max(EXTRACAO_WORKERS, 1)))
+    return [(inicio, min(inicio + tamanho, total)) for inicio in range(0, total, tamanho)]
+
+
+def extrair_paginas(conteudo, limite_paginas=None, timeout=None, ao_progredir=None) -> list:
+    """
+    Devolve o texto de cada página do PDF, na ordem. `conteudo` são os bytes ou o caminho do arquivo.
+    - limite_paginas: lê só as N primeiras páginas.
+    - timeout: tempo máximo para o documento inteiro (padrão EXTRACAO_TIMEOUT).
+    - ao_progredir(feitas, total): chamado a cada intervalo concluído.
+    Lança TimeoutError se o documento passar do tempo. Arquivo vazio devolve [].
+    """
+    if _vazio(conteudo):
+        return []
+
+    timeout = EXTRACAO_TIMEOUT if timeout is None else timeout
+    prazo = time.monotonic() + timeout
+
+    pool = _obter_pool()
+    try:
+        try:
+            total = pool.submit(_contar_paginas, conteudo).result(timeout=timeout)
+        except FuturesTimeoutError:
+            encerrar_pool(terminar_processos=True)
+            raise TimeoutError(f"Extração do PDF passou de {timeout:.0f}s")
+        if limite_paginas is not None:
+            total = min(total, limite_paginas)
+        if total == 0:
+            return []
+
+        intervalos = _dividir_paginas(total)
+        futuros = {pool.submit(_extrair_intervalo, conteudo, inicio, fim): inicio for inicio, fim in intervalos}
+
+        resultados = {}
+        feitas = 0
+        try:
+            for futuro in as_completed(futuros, timeout=max(prazo - time.monotonic(), 0)):
+                inicio = futuros[futuro]
+                resultados[inicio] = futuro.result()
+                feitas += len(resultados[inicio])
+                if ao_progredir:
+                    ao_progredir(feitas, total)
+        except FuturesTimeoutError:
+            encerrar_pool(terminar_processos=True)
+            raise TimeoutError(f"Extração do PDF passou de {timeout:.0f}s")
+
+    except BrokenProcessPool:
+        encerrar_pool()
+        raise
+
+    paginas = []
+    for inicio, _ in intervalos:
+        paginas.extend(resultados[inicio])
+    return paginas
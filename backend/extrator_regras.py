@@ -0,0 +1,151 @@
+import os
+import re
+from datetime import date
+
+# Extração local (regex + heurísticas) dos dados do formulário de processo.
+# Número CNJ, partes e datas costumam estar na primeira página e seguem formatos fixos:
+# só o que não for encontrado aqui com confiança suficiente vai para a IA.
+
+EXTRACAO_CONFIANCA_MIN = float(os.getenv("EXTRACAO_CONFIANCA_MIN", "0.5"))
+
+CAMPOS = ["numero_processo", "cliente", "contra_parte", "data_prazo"]
+
+# NNNNNNN-DD.AAAA.J.TR.OOOO, aceitando a versão sem pontuação
+RE_CNJ = re.compile(r"(?<!\d)(\d{7})-?(\d{2})\.?(\d{4})\.?(\d)\.?(\d{2})\.?(\d{4})(?!\d)")
+
+_SUFIXO = r"(?:\s*\((?:a|as|s|es|os)\))?"
+# Só rótulos no começo da linha e seguidos de ":" ("Réu: FULANO"); "o réu - citado - apresentou" é prosa
+RE_POLO_ATIVO = re.compile(
+    r"^[ \t]*(?:autor|autora|requerente|reclamante|exequente|impetrante|apelante|agravante|embargante|polo ativo)"
+    + _SUFIXO + r"s?[ \t]*:[ \t]*([^\n]+)",
+    re.IGNORECASE | re.MULTILINE
+)
+RE_POLO_PASSIVO = re.compile(
+    r"^[ \t]*(?:r[ée]u|r[ée]|requerid[oa]|reclamad[oa]|executad[oa]|impetrad[oa]|apelad[oa]|agravad[oa]|embargad[oa]|polo passivo)"
+    + _SUFIXO + r"s?[ \t]*:[ \t]*([^\n]+)",
+    re.IGNORECASE | re.MULTILINE
+)
+RE_EM_FACE = re.compile(r"em face d[eoa]s?\s+([^\n]+)", re.IGNORECASE)
+# O nome termina na qualificação ("FULANO, brasileiro, CPF ...")
+ABREVIACOES = {"ltda", "cia", "me", "epp", "eireli", "jr", "sr", "sra", "dr", "dra"}
+RE_SIGLA = re.compile(r"^(?:\w\.){2,}$")
+RE_FIM_NOME = re.compile(r",|;|\s[-–]\s|\s(?:CPF|CNPJ|RG|inscrit[oa]|portador[a]?|residente|domiciliad[oa])\b", re.IGNORECASE)
+
+MESES = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "março": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+RE_DATA_NUMERICA = re.compile(r"(?<!\d)(\d{1,2})[/.](\d{1,2})[/.](\d{4})(?!\d)")
+RE_DATA_EXTENSO = re.compile(r"(?<!\d)(\d{1,2})º?\s+de\s+(" + "|".join(MESES) + r")\s+de\s+(\d{4})(?!\d)", re.IGNORECASE)
+RE_CONTEXTO_PRAZO = re.compile(
+    r"prazo|audi[eê]ncia|vencimento|intima|comparec|sess[aã]o|per[ií]cia|julgamento|at[eé] o dia|designad",
+    re.IGNORECASE
+)
+
+
+def _digito_cnj_valido(numero, digito, ano, justica, tribunal, origem) -> bool:
+    """Dígito verificador do CNJ (Resolução 65/2008, módulo 97)."""
+    calculado = 98 - int(f"{numero}{ano}{justica}{tribunal}{origem}00") % 97
+    return calculado == int(digito)
+
+
+def extrair_numero_cnj(texto: str):
+    primeiro = None
+    for m in RE_CNJ.finditer(texto):
+        numero = f"{m[1]}-{m[2]}.{m[3]}.{m[4]}.{m[5]}.{m[6]}"
+        if _digito_cnj_valido(*m.groups()):
+            return numero, 0.95
+        primeiro = primeiro or numero
+    # Formato certo mas dígito não confere: pode ser erro de OCR
+    return (primeiro, 0.6) if primeiro else None
+
+
+def _termina_em_abreviacao(nome: str) -> bool:
+    ultima = nome.split()[-1].lower()
+    # Sigla com pontos ("S.A.", "M.E.") ou abreviação conhecida ("Ltda.")
+    return bool(RE_SIGLA.match(ultima)) or ultima[:-1] in ABREVIACOES
+
+
+def _limpar_nome(bruto: str) -> str:
+    nome = RE_FIM_NOME.split(bruto, maxsplit=1)[0]
+    nome = " ".join(nome.split()).strip(" :-–")
+    # Ponto final da frase sai; o da abreviação fica
+    while nome.endswith(".") and not _termina_em_abreviacao(nome):
+        nome = nome[:-1].rstrip(" .:-–")
+    return nome.lstrip(" .")[:120]
+
+
+def _extrair_parte(padrao, texto: str):
+    nomes = [n for n in (_limpar_nome(m[1]) for m in padrao.finditer(texto)) if len(n) >= 3]
+    if not nomes:
+        return None
+    # Mais de um nome diferente no mesmo polo (litisconsórcio ou outro documento): ficamos com o primeiro
+    confianca = 0.85 if len({n.upper() for n in nomes}) == 1 else 0.7
+    return nomes[0], confianca
+
+
+def extrair_partes(texto: str) -> dict:
+    """Autor vira "cliente" e réu vira "contra_parte", como no prompt da IA."""
+    partes = {}
+    ativo = _extrair_parte(RE_POLO_ATIVO, texto)
+    if ativo:
+        partes["cliente"] = ativo
+
+    passivo = _extrair_parte(RE_POLO_PASSIVO, texto)
+    if not passivo:
+        em_face = _extrair_parte(RE_EM_FACE, texto)
+        passivo = (em_face[0], 0.55) if em_face else None
+    if passivo:
+        partes["contra_parte"] = passivo
+    return partes
+
+
+def _datas(texto: str):
+    for m in RE_DATA_NUMERICA.finditer(texto):
+        dia, mes, ano = int(m[1]), int(m[2]), int(m[3])
+        yield m.start(), dia, mes, ano
+    for m in RE_DATA_EXTENSO.finditer(texto):
+        yield m.start(), int(m[1]), MESES[m[2].lower()], int(m[3])
+
+
+def extrair_data_prazo(texto: str, hoje: date = None):
+    """
+    Sugere o próximo prazo: só datas futuras perto de palavras como "prazo" ou "audiência"
+    passam do mínimo de confiança; datas passadas só contam se estiverem nesse contexto.
+    """
+    hoje = hoje or date.today()
+    candidatas = []
+    for posicao, dia, mes, ano in _datas(texto):
+        try:
+            data = date(ano, mes, dia)
+        except ValueError:
+            continue
+        contexto = bool(RE_CONTEXTO_PRAZO.search(texto[max(0, posicao - 80):posicao]))
+        futura = data >= hoje
+        if futura:
+            # Sem contexto pode ser qualquer data (assinatura, vigência...): fica abaixo do mínimo e a IA confirma
+            confianca = 0.9 if contexto else 0.4
+        elif contexto:
+            confianca = 0.45
+        else:
+            continue
+        candidatas.append((confianca, data))
+
+    if not candidatas:
+        return None
+    # A mais confiável; no empate, a mais próxima
+    confianca, data = min(candidatas, key=lambda c: (-c[0], c[1]))
+    return data.isoformat(), confianca
+
+
+def extrair_campos(texto: str, hoje: date = None) -> dict:
+    """{campo: (valor, confianca)} só com os campos encontrados."""
+    campos = {}
+    numero = extrair_numero_cnj(texto)
+    if numero:
+        campos["numero_processo"] = numero
+    campos.update(extrair_partes(texto))
+    prazo = extrair_data_prazo(texto, hoje)
+    if prazo:
+        campos["data_prazo"] = prazo
+    return campos
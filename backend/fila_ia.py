@@ -0,0 +1,204 @@
+import os
+import json
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from sqlmodel import Session, select
+
+from database import engine
+from models import Processo, Tarefa, ResumoIA
+from documentos import buscar_documento, paginas_documento
+from ia import montar_prompt_resumo, TEMPLATE_RESUMO_PROCESSO
+from resumo_longo import resumir
+
+# Fila das análises por IA: poucas chamadas ao Gemini ao mesmo tempo (limite global),
+# revezando entre os usuários para que um escritório com 50 pedidos não trave os outros.
+
+ANALISE_IA_WORKERS = int(os.getenv("ANALISE_IA_WORKERS", "3"))  # análises simultâneas no servidor
+ANALISE_IA_FILA_MAX = int(os.getenv("ANALISE_IA_FILA_MAX", "100"))  # acima disso recusamos (429)
+
+
+class FilaCheia(Exception):
+    pass
+
+
+class FilaJusta:
+    """Uma fila por usuário; os workers retiram em rodízio (round-robin) entre eles."""
+
+    def __init__(self, limite: int):
+        self.limite = limite
+        self._filas = OrderedDict()  # usuario_id -> deque de tarefa_id
+        self._total = 0
+        self._condicao = threading.Condition()
+
+    def __len__(self):
+        with self._condicao:
+            return self._total
+
+    def colocar(self, usuario_id, tarefa_id: int, forcar: bool = False):
+        with self._condicao:
+            if not forcar and self._total >= self.limite:
+                raise FilaCheia()
+            self._filas.setdefault(usuario_id, deque()).append(tarefa_id)
+            self._total += 1
+            self._condicao.notify()
+
+    def retirar(self) -> int:
+        with self._condicao:
+            while self._total == 0:
+                self._condicao.wait()
+            # Pega do primeiro usuário da vez e manda ele para o fim da rodada
+            usuario_id, fila = next(iter(self._filas.items()))
+            tarefa_id = fila.popleft()
+            self._filas.move_to_end(usuario_id)
+            if not fila:
+                del self._filas[usuario_id]
+            self._total -= 1
+            return tarefa_id
+
+
+fila = FilaJusta(ANALISE_IA_FILA_MAX)
+_workers = []
+# Resumos gerados ao mesmo tempo no servidor, somando a fila e a reanálise em lote (lote_ia)
+_vagas_ia = threading.BoundedSemaphore(ANALISE_IA_WORKERS)
+
+
+def _atualizar_tarefa(session: Session, tarefa: Tarefa, **campos):
+    for nome, valor in campos.items():
+        setattr(tarefa, nome, valor)
+    tarefa.atualizado_em = datetime.utcnow()
+    session.add(tarefa)
+    session.commit()
+
+
+def enfileirar_analise(session: Session, processo: Processo) -> Tarefa:
+    """
+    Cria a tarefa de análise e coloca na fila. Se o processo já tem uma análise
+    pendente, devolve a mesma. Lança FilaCheia quando o servidor está sobrecarregado.
+    """
+    tarefa = session.exec(select(Tarefa).where(
+        Tarefa.tipo == "analise_ia",
+        Tarefa.processo_id == processo.id,
+        Tarefa.status.in_(["pendente", "processando"])
+    )).first()
+    if tarefa:
+        return tarefa
+
+    if len(fila) >= fila.limite:
+        raise FilaCheia()
+
+    tarefa = Tarefa(tipo="analise_ia", processo_id=processo.id, usuario_id=processo.usuario_id, referencia=processo.arquivo_pdf)
+    session.add(tarefa)
+    session.commit()
+    session.refresh(tarefa)
+
+    try:
+        fila.colocar(tarefa.usuario_id, tarefa.id)
+    except FilaCheia:
+        _atualizar_tarefa(session, tarefa, status="erro", erro="Fila de análises cheia")
+        raise
+    return tarefa
+
+
+def salvar_resumo(processo_id: int, resumo: str, hash_documento: str):
+    """Grava Processo.resumo_ia e guarda de qual documento/prompt ele saiu."""
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+        if not processo:
+            return
+        processo.resumo_ia = resumo
+        session.add(processo)
+
+        origem = session.exec(select(ResumoIA).where(ResumoIA.processo_id == processo_id)).first()
+        origem = origem or ResumoIA(processo_id=processo_id, template=TEMPLATE_RESUMO_PROCESSO)
+        origem.hash_documento = hash_documento
+        origem.template = TEMPLATE_RESUMO_PROCESSO
+        origem.gerado_em = datetime.utcnow()
+        session.add(origem)
+        session.commit()
+
+
+def gerar_resumo_processo(processo_id: int) -> dict:
+    """
+    Gera o resumo do processo (o PDF inteiro, em partes se for longo) e grava em Processo.resumo_ia.
+    Devolve {"resumo", "hash_documento", "tokens_estimados", "estatisticas"}. Lança ValueError se o PDF não estiver pronto.
+    """
+    # 1. Lê o que precisa e fecha a sessão antes de chamar a IA (não seguramos conexão do banco)
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+        documento = buscar_documento(session, processo.arquivo_pdf) if processo and processo.arquivo_pdf else None
+        if not documento or documento.status != "pronto":
+            raise ValueError("O PDF do processo não está disponível para leitura.")
+
+        paginas = paginas_documento(documento)
+        hash_documento = documento.hash_conteudo
+
+    # 2. Chamadas à IA (mapa e redução nos PDFs longos), dentro do limite global
+    with _vagas_ia:
+        resultado = resumir(paginas, montar_prompt_resumo, TEMPLATE_RESUMO_PROCESSO, hash_documento)
+    resumo = resultado["resumo"]
+
+    # 3. Grava no processo
+    salvar_resumo(processo_id, resumo, hash_documento)
+
+    return {
+        "resumo": resumo,
+        "hash_documento": hash_documento,
+        "tokens_estimados": resultado["estatisticas"]["tokens_total"],
+        "estatisticas": resultado["estatisticas"],
+    }
+
+
+def executar_analise(tarefa_id: int):
+    with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+        if not tarefa or tarefa.status in ("concluida", "erro"):
+            return
+        _atualizar_tarefa(session, tarefa, status="processando", progresso=10)
+        processo_id = tarefa.processo_id
+
+    try:
+        resultado = gerar_resumo_processo(processo_id)
+        erro = None
+    except Exception as e:
+        print(f"Erro na análise da tarefa {tarefa_id}: {e}")
+        resultado, erro = None, str(e)
+
+    with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+        if not tarefa:
+            return
+        if erro:
+            _atualizar_tarefa(session, tarefa, status="erro", erro=erro)
+        else:
+            _atualizar_tarefa(session, tarefa, status="concluida", progresso=100, resultado=json.dumps(resultado, ensure_ascii=False))
+
+
+def _laco_worker():
+    while True:
+        tarefa_id = fila.retirar()
+        try:
+            executar_analise(tarefa_id)
+        except Exception as e:
+            print(f"Erro inesperado no worker de análise ({tarefa_id}): {e}")
+
+
+def iniciar_workers():
+    """Sobe os workers (uma vez) e recoloca na fila as análises que ficaram pendentes."""
+    if _workers:
+        return
+    for i in range(ANALISE_IA_WORKERS):
+        worker = threading.Thread(target=_laco_worker, name=f"analise-ia-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+    with Session(engine) as session:
+        tarefas = session.exec(select(Tarefa).where(
+            Tarefa.tipo == "analise_ia",
+            Tarefa.status.in_(["pendente", "processando"])
+        ).order_by(Tarefa.id)).all()
+        for tarefa in tarefas:
+            fila.colocar(tarefa.usuario_id, tarefa.id, forcar=True)
+
+        if tarefas:
+            print(f"🔁 {len(tarefas)} análise(s) de IA retomada(s).")
@@ -293,7 +293,7 @@ else:
                         try:
                             # Chama a SUA rota existente: /ia/extrair-dados
                             files = {"arquivo": uploaded_file.getvalue()} # Note que o backend espera 'arquivo'
-                            res = requests.post(f"{BASE_URL}/ia/extrair-dados", files=files)
+                            res = requests.post(f"{BASE_URL}/ia/extrair-dados", files=files, headers=headers)
                             
                             if res.status_code == 200:
                                 dados_ia = res.json()
@@ -302,6 +302,8 @@ else:
                                 # O backend devolve "numero_processo", o form usa "numero"
                                 st.session_state["form_dados"]["numero"] = dados_ia.get("numero_processo", "")
                                 st.session_state["form_dados"]["contra_parte"] = dados_ia.get("contra_parte", "")
+                                # O PDF já ficou guardado no servidor: ao salvar, anexamos pelo hash
+                                st.session_state["form_dados"]["hash_pdf"] = dados_ia.get("hash")
                                 
                                 # Tenta converter a data que vem da IA (YYYY-MM-DD) para objeto data
                                 data_str = dados_ia.get("data_prazo")
@@ -347,6 +349,13 @@ else:
                     try:
                         res = requests.post(f"{BASE_URL}/processos", json=payload, headers=headers)
                         if res.status_code == 200:
+                            hash_pdf = st.session_state["form_dados"].get("hash_pdf")
+                            if hash_pdf:
+                                requests.post(
+                                    f"{BASE_URL}/processos/{res.json()['id']}/anexo/por-hash",
+                                    json={"hash": hash_pdf},
+                                    headers=headers
+                                )
                             st.balloons()
                             st.success("Processo Criado com Sucesso!")
                             
@@ -375,6 +384,17 @@ else:
                 processos = []
                 st.error("Erro ao conectar.")
 
+            # Links de download de todos os anexos numa requisição só
+            links = {}
+            com_anexo = [p["id"] for p in processos if p.get("arquivo_pdf")]
+            if com_anexo:
+                try:
+                    res_links = requests.post(f"{BASE_URL}/processos/links-download", json={"ids": com_anexo}, headers=headers)
+                    if res_links.status_code == 200:
+                        links = res_links.json()["links"]
+                except:
+                    pass
+
             for p in processos:
                 # Container visual para o processo
                 with st.container(border=True):
@@ -403,14 +423,20 @@ else:
                             if not p.get("arquivo_pdf"):
                                 arq = st.file_uploader("Anexar PDF", key=f"up_{p['id']}", label_visibility="collapsed")
                                 if arq and st.button("Enviar PDF", key=f"btn_up_{p['id']}"):
-                                    files = {"arquivo": arq}
-                                    requests.post(f"{BASE_URL}/processos/{p['id']}/anexo", headers=headers, files=files)
+                                    requests.post(
+                                        f"{BASE_URL}/processos/{p['id']}/anexo/fluxo",
+                                        headers={**headers, "Content-Type": "application/pdf"},
+                                        params={"nome": arq.name},
+                                        data=arq
+                                    )
                                     st.success("Enviado!")
                                     st.rerun()
                             else:
                                 st.success(f"✅ Arquivo na Nuvem: {p.get('arquivo_pdf')}")
 
-                                if st.button("📥 Gerar Link de Download", key=f"btn_down_{p['id']}"):
+                                if str(p["id"]) in links:
+                                    st.markdown(f"[📥 Baixar Documento]({links[str(p['id'])]['url_download']})")
+                                elif st.button("📥 Gerar Link de Download", key=f"btn_down_{p['id']}"):
                                     res_link = requests.get(f"{BASE_URL}/processos/{p['id']}/download", headers=headers)
                                     if res_link.status_code == 200:
                                         link = res_link.json()["url_download"]
@@ -494,9 +520,22 @@ else:
                                 with st.spinner("Analisando com IA..."):
                                     try:
                                         res_ia = requests.post(f"{BASE_URL}/processos/{p['id']}/analise-ia", headers=headers)
-                                        if res_ia.status_code == 200:
-                                            st.success("Análise concluída!")
-                                            st.rerun()
+                                        if res_ia.status_code == 202:
+                                            # A análise roda na fila do servidor: consultamos até terminar
+                                            tarefa_id = res_ia.json()["tarefa_id"]
+                                            tarefa = {"status": "pendente"}
+                                            for _ in range(120):
+                                                time.sleep(2)
+                                                tarefa = requests.get(f"{BASE_URL}/tarefas/{tarefa_id}", headers=headers).json()
+                                                if tarefa.get("status") in ("concluida", "erro"):
+                                                    break
+                                            if tarefa.get("status") == "concluida":
+                                                st.success("Análise concluída!")
+                                                st.rerun()
+                                            else:
+                                                st.error("Erro na IA.")
+                                        elif res_ia.status_code in (409, 429):
+                                            st.warning(res_ia.json().get("detail"))
                                         else:
                                             st.error("Erro na IA.")
                                     except Exception as e:
@@ -1,41 +1,250 @@
-from google import genai
-from pypdf import PdfReader
 import os
-from dotenv import load_dotenv
+import sys
+import re
+import json
+import math
+import time
+import asyncio
+import argparse
+import threading
+from datetime import datetime, date
+from typing import Optional
+from pydantic import BaseModel, field_validator
+from starlette.concurrency import run_in_threadpool
 
-# 1. Carrega as variáveis do arquivo .env
-load_dotenv()
+from extracao import extrair_paginas
+from documentos import calcular_hash, ler_texto_pdf
+from resumo_longo import resumir
+from cache_ia import gerar_texto_async, descartar
+from extrator_regras import RE_CNJ
 
-# 2. Pega a chave do ambiente seguro
-chave_secreta = os.getenv("GEMINI_API_KEY")
+# Ids dos templates usados no cache de respostas: mude a versão ao alterar o texto do prompt
+TEMPLATE_RESUMO_PROCESSO = "resumo_processo:v2"
+TEMPLATE_TRIAGEM = "triagem_documento:v2"
+TEMPLATE_CHAT = "chat:v1"
+TEMPLATE_RESUMO_CONVERSA = "resumo_conversa:v1"
+TEMPLATE_EXTRACAO = "extrair_dados:v3"
 
-if not chave_secreta:
-    print("ERRO: Chave API não encontrada no arquivo .env")
-else:
-    # 3. Configura o Gemini
-    genai.Client(api_key=chave_secreta)
+EXTRACAO_IA_RETENTATIVAS = int(os.getenv("EXTRACAO_IA_RETENTATIVAS", "2"))  # novas chamadas à IA se o JSON vier inválido
 
+# Campos do formulário de processo que a IA preenche quando o extrator local não encontra
+DESCRICAO_CAMPOS_EXTRACAO = {
+    "numero_processo": "O número do processo (formato CNJ se houver).",
+    "cliente": "O nome da parte que parece ser o nosso cliente (ou Autor).",
+    "contra_parte": "O nome da outra parte (Réu).",
+    "data_prazo": "Uma data sugerida para o próximo prazo no formato YYYY-MM-DD. Se não achar, use a data de hoje.",
+}
 
-def analisar_documento(caminho_pdf):
+
+def montar_prompt_resumo(texto_pdf):
+    """Prompt do resumo executivo gravado em Processo.resumo_ia."""
+    return f"""
+        Você é um assistente jurídico sênior.
+        Analise o texto do processo abaixo e gere um RESUMO EXECUTIVO em formato de texto (Markdown).
+        NÃO retorne JSON. Retorne um texto legível para um advogado ler rápido.
+
+        Estrutura sugerida:
+        **📝 Resumo dos Fatos:** (O que aconteceu resumidamente)
+        **⚖️ Partes:** (Quem está processando quem)
+        **💰 Pedidos e Valores:** (O que está sendo pedido)
+        **⚠️ Pontos de Atenção:** (Prazos ou riscos imediatos identificados)
+
+        --- TEXTO DO PROCESSO ---
+        {texto_pdf}
+        """
+
+
+def montar_prompt_extracao(texto_pdf, campos):
+    """Prompt do auto preenchimento, pedindo só os campos que faltaram."""
+    itens = "\n        ".join(f'{i}. "{campo}": {DESCRICAO_CAMPOS_EXTRACAO[campo]}' for i, campo in enumerate(campos, 1))
+    return f"""
+        Aja como um assistente jurídico. Analise o texto abaixo extraído de um processo judicial.
+        Extraia as seguintes informações e retorne APENAS um objeto JSON (sem ```json no inicio):
+        
+        {itens}
+        
+        Texto do processo:
+        {texto_pdf}
+        """
+
+
+class DadosExtraidos(BaseModel):
+    """Formato da resposta do auto preenchimento (também enviado ao Gemini como response_schema)."""
+    numero_processo: Optional[str] = None
+    cliente: Optional[str] = None
+    contra_parte: Optional[str] = None
+    data_prazo: Optional[str] = None  # YYYY-MM-DD
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _texto(cls, valor):
+        if isinstance(valor, (int, float)):
+            valor = str(valor)
+        if isinstance(valor, str):
+            valor = valor.strip()
+            if not valor or valor.lower() in ("null", "none", "n/a", "não encontrado", "nao encontrado"):
+                return None
+        return valor
+
+    @field_validator("numero_processo")
+    @classmethod
+    def _numero_cnj(cls, valor):
+        m = RE_CNJ.search(valor or "")
+        return f"{m[1]}-{m[2]}.{m[3]}.{m[4]}.{m[5]}.{m[6]}" if m else valor
+
+    @field_validator("data_prazo")
+    @classmethod
+    def _data(cls, valor):
+        if valor is None:
+            return None
+        # Aceita também DD/MM/AAAA, que a IA às vezes devolve
+        for formato in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y"):
+            try:
+                return datetime.strptime(valor[:10], formato).date().isoformat()
+            except ValueError:
+                continue
+        raise ValueError(f"data_prazo fora do formato YYYY-MM-DD: {valor}")
+
+
+def reparar_json(texto: str) -> str:
+    """Conserta os desvios comuns: cercas de markdown, texto em volta, aspas curvas e vírgula sobrando."""
+    texto = (texto or "").replace("```json", "").replace("```", "")
+    inicio, fim = texto.find("{"), texto.rfind("}")
+    if inicio != -1 and fim > inicio:
+        texto = texto[inicio:fim + 1]
+    texto = texto.replace("\u201c", '"').replace("\u201d", '"').replace("\u2018", "'").replace("\u2019", "'")
+    texto = re.sub(r",\s*([}\]])", r"\1", texto)
+    if '"' not in texto:
+        texto = texto.replace("'", '"')
+    texto = re.sub(r"\bNone\b", "null", texto)
+    return texto.strip()
+
+
+def interpretar_extracao(texto: str):
+    """Valida a resposta da IA. Devolve (DadosExtraidos, precisou_reparar) ou lança ValueError."""
+    reparado = False
+    try:
+        dados = json.loads(texto)
+    except (TypeError, ValueError):
+        dados = json.loads(reparar_json(texto))
+        reparado = True
+    if not isinstance(dados, dict):
+        raise ValueError("A resposta não é um objeto JSON.")
+    return DadosExtraidos.model_validate(dados), reparado
+
+
+_trava_estatisticas = threading.Lock()
+estatisticas_extracao = {
+    "extracoes": 0,
+    "sucesso_primeira": 0,
+    "reparos_locais": 0,
+    "retentativas": 0,
+    "falhas": 0,
+}
+
+
+def _contar(campo: str):
+    with _trava_estatisticas:
+        estatisticas_extracao[campo] += 1
+
+
+def obter_estatisticas_extracao() -> dict:
+    with _trava_estatisticas:
+        dados = dict(estatisticas_extracao)
+    dados["taxa_falha"] = round(dados["falhas"] / dados["extracoes"], 3) if dados["extracoes"] else 0.0
+    return dados
+
+
+async def completar_extracao(texto_pdf: str, campos: list, hash_documento: str) -> dict:
     """
-    1. Abre o PDF.
-    2. Extrai o texto.
-    3. Manda pro Gemini resumir.
+    Pede à IA só os `campos` que faltaram, em JSON validado por DadosExtraidos.
+    Se a resposta não servir, repete apenas a chamada à IA (o texto do PDF já está em mãos),
+    até EXTRACAO_IA_RETENTATIVAS vezes. Lança ValueError quando o orçamento acaba.
     """
-    try:
-        #Extrai o pdf
-        leitor = PdfReader(caminho_pdf)
-        texto_completo = ""
-        for pagina in leitor.pages:
-            texto_completo += pagina.extract_text() or ""
+    _contar("extracoes")
+    prompt = montar_prompt_extracao(texto_pdf, campos)
+    pergunta = ",".join(campos)
+    erro = None
 
-        #limite de segurança
-        texto_completo = texto_completo[:15000]
+    for tentativa in range(EXTRACAO_IA_RETENTATIVAS + 1):
+        chave_pergunta = pergunta
+        prompt_tentativa = prompt
+        if tentativa:
+            _contar("retentativas")
+            chave_pergunta = f"{pergunta}|correcao:{tentativa}"
+            prompt_tentativa = f"""{prompt}
+        Sua resposta anterior não pôde ser usada ({erro}). Responda de novo, só com o objeto JSON pedido.
+        """
 
-        if not texto_completo.strip():
-            return "Erro: O PDF parece estar vazio ou é imagem."
+        try:
+            resposta = await gerar_texto_async(
+                prompt_tentativa,
+                template=TEMPLATE_EXTRACAO,
+                hash_documento=hash_documento,
+                pergunta=chave_pergunta,
+                esquema=DadosExtraidos
+            )
+            dados, reparado = interpretar_extracao(resposta)
+        except Exception as e:
+            print(f"Extração pela IA, tentativa {tentativa + 1}: {e}")
+            erro = e
+            # A resposta ruim não pode voltar do cache na próxima vez
+            await run_in_threadpool(descartar, TEMPLATE_EXTRACAO, hash_documento, chave_pergunta)
+            continue
+
+        if reparado:
+            _contar("reparos_locais")
+        if not tentativa:
+            _contar("sucesso_primeira")
+        valores = dados.model_dump()
+        return {campo: valores[campo] for campo in campos if valores.get(campo)}
+
+    _contar("falhas")
+    raise ValueError(f"A IA não devolveu um JSON válido: {erro}")
+
+
+def montar_prompt_chat(trechos, pergunta, resumo_conversa=None, mensagens_recentes=None):
+    """Prompt do chat: só os trechos do processo escolhidos pela busca, mais o histórico condensado da sessão."""
+    historico = ""
+    if resumo_conversa or mensagens_recentes:
+        linhas = [f"{'Usuário' if m.papel == 'user' else 'Assistente'}: {m.conteudo}" for m in (mensagens_recentes or [])]
+        historico = f"""
+        --- CONVERSA ATÉ AQUI ---
+        Resumo das mensagens anteriores: {resumo_conversa or "(nenhum)"}
+        {chr(10).join(linhas)}
+        --- FIM DA CONVERSA ---
+        """
+
+    return f"""
+        Você é um assistente jurídico. Responda com base nos trechos do processo abaixo.
+        Cada trecho indica a página de onde veio; cite a página quando for útil.
+        --- TRECHOS DO PROCESSO ---
+        {trechos}
+        --- FIM ---
+        {historico}
+        Pergunta: {pergunta}
+        """
+
+
+def montar_prompt_resumo_conversa(resumo_atual, mensagens):
+    """Prompt que incorpora mensagens antigas ao resumo da sessão de chat."""
+    linhas = "\n".join(f"{'Usuário' if m.papel == 'user' else 'Assistente'}: {m.conteudo}" for m in mensagens)
+    return f"""
+        Você mantém o resumo de uma conversa entre um advogado e um assistente jurídico sobre um processo.
+        Atualize o resumo abaixo incorporando as novas mensagens. Seja breve (no máximo 10 linhas),
+        preserve fatos, valores, datas, páginas citadas e decisões já tomadas na conversa.
 
-        prompt = f"""
+        RESUMO ATUAL:
+        {resumo_atual or "(vazio)"}
+
+        NOVAS MENSAGENS:
+        {linhas}
+        """
+
+
+def montar_prompt_triagem(texto_completo):
+    """Prompt da triagem de um PDF avulso (analisar_documento)."""
+    return f"""
         Atue como um Advogado Sênior especialista em Triagem Processual.
         Abaixo, você receberá o texto extraído de um arquivo PDF jurídico. Este arquivo pode conter múltiplos documentos (Petição, Procuração, Comprovantes, Sentença, etc.).
         
@@ -64,17 +273,177 @@ def analisar_documento(caminho_pdf):
         {texto_completo}
         """
 
-        # 3. Chamar a IA (SINTAXE NOVA CORRIGIDA)
-        client = genai.Client(api_key=chave_secreta)
 
-        # Na biblioteca nova, chamamos client.models.generate_content
-        response = client.models.generate_content(
-            model="models/gemini-3-flash-preview", 
-            contents=prompt
-        )
-        
-        return response.text
+def analisar_documento(caminho_pdf):
+    """
+    1. Abre o PDF.
+    2. Extrai o texto.
+    3. Manda pro Gemini resumir (em partes, se o PDF for longo).
+    """
+    try:
+        #Extrai o pdf
+        with open(caminho_pdf, "rb") as f:
+            conteudo = f.read()
+        paginas = extrair_paginas(conteudo)
+
+        if not "".join(paginas).strip():
+            return "Erro: O PDF parece estar vazio ou é imagem."
+
+        # 3. Chamar a IA (o mesmo PDF analisado de novo responde do cache)
+        resultado = resumir(paginas, montar_prompt_triagem, TEMPLATE_TRIAGEM, calcular_hash(conteudo))
+        return resultado["resumo"]
 
     except Exception as e:
         print(f"ERRO IA: {e}")
-        return f"Erro ao analisar IA: {str(e)}"
\ No newline at end of file
+        return f"Erro ao analisar IA: {str(e)}"
+
+
+# --- Triagem em lote (linha de comando) ---
+# Uso: python ia.py uploads/ --saida triagem.jsonl [--concorrencia 4]
+# Cada PDF vira uma linha no JSONL assim que termina; rodar de novo pula os que já deram certo (pelo hash).
+
+
+def _percentil(valores, p):
+    """Percentil pelo método do posto mais próximo (valores já ordenados)."""
+    if not valores:
+        return 0.0
+    posicao = max(0, min(len(valores), math.ceil(p / 100 * len(valores))) - 1)
+    return round(valores[posicao], 2)
+
+
+def _ja_processados(caminho_saida):
+    """Hashes que já têm linha com status "ok" no JSONL (linhas cortadas por uma queda são ignoradas)."""
+    feitos = set()
+    if not os.path.exists(caminho_saida):
+        return feitos
+    with open(caminho_saida, "r", encoding="utf-8") as f:
+        for linha in f:
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                continue
+            if registro.get("status") == "ok":
+                feitos.add(registro["hash"])
+    return feitos
+
+
+def _listar_pdfs(pasta, recursivo):
+    if not recursivo:
+        nomes = sorted(os.listdir(pasta))
+        return [os.path.join(pasta, n) for n in nomes if n.lower().endswith(".pdf")]
+    caminhos = []
+    for raiz, _, nomes in os.walk(pasta):
+        caminhos.extend(os.path.join(raiz, n) for n in nomes if n.lower().endswith(".pdf"))
+    return sorted(caminhos)
+
+
+async def triar_pasta(pasta, caminho_saida, concorrencia=4, recursivo=False):
+    """
+    Triagem de todos os PDFs da pasta. A leitura do texto usa o pool de processos da extração
+    (e o cache em disco); as chamadas à IA ficam limitadas a `concorrencia` documentos por vez.
+    """
+    caminhos = _listar_pdfs(pasta, recursivo)
+    feitos = _ja_processados(caminho_saida)
+
+    limite_ia = asyncio.Semaphore(concorrencia)
+    # Poucos PDFs carregados em memória além dos que o pool está lendo
+    limite_leitura = asyncio.Semaphore(concorrencia * 2)
+    trava_saida = asyncio.Lock()
+    metricas = {"ok": 0, "erro": 0, "pulados": 0, "tokens": 0, "latencias": [], "extracao": [], "ia": []}
+
+    saida = open(caminho_saida, "a", encoding="utf-8")
+
+    async def gravar(registro):
+        async with trava_saida:
+            saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            saida.flush()
+
+    async def processar(caminho):
+        registro = {"arquivo": os.path.relpath(caminho, pasta)}
+        inicio = time.perf_counter()
+        try:
+            async with limite_leitura:
+                with open(caminho, "rb") as f:
+                    conteudo = f.read()
+                registro["hash"] = calcular_hash(conteudo)
+                if registro["hash"] in feitos:
+                    metricas["pulados"] += 1
+                    return
+                # Marca já, para não processar duas vezes o mesmo PDF com outro nome
+                feitos.add(registro["hash"])
+
+                _, paginas = await asyncio.to_thread(ler_texto_pdf, conteudo)
+                del conteudo
+            registro["paginas"] = len(paginas)
+            registro["segundos_extracao"] = round(time.perf_counter() - inicio, 2)
+
+            if not "".join(paginas).strip():
+                raise ValueError("O PDF parece estar vazio ou é imagem.")
+
+            async with limite_ia:
+                inicio_ia = time.perf_counter()
+                resultado = await asyncio.to_thread(resumir, paginas, montar_prompt_triagem, TEMPLATE_TRIAGEM, registro["hash"])
+            registro["segundos_ia"] = round(time.perf_counter() - inicio_ia, 2)
+            registro["tokens"] = resultado["estatisticas"]["tokens_total"]
+            registro["resumo"] = resultado["resumo"]
+            registro["status"] = "ok"
+
+            metricas["ok"] += 1
+            metricas["tokens"] += registro["tokens"]
+            metricas["extracao"].append(registro["segundos_extracao"])
+            metricas["ia"].append(registro["segundos_ia"])
+            metricas["latencias"].append(time.perf_counter() - inicio)
+        except Exception as e:
+            if "hash" in registro:
+                feitos.discard(registro["hash"])
+            registro["status"] = "erro"
+            registro["erro"] = str(e)
+            metricas["erro"] += 1
+            print(f"Erro em {registro['arquivo']}: {e}")
+
+        registro["concluido_em"] = datetime.utcnow().isoformat()
+        await gravar(registro)
+        print(f"[{metricas['ok'] + metricas['erro']}/{len(caminhos) - metricas['pulados']}] {registro['arquivo']}: {registro['status']}")
+
+    inicio_total = time.perf_counter()
+    try:
+        await asyncio.gather(*(processar(c) for c in caminhos))
+    finally:
+        saida.close()
+    segundos = time.perf_counter() - inicio_total
+
+    minutos = segundos / 60
+    latencias, extracao, ia = sorted(metricas["latencias"]), sorted(metricas["extracao"]), sorted(metricas["ia"])
+    return {
+        "arquivos": len(caminhos),
+        "ok": metricas["ok"],
+        "erros": metricas["erro"],
+        "pulados": metricas["pulados"],
+        "segundos": round(segundos, 2),
+        "docs_por_minuto": round(metricas["ok"] / minutos, 2) if minutos else 0.0,
+        "tokens_por_minuto": round(metricas["tokens"] / minutos) if minutos else 0,
+        "latencia": {"p50": _percentil(latencias, 50), "p90": _percentil(latencias, 90), "p99": _percentil(latencias, 99)},
+        "extracao": {"p50": _percentil(extracao, 50), "p90": _percentil(extracao, 90), "p99": _percentil(extracao, 99)},
+        "ia": {"p50": _percentil(ia, 50), "p90": _percentil(ia, 90), "p99": _percentil(ia, 99)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Triagem por IA de todos os PDFs de uma pasta, com saída em JSONL.")
+    parser.add_argument("pasta", help="Pasta com os PDFs (ex: uploads/)")
+    parser.add_argument("--saida", default="triagem.jsonl", help="Arquivo JSONL de resultados (também usado para retomar)")
+    parser.add_argument("--concorrencia", type=int, default=4, help="Documentos na IA ao mesmo tempo")
+    parser.add_argument("--recursivo", action="store_true", help="Inclui as subpastas")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.pasta):
+        sys.exit("Pasta não encontrada.")
+
+    resumo = asyncio.run(triar_pasta(args.pasta, args.saida, args.concorrencia, args.recursivo))
+    print(
+        f"✅ {resumo['ok']} documento(s), {resumo['erros']} erro(s), {resumo['pulados']} já feito(s) em {resumo['segundos']}s | "
+        f"{resumo['docs_por_minuto']} docs/min, {resumo['tokens_por_minuto']} tokens/min"
+    )
+    for etapa in ("latencia", "extracao", "ia"):
+        p = resumo[etapa]
+        print(f"   {etapa:<9} p50 {p['p50']}s | p90 {p['p90']}s | p99 {p['p99']}s")
@@ -0,0 +1,147 @@
+import os
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlmodel import Session, select
+
+from database import engine
+from models import DocumentoTexto, Tarefa
+from armazenamento import obter_armazenamento, hash_da_chave
+from documentos import buscar_documento, registrar_documento_pendente, ler_texto_pdf, ler_cache_disco
+
+# Quantos PDFs podem ser lidos ao mesmo tempo em segundo plano
+INGESTAO_WORKERS = int(os.getenv("INGESTAO_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=INGESTAO_WORKERS, thread_name_prefix="ingestao")
+
+
+def _atualizar_tarefa(session: Session, tarefa: Tarefa, **campos):
+    for nome, valor in campos.items():
+        setattr(tarefa, nome, valor)
+    tarefa.atualizado_em = datetime.utcnow()
+    session.add(tarefa)
+    session.commit()
+
+
+def enfileirar_ingestao(session: Session, chave: str, processo_id=None, usuario_id=None, em_segundo_plano=True, conteudo: bytes = None) -> Tarefa:
+    """
+    Marca o documento como pendente e agenda a leitura do PDF.
+    Se o documento já estava registrado e há uma ingestão em andamento para ele, devolve ela.
+    Com em_segundo_plano=False a leitura roda na hora, na thread de quem chamou (ex: rotinas em lote).
+    Se quem chamou já tem os bytes do PDF (acabou de recebê-los), passa em `conteudo` e o download é pulado.
+    """
+    if not registrar_documento_pendente(session, chave):
+        tarefa = session.exec(select(Tarefa).where(
+            Tarefa.tipo == "ingestao",
+            Tarefa.referencia == chave,
+            Tarefa.status.in_(["pendente", "processando"])
+        ).order_by(Tarefa.id.desc())).first()
+        if tarefa:
+            return tarefa
+
+    tarefa = Tarefa(tipo="ingestao", referencia=chave, processo_id=processo_id, usuario_id=usuario_id)
+    session.add(tarefa)
+    session.commit()
+    session.refresh(tarefa)
+
+    if em_segundo_plano:
+        _executor.submit(executar_ingestao, tarefa.id, conteudo)
+    else:
+        executar_ingestao(tarefa.id, conteudo)
+        session.refresh(tarefa)
+    return tarefa
+
+
+def executar_ingestao(tarefa_id: int, conteudo: bytes = None):
+    """Roda na thread de fundo: baixa o PDF, extrai o texto por página e marca o documento como pronto."""
+    with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+        if not tarefa or tarefa.status == "concluida":
+            return
+
+        chave = tarefa.referencia
+        try:
+            _atualizar_tarefa(session, tarefa, status="processando", progresso=5)
+
+            # Chaves de conteudo/ trazem o hash: se o texto já está no cache em disco, nem baixamos
+            hash_conteudo = hash_da_chave(chave)
+            paginas = ler_cache_disco(hash_conteudo) if hash_conteudo else None
+            etag = None
+
+            if paginas is None:
+                if conteudo is None:
+                    # No armazenamento local a extração lê o arquivo direto do disco; no S3, baixamos
+                    armazenamento = obter_armazenamento()
+                    conteudo = armazenamento.caminho_local(chave)
+                    if conteudo is None:
+                        conteudo, etag = armazenamento.ler(chave)
+                _atualizar_tarefa(session, tarefa, progresso=20)
+
+                # Grava o progresso só a cada 10% para não martelar o banco em PDFs grandes
+                ultimo = {"progresso": 20}
+
+                def ao_progredir(feitas, total):
+                    progresso = 20 + int(75 * feitas / max(total, 1))
+                    if progresso - ultimo["progresso"] >= 10:
+                        ultimo["progresso"] = progresso
+                        _atualizar_tarefa(session, tarefa, progresso=progresso)
+
+                hash_conteudo, paginas = ler_texto_pdf(conteudo, ao_progredir=ao_progredir, hash_conteudo=hash_conteudo)
+
+            documento = buscar_documento(session, chave)
+            if not documento or documento.criado_em > tarefa.criado_em:
+                # O anexo foi trocado/excluído enquanto líamos: o texto lido é do arquivo antigo
+                _atualizar_tarefa(session, tarefa, status="concluida", progresso=100)
+                return
+
+            documento.status = "pronto"
+            documento.etag = etag
+            documento.hash_conteudo = hash_conteudo
+            documento.total_paginas = len(paginas)
+            documento.paginas = json.dumps(paginas, ensure_ascii=False)
+            session.add(documento)
+
+            _atualizar_tarefa(
+                session, tarefa,
+                status="concluida",
+                progresso=100,
+                resultado=json.dumps({"total_paginas": len(paginas), "hash_conteudo": hash_conteudo})
+            )
+
+        except Exception as e:
+            print(f"Erro na ingestão de {chave}: {e}")
+            session.rollback()
+            documento = buscar_documento(session, chave)
+            if documento and documento.criado_em <= tarefa.criado_em:
+                documento.status = "erro"
+                session.add(documento)
+            _atualizar_tarefa(session, tarefa, status="erro", erro=str(e))
+
+
+def garantir_documento(session: Session, chave: str, processo_id=None, usuario_id=None) -> DocumentoTexto:
+    """
+    Devolve o DocumentoTexto da chave sem nunca ler o PDF aqui.
+    Se ninguém agendou a ingestão ainda (ex: anexos enviados antes desta rotina existir),
+    agenda agora e devolve o documento como "pendente".
+    """
+    documento = buscar_documento(session, chave)
+    if documento:
+        return documento
+
+    enfileirar_ingestao(session, chave, processo_id=processo_id, usuario_id=usuario_id)
+    return buscar_documento(session, chave)
+
+
+def retomar_ingestoes_pendentes():
+    """Chamado na subida do servidor: reagenda o que ficou pela metade se o processo caiu."""
+    with Session(engine) as session:
+        tarefas = session.exec(select(Tarefa).where(
+            Tarefa.tipo == "ingestao",
+            Tarefa.status.in_(["pendente", "processando"])
+        )).all()
+
+        for tarefa in tarefas:
+            _executor.submit(executar_ingestao, tarefa.id)
+
+        if tarefas:
+            print(f"🔁 {len(tarefas)} ingestão(ões) de PDF retomada(s).")
@@ -0,0 +1,214 @@
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from database import engine
+from models import OperacaoArmazenamento, ArquivoEnviado, EnvioUsuario, Processo, Documento
+from armazenamento import obter_armazenamento, descartar_links, hash_da_chave, PREFIXO_CONTEUDO, PREFIXO_RECEBENDO
+
+# Exclusões no armazenamento pelo padrão outbox: a rota só grava uma OperacaoArmazenamento
+# na mesma transação (milissegundos, sem chamar o S3 com o banco travado) e o agendador
+# executa as pendentes em lote (delete_objects, até 1000 chaves por chamada), com novas tentativas.
+# A reconciliação procura objetos que nenhum registro do banco usa e agenda a exclusão deles.
+
+LIMPEZA_INTERVALO = int(os.getenv("LIMPEZA_INTERVALO", "15"))  # segundos entre execuções do worker
+LIMPEZA_LOTE = int(os.getenv("LIMPEZA_LOTE", "1000"))
+LIMPEZA_TENTATIVAS = int(os.getenv("LIMPEZA_TENTATIVAS", "5"))
+LIMPEZA_ESPERA = int(os.getenv("LIMPEZA_ESPERA", "30"))  # segundos antes de uma exclusão poder rodar
+LIMPEZA_RECONCILIAR_HORAS = int(os.getenv("LIMPEZA_RECONCILIAR_HORAS", "6"))
+LIMPEZA_IDADE_ORFAO_HORAS = int(os.getenv("LIMPEZA_IDADE_ORFAO_HORAS", "24"))  # objeto sem dono há mais que isso é apagado
+LIMPEZA_ENVIO_DIAS = int(os.getenv("LIMPEZA_ENVIO_DIAS", "7"))  # PDF do auto preenchimento nunca anexado
+LIMPEZA_RESERVA_MAX = int(os.getenv("LIMPEZA_RESERVA_MAX", "600"))  # segundos até um lote reservado por worker que caiu voltar à fila
+LIMPEZA_UPLOAD_ESPERA = int(os.getenv("LIMPEZA_UPLOAD_ESPERA", "60"))  # segundos que um upload espera a exclusão em andamento da mesma chave
+
+
+def agendar_exclusao(session: Session, chave: str):
+    """Registra a exclusão do objeto. O commit fica com quem chamou: sem commit, nada é apagado."""
+    pendente = session.exec(select(OperacaoArmazenamento).where(
+        OperacaoArmazenamento.chave == chave,
+        OperacaoArmazenamento.status == "pendente"
+    )).first()
+    if not pendente:
+        session.add(OperacaoArmazenamento(
+            operacao="apagar",
+            chave=chave,
+            proxima_tentativa=datetime.utcnow() + timedelta(seconds=LIMPEZA_ESPERA)
+        ))
+    descartar_links(chave)
+
+
+def cancelar_exclusoes(session: Session, chave: str):
+    """
+    O mesmo conteúdo voltou a ser enviado: a exclusão agendada não pode mais rodar.
+    Se o worker já reservou essa chave (executando), espera ele terminar, porque o objeto
+    só pode subir depois de apagado. Faz commit; lança TimeoutError se a exclusão não terminar.
+    """
+    limite = time.monotonic() + LIMPEZA_UPLOAD_ESPERA
+    while True:
+        session.execute(update(OperacaoArmazenamento).where(
+            OperacaoArmazenamento.chave == chave,
+            OperacaoArmazenamento.status == "pendente"
+        ).values(status="cancelada", atualizado_em=datetime.utcnow()))
+        session.commit()
+        # Conferido depois do commit: um lote reservado antes do cancelamento aparece aqui;
+        # um reservado depois não pega esta chave, que já não está pendente
+        if not _em_execucao(chave):
+            return
+        if time.monotonic() > limite:
+            raise TimeoutError(f"A exclusão de {chave} ainda está em andamento")
+        time.sleep(0.2)
+
+
+def _em_execucao(chave: str) -> bool:
+    # Sessão própria: cada consulta vê o que o worker já confirmou
+    with Session(engine) as session:
+        return session.exec(select(OperacaoArmazenamento.id).where(
+            OperacaoArmazenamento.chave == chave,
+            OperacaoArmazenamento.status == "executando"
+        )).first() is not None
+
+
+def _em_uso(session: Session, chave: str) -> bool:
+    if session.exec(select(Processo.id).where(Processo.arquivo_pdf == chave)).first():
+        return True
+    if session.exec(select(Documento.id).where(Documento.chave == chave)).first():
+        return True
+    hash_conteudo = hash_da_chave(chave)
+    return bool(hash_conteudo and session.exec(
+        select(ArquivoEnviado.id).where(ArquivoEnviado.hash_conteudo == hash_conteudo)
+    ).first())
+
+
+def _reservar_lote(agora: datetime) -> tuple:
+    """
+    Passo 1: marca as exclusões vencidas como executando e confirma. Quem ainda está em uso é cancelado.
+    Devolve ({id: chave} reservadas, quantas foram canceladas).
+    """
+    with Session(engine) as session:
+        # Lote de um worker que caiu no meio volta para a fila
+        session.execute(update(OperacaoArmazenamento).where(
+            OperacaoArmazenamento.status == "executando",
+            OperacaoArmazenamento.atualizado_em < agora - timedelta(seconds=LIMPEZA_RESERVA_MAX)
+        ).values(status="pendente"))
+
+        ids = session.exec(select(OperacaoArmazenamento.id).where(
+            OperacaoArmazenamento.status == "pendente",
+            OperacaoArmazenamento.proxima_tentativa <= agora
+        ).order_by(OperacaoArmazenamento.id).limit(LIMPEZA_LOTE)).all()
+
+        reservadas, canceladas = {}, 0
+        for operacao_id in ids:
+            # Só a linha ainda pendente é reservada: cancelada por um upload ou pega por outro worker fica de fora
+            if not session.execute(update(OperacaoArmazenamento).where(
+                OperacaoArmazenamento.id == operacao_id,
+                OperacaoArmazenamento.status == "pendente"
+            ).values(status="executando", atualizado_em=agora)).rowcount:
+                continue
+            operacao = session.get(OperacaoArmazenamento, operacao_id)
+            # Confere de novo: o objeto pode ter voltado a ser usado depois do agendamento
+            if _em_uso(session, operacao.chave):
+                operacao.status = "cancelada"
+                session.add(operacao)
+                canceladas += 1
+            else:
+                reservadas[operacao_id] = operacao.chave
+        session.commit()
+    return reservadas, canceladas
+
+
+def executar_exclusoes() -> dict:
+    """
+    Um ciclo do worker: apaga em lote as exclusões vencidas. Devolve quantas foram feitas, canceladas e com erro.
+    Nenhuma transação fica aberta durante a chamada ao armazenamento: o lote é reservado (executando)
+    e confirmado, o S3 é chamado, e o resultado é gravado numa transação nova. Um upload da mesma chave
+    nesse meio tempo espera em cancelar_exclusoes até o lote terminar.
+    """
+    agora = datetime.utcnow()
+    resultado = {"feitas": 0, "canceladas": 0, "erros": 0}
+
+    # 1. Reserva
+    reservadas, resultado["canceladas"] = _reservar_lote(agora)
+
+    # 2. Armazenamento, sem banco
+    erros = {}
+    if reservadas:
+        try:
+            erros = obter_armazenamento().apagar_varios(list(set(reservadas.values())))
+        except Exception as e:
+            erros = {chave: str(e) for chave in reservadas.values()}
+
+    # 3. Resultado
+    with Session(engine) as session:
+        for operacao_id in reservadas:
+            operacao = session.get(OperacaoArmazenamento, operacao_id)
+            operacao.tentativas += 1
+            if operacao.chave in erros:
+                operacao.erro = erros[operacao.chave]
+                if operacao.tentativas >= LIMPEZA_TENTATIVAS:
+                    operacao.status = "erro"
+                else:
+                    # Espera cresce a cada falha: 30 s, 1 min, 2 min...
+                    operacao.status = "pendente"
+                    operacao.proxima_tentativa = agora + timedelta(seconds=LIMPEZA_ESPERA * 2 ** (operacao.tentativas - 1))
+                resultado["erros"] += 1
+            else:
+                operacao.status = "feita"
+                operacao.erro = None
+                descartar_links(operacao.chave)
+                resultado["feitas"] += 1
+            operacao.atualizado_em = datetime.utcnow()
+            session.add(operacao)
+        session.commit()
+
+    if any(resultado.values()):
+        print(f"🧹 Limpeza do armazenamento: {resultado}")
+    return resultado
+
+
+def reconciliar() -> int:
+    """
+    Agenda a exclusão do que sobrou sem dono no armazenamento:
+      - objetos em conteudo/ e recebendo/ que nenhum registro usa (ex: falha entre o upload e o commit)
+      - PDFs do auto preenchimento que nunca foram anexados a um processo
+    Só pega o que tem mais que LIMPEZA_IDADE_ORFAO_HORAS, para não disputar com uploads em andamento.
+    Devolve quantas exclusões foram agendadas.
+    """
+    agora = datetime.utcnow()
+    limite_orfao = agora - timedelta(hours=LIMPEZA_IDADE_ORFAO_HORAS)
+    limite_envio = agora - timedelta(days=LIMPEZA_ENVIO_DIAS)
+    agendadas = 0
+
+    with Session(engine) as session:
+        usadas = set(session.exec(select(Processo.arquivo_pdf).where(Processo.arquivo_pdf != None)).all())
+        usadas |= set(session.exec(select(Documento.chave)).all())
+
+        for envio in session.exec(select(ArquivoEnviado).where(ArquivoEnviado.criado_em < limite_envio)).all():
+            if envio.chave not in usadas:
+                for registro in session.exec(select(EnvioUsuario).where(EnvioUsuario.hash_conteudo == envio.hash_conteudo)).all():
+                    session.delete(registro)
+                session.delete(envio)
+                agendar_exclusao(session, envio.chave)
+                agendadas += 1
+        session.flush()
+
+        usadas |= set(session.exec(select(ArquivoEnviado.chave)).all())
+        pendentes = set(session.exec(select(OperacaoArmazenamento.chave).where(
+            OperacaoArmazenamento.status.in_(["pendente", "executando"])
+        )).all())
+
+        armazenamento = obter_armazenamento()
+        for prefixo in (PREFIXO_CONTEUDO, PREFIXO_RECEBENDO):
+            for chave, modificado_em in armazenamento.listar(prefixo):
+                if chave in usadas or chave in pendentes or modificado_em > limite_orfao:
+                    continue
+                agendar_exclusao(session, chave)
+                pendentes.add(chave)
+                agendadas += 1
+
+        session.commit()
+
+    if agendadas:
+        print(f"🧹 Reconciliação do armazenamento: {agendadas} objeto(s) sem dono agendado(s) para exclusão.")
+    return agendadas
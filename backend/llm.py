@@ -0,0 +1,276 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from datetime import date
+from dotenv import load_dotenv
+
+# Provedores de IA. Todo o código chama a IA por aqui (gerar, gerar_stream_async, contar_tokens),
+# e LLM_PROVEDOR escolhe quem responde:
+#   "gemini" - Google Gemini, com um cliente único para o processo inteiro
+#              (criar um genai.Client por chamada jogava fora o pool de conexões HTTP e a sessão TLS)
+#   "local"  - respostas simuladas, sem rede nem cota, com latência configurável (testes de carga)
+
+load_dotenv()
+
+LLM_PROVEDOR = os.getenv("LLM_PROVEDOR", "gemini").lower()
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # segundos por chamada
+LLM_TENTATIVAS = int(os.getenv("LLM_TENTATIVAS", "3"))  # inclui a primeira tentativa
+LLM_MAX_CONEXOES = int(os.getenv("LLM_MAX_CONEXOES", "20"))
+LLM_AQUECER = os.getenv("LLM_AQUECER", "0") == "1"
+
+# Provedor local
+LLM_LOCAL_LATENCIA = os.getenv("LLM_LOCAL_LATENCIA", "lognormal:1.5,0.4")  # ver _sortear_latencia
+LLM_LOCAL_PRIMEIRO_TOKEN = float(os.getenv("LLM_LOCAL_PRIMEIRO_TOKEN", "0.3"))  # fração da latência até o 1º pedaço do stream
+LLM_LOCAL_TOKENS_RESPOSTA = int(os.getenv("LLM_LOCAL_TOKENS_RESPOSTA", "200"))
+LLM_LOCAL_RESPOSTAS = os.getenv("LLM_LOCAL_RESPOSTAS")  # JSON opcional {"trecho do prompt": "resposta"}
+LLM_LOCAL_SEMENTE = int(os.getenv("LLM_LOCAL_SEMENTE", "0"))
+
+chave_secreta = os.getenv("GEMINI_API_KEY")
+
+if LLM_PROVEDOR == "gemini" and not chave_secreta:
+    print("ERRO: Chave API não encontrada no arquivo .env")
+
+
+def estimar_tokens(texto: str) -> int:
+    """Aproximação de ~4 caracteres por token, usada quando o provedor não conta."""
+    return len(texto or "") // 4 + 1
+
+
+class ProvedorGemini:
+    nome = "gemini"
+
+    def __init__(self):
+        self.modelo_padrao = os.getenv("GEMINI_MODELO", "models/gemini-3-flash-preview")
+        self._cliente = None
+        self._trava = threading.Lock()
+
+    def obter_cliente(self):
+        """Cria o cliente na primeira vez (de forma segura entre threads) e reaproveita depois."""
+        if self._cliente is None:
+            with self._trava:
+                if self._cliente is None:
+                    if not chave_secreta:
+                        raise RuntimeError("GEMINI_API_KEY não configurada")
+
+                    # Importado aqui para o provedor local rodar sem o SDK do Gemini instalado
+                    import httpx
+                    from google import genai
+                    from google.genai import types
+
+                    # Conexões keep-alive reaproveitadas entre requisições (sync e async)
+                    limites = httpx.Limits(
+                        max_connections=LLM_MAX_CONEXOES,
+                        max_keepalive_connections=LLM_MAX_CONEXOES,
+                        keepalive_expiry=120
+                    )
+                    self._cliente = genai.Client(
+                        api_key=chave_secreta,
+                        http_options=types.HttpOptions(
+                            timeout=int(LLM_TIMEOUT * 1000),
+                            retry_options=types.HttpRetryOptions(attempts=LLM_TENTATIVAS),
+                            client_args={"limits": limites},
+                            async_client_args={"limits": limites}
+                        )
+                    )
+        return self._cliente
+
+    def _configuracao(self, esquema):
+        """Com um modelo Pydantic em `esquema`, o Gemini responde só JSON nesse formato."""
+        if esquema is None:
+            return None
+        from google.genai import types
+        return types.GenerateContentConfig(response_mime_type="application/json", response_schema=esquema)
+
+    def gerar(self, prompt: str, modelo: str = None, esquema=None) -> str:
+        return self.obter_cliente().models.generate_content(
+            model=modelo or self.modelo_padrao,
+            contents=prompt,
+            config=self._configuracao(esquema)
+        ).text
+
+    async def gerar_async(self, prompt: str, modelo: str = None, esquema=None) -> str:
+        resposta = await self.obter_cliente().aio.models.generate_content(
+            model=modelo or self.modelo_padrao,
+            contents=prompt,
+            config=self._configuracao(esquema)
+        )
+        return resposta.text
+
+    async def gerar_stream_async(self, prompt: str, modelo: str = None):
+        """Devolve os pedaços de texto conforme o modelo gera. Fechar o gerador encerra a conexão com a IA."""
+        fluxo = await self.obter_cliente().aio.models.generate_content_stream(
+            model=modelo or self.modelo_padrao,
+            contents=prompt
+        )
+        try:
+            async for parte in fluxo:
+                if parte.text:
+                    yield parte.text
+        finally:
+            fechar = getattr(fluxo, "aclose", None)
+            if fechar:
+                await fechar()
+
+    def contar_tokens(self, texto: str, modelo: str = None) -> int:
+        try:
+            return self.obter_cliente().models.count_tokens(
+                model=modelo or self.modelo_padrao,
+                contents=texto
+            ).total_tokens
+        except Exception as e:
+            print(f"Erro ao contar tokens no Gemini, usando estimativa: {e}")
+            return estimar_tokens(texto)
+
+    async def aquecer(self):
+        """
+        Abre as conexões (DNS + TLS) antes da primeira requisição de usuário.
+        Usa uma chamada barata de metadados do modelo, sem gastar tokens.
+        O cliente síncrono (rotas def) aquece numa thread, para não travar o event loop.
+        """
+        cliente = self.obter_cliente()
+        await asyncio.gather(
+            asyncio.to_thread(cliente.models.get, model=self.modelo_padrao),
+            cliente.aio.models.get(model=self.modelo_padrao)
+        )
+
+
+class ProvedorLocal:
+    """
+    Responde sem rede: mesmo prompt, mesma resposta e mesma latência (dada a semente).
+    Prompts que pedem JSON recebem um objeto com as chaves citadas no prompt.
+    """
+    nome = "local"
+
+    def __init__(self):
+        self.modelo_padrao = "local-simulado"
+        self.respostas = {}
+        if LLM_LOCAL_RESPOSTAS:
+            with open(LLM_LOCAL_RESPOSTAS, encoding="utf-8") as arquivo:
+                self.respostas = json.load(arquivo)
+
+    def _sorteio(self, prompt: str) -> random.Random:
+        semente = hashlib.sha256(f"{LLM_LOCAL_SEMENTE}:{prompt}".encode("utf-8")).hexdigest()
+        return random.Random(semente)
+
+    def _sortear_latencia(self, prompt: str) -> float:
+        """
+        LLM_LOCAL_LATENCIA, em segundos:
+          "fixa:1.0", "uniforme:0.5,2.0", "normal:1.2,0.3" (média, desvio) ou "lognormal:1.5,0.4" (mediana, sigma)
+        """
+        distribuicao, _, parametros = LLM_LOCAL_LATENCIA.partition(":")
+        valores = [float(v) for v in parametros.split(",") if v.strip()]
+        sorteio = self._sorteio(prompt)
+
+        if distribuicao == "fixa":
+            latencia = valores[0]
+        elif distribuicao == "uniforme":
+            latencia = sorteio.uniform(valores[0], valores[1])
+        elif distribuicao == "normal":
+            latencia = sorteio.gauss(valores[0], valores[1])
+        elif distribuicao == "lognormal":
+            latencia = valores[0] * sorteio.lognormvariate(0, valores[1])
+        else:
+            raise ValueError(f"LLM_LOCAL_LATENCIA inválida: {LLM_LOCAL_LATENCIA}")
+        return max(latencia, 0.0)
+
+    def _responder(self, prompt: str, esquema=None) -> str:
+        for trecho, resposta in self.respostas.items():
+            if trecho in prompt:
+                return resposta
+
+        if esquema is not None or ("JSON" in prompt and "NÃO retorne JSON" not in prompt):
+            if esquema is not None:
+                chaves = list(esquema.model_fields)
+            else:
+                chaves = list(dict.fromkeys(re.findall(r'"(\w+)"\s*:', prompt)))
+            return json.dumps({
+                chave: date.today().isoformat() if chave.startswith("data") else f"{chave} (simulado)"
+                for chave in chaves
+            }, ensure_ascii=False)
+
+        sorteio = self._sorteio(prompt)
+        palavras = re.findall(r"\w{4,}", prompt[-4000:]) or ["resposta"]
+        corpo = " ".join(sorteio.choice(palavras) for _ in range(LLM_LOCAL_TOKENS_RESPOSTA))
+        return f"**Resposta simulada ({self.nome})**\n\n{corpo}"
+
+    def _pedacos(self, texto: str) -> list:
+        return re.findall(r"\S+\s*", texto) or [texto]
+
+    def gerar(self, prompt: str, modelo: str = None, esquema=None) -> str:
+        time.sleep(self._sortear_latencia(prompt))
+        return self._responder(prompt, esquema)
+
+    async def gerar_async(self, prompt: str, modelo: str = None, esquema=None) -> str:
+        await asyncio.sleep(self._sortear_latencia(prompt))
+        return self._responder(prompt, esquema)
+
+    async def gerar_stream_async(self, prompt: str, modelo: str = None):
+        latencia = self._sortear_latencia(prompt)
+        pedacos = self._pedacos(self._responder(prompt))
+        await asyncio.sleep(latencia * LLM_LOCAL_PRIMEIRO_TOKEN)
+        intervalo = latencia * (1 - LLM_LOCAL_PRIMEIRO_TOKEN) / len(pedacos)
+        for i, pedaco in enumerate(pedacos):
+            if i:
+                await asyncio.sleep(intervalo)
+            yield pedaco
+
+    def contar_tokens(self, texto: str, modelo: str = None) -> int:
+        return estimar_tokens(texto)
+
+    async def aquecer(self):
+        pass
+
+
+PROVEDORES = {
+    "gemini": ProvedorGemini,
+    "local": ProvedorLocal,
+}
+
+_provedor = None
+_trava = threading.Lock()
+
+
+def obter_provedor():
+    """Instancia o provedor escolhido em LLM_PROVEDOR uma única vez."""
+    global _provedor
+    if _provedor is None:
+        with _trava:
+            if _provedor is None:
+                if LLM_PROVEDOR not in PROVEDORES:
+                    raise RuntimeError(f"LLM_PROVEDOR desconhecido: {LLM_PROVEDOR}")
+                _provedor = PROVEDORES[LLM_PROVEDOR]()
+    return _provedor
+
+
+def modelo_padrao() -> str:
+    return obter_provedor().modelo_padrao
+
+
+def gerar(prompt: str, modelo: str = None, esquema=None) -> str:
+    return obter_provedor().gerar(prompt, modelo=modelo, esquema=esquema)
+
+
+async def gerar_async(prompt: str, modelo: str = None, esquema=None) -> str:
+    return await obter_provedor().gerar_async(prompt, modelo=modelo, esquema=esquema)
+
+
+def gerar_stream_async(prompt: str, modelo: str = None):
+    return obter_provedor().gerar_stream_async(prompt, modelo=modelo)
+
+
+def contar_tokens(texto: str, modelo: str = None) -> int:
+    return obter_provedor().contar_tokens(texto, modelo=modelo)
+
+
+async def aquecer():
+    try:
+        provedor = obter_provedor()
+        await provedor.aquecer()
+        print(f"🔥 Provedor de IA aquecido ({provedor.nome}).")
+    except Exception as e:
+        print(f"Não foi possível aquecer o provedor de IA: {e}")
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlmodel import Session, select
+
+from database import engine, create_db_and_tables
+from models import Processo, Usuario, Tarefa, ResumoIA
+from documentos import buscar_documento
+from ingestao import enfileirar_ingestao
+from ia import TEMPLATE_RESUMO_PROCESSO, montar_prompt_resumo
+from fila_ia import gerar_resumo_processo
+from resumo_longo import resumir
+from llm import obter_provedor
+
+# Reanálise em lote: preenche resumo_ia de todos os processos do usuário que ainda não têm
+# (ou cujo resumo saiu de outro PDF/prompt). O progresso fica salvo na Tarefa, então dá para
+# retomar depois de uma queda sem refazer o que já foi feito.
+
+LOTE_IA_PARALELISMO = int(os.getenv("LOTE_IA_PARALELISMO", "4"))
+
+# Um pool para todos os lotes: dois cliques ou vários usuários não multiplicam as threads.
+# As chamadas à IA ainda passam pelo limite global de fila_ia (ANALISE_IA_WORKERS).
+_executor = ThreadPoolExecutor(max_workers=LOTE_IA_PARALELISMO, thread_name_prefix="lote-ia")
+_em_execucao = set()
+_trava_execucao = threading.Lock()
+
+# Parágrafo repetido para montar o corpus fixo do --bench
+_PARAGRAFO_BENCH = (
+    "O autor ajuizou a presente ação em face do réu, alegando descumprimento do contrato firmado entre as partes, "
+    "com pedido de indenização por danos materiais e morais. Foi designada audiência de conciliação e o réu, "
+    "citado, apresentou contestação impugnando os valores. Os autos vieram conclusos para decisão. "
+)
+
+
+def selecionar_processos(session: Session, usuario_id: int, incluir_desatualizados: bool = True) -> list:
+    """Ids dos processos com PDF e sem resumo (ou com resumo de outro documento/prompt)."""
+    processos = session.exec(select(Processo).where(
+        Processo.usuario_id == usuario_id,
+        Processo.arquivo_pdf != None  # noqa: E711
+    )).all()
+
+    origens = {}
+    if incluir_desatualizados:
+        ids = [p.id for p in processos]
+        origens = {o.processo_id: o for o in session.exec(select(ResumoIA).where(ResumoIA.processo_id.in_(ids))).all()}
+
+    selecionados = []
+    for processo in processos:
+        if not processo.resumo_ia:
+            selecionados.append(processo.id)
+            continue
+
+        origem = origens.get(processo.id)
+        if not incluir_desatualizados or not origem:
+            # Resumo antigo sem registro de origem: não dá para saber se está desatualizado
+            continue
+
+        documento = buscar_documento(session, processo.arquivo_pdf)
+        if origem.template != TEMPLATE_RESUMO_PROCESSO or (documento and documento.hash_conteudo != origem.hash_documento):
+            selecionados.append(processo.id)
+
+    return selecionados
+
+
+def lote_em_andamento(session: Session, usuario_id: int):
+    """O lote do usuário que ainda não terminou, se houver."""
+    return session.exec(select(Tarefa).where(
+        Tarefa.tipo == "analise_lote",
+        Tarefa.usuario_id == usuario_id,
+        Tarefa.status.in_(["pendente", "processando"])
+    ).order_by(Tarefa.id)).first()
+
+
+def criar_lote(session: Session, usuario_id: int, incluir_desatualizados: bool = True) -> Tarefa:
+    pendentes = selecionar_processos(session, usuario_id, incluir_desatualizados)
+    checkpoint = {
+        "total": len(pendentes),
+        "pendentes": pendentes,
+        "concluidos": 0,
+        "falhas": {},
+        "tokens_estimados": 0,
+        "segundos": 0.0,
+    }
+    tarefa = Tarefa(
+        tipo="analise_lote",
+        usuario_id=usuario_id,
+        status="pendente" if pendentes else "concluida",
+        progresso=0 if pendentes else 100,
+        resultado=json.dumps(checkpoint)
+    )
+    session.add(tarefa)
+    session.commit()
+    session.refresh(tarefa)
+    return tarefa
+
+
+def _vazao(checkpoint: dict) -> dict:
+    minutos = checkpoint["segundos"] / 60
+    return {
+        "docs_por_minuto": round(checkpoint["concluidos"] / minutos, 2) if minutos else 0.0,
+        "tokens_por_minuto": round(checkpoint["tokens_estimados"] / minutos) if minutos else 0,
+    }
+
+
+def _preparar_e_resumir(processo_id: int) -> dict:
+    """Garante o texto do PDF (lendo na hora se preciso) e gera o resumo."""
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+        if not processo or not processo.arquivo_pdf:
+            raise ValueError("Processo sem PDF.")
+
+        documento = buscar_documento(session, processo.arquivo_pdf)
+        if not documento or documento.status != "pronto":
+            # Em lote não esperamos a fila de ingestão: lemos o PDF aqui mesmo
+            if documento:
+                session.delete(documento)
+                session.commit()
+            enfileirar_ingestao(session, processo.arquivo_pdf, processo_id=processo.id, usuario_id=processo.usuario_id, em_segundo_plano=False)
+
+    return gerar_resumo_processo(processo_id)
+
+
+def executar_lote(tarefa_id: int):
+    with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+        if not tarefa or tarefa.status in ("concluida", "erro"):
+            return
+        checkpoint = json.loads(tarefa.resultado)
+        tarefa.status = "processando"
+        tarefa.atualizado_em = datetime.utcnow()
+        session.add(tarefa)
+        session.commit()
+
+    trava = threading.Lock()
+    inicio = time.perf_counter()
+    segundos_antes = checkpoint["segundos"]
+
+    def registrar(processo_id, resultado=None, erro=None):
+        # Checkpoint a cada processo: numa queda, só o que estava em andamento é refeito
+        with trava, Session(engine) as session:
+            checkpoint["pendentes"].remove(processo_id)
+            if erro:
+                checkpoint["falhas"][str(processo_id)] = erro
+            else:
+                checkpoint["concluidos"] += 1
+                checkpoint["tokens_estimados"] += resultado["tokens_estimados"]
+            checkpoint["segundos"] = round(segundos_antes + time.perf_counter() - inicio, 2)
+            checkpoint.update(_vazao(checkpoint))
+
+            tarefa = session.get(Tarefa, tarefa_id)
+            feitos = checkpoint["total"] - len(checkpoint["pendentes"])
+            tarefa.progresso = int(100 * feitos / max(checkpoint["total"], 1))
+            tarefa.resultado = json.dumps(checkpoint)
+            tarefa.atualizado_em = datetime.utcnow()
+            session.add(tarefa)
+            session.commit()
+
+    futuros = {_executor.submit(_preparar_e_resumir, pid): pid for pid in list(checkpoint["pendentes"])}
+    for futuro in as_completed(futuros):
+        processo_id = futuros[futuro]
+        try:
+            registrar(processo_id, resultado=futuro.result())
+        except Exception as e:
+            print(f"Lote {tarefa_id}: erro no processo {processo_id}: {e}")
+            registrar(processo_id, erro=str(e))
+
+    with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+        tarefa.status = "concluida"
+        tarefa.progresso = 100
+        tarefa.atualizado_em = datetime.utcnow()
+        session.add(tarefa)
+        session.commit()
+
+    vazao = _vazao(checkpoint)
+    print(
+        f"✅ Lote {tarefa_id}: {checkpoint['concluidos']}/{checkpoint['total']} resumos, "
+        f"{len(checkpoint['falhas'])} falha(s), {vazao['docs_por_minuto']} docs/min, "
+        f"{vazao['tokens_por_minuto']} tokens/min"
+    )
+
+
+def corpus_bench(documentos: int) -> list:
+    """Corpus fixo: documentos de 2 a 31 páginas (curtos vão direto, longos passam pelo mapa e redução)."""
+    corpus = []
+    for i in range(documentos):
+        paginas = [f"Página {p + 1} do processo {i + 1}. " + _PARAGRAFO_BENCH * 8 for p in range(2 + (i * 7) % 30)]
+        corpus.append(paginas)
+    return corpus
+
+
+def bench(documentos: int = 20, paralelismo: int = LOTE_IA_PARALELISMO) -> dict:
+    """
+    Mede a vazão do lote (docs/min e tokens/min) com o mesmo resumo e paralelismo da reanálise,
+    sem banco nem armazenamento. Use com LLM_PROVEDOR=local para não gastar cota.
+    """
+    # Hash novo a cada execução: o cache das respostas não entra na medida
+    rodada = uuid.uuid4().hex
+    corpus = corpus_bench(documentos)
+    checkpoint = {"concluidos": 0, "tokens_estimados": 0, "segundos": 0.0}
+
+    def resumir_documento(indice):
+        hash_documento = hashlib.sha256(f"{rodada}:{indice}".encode()).hexdigest()
+        return resumir(corpus[indice], montar_prompt_resumo, TEMPLATE_RESUMO_PROCESSO, hash_documento)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=paralelismo, thread_name_prefix="lote-ia-bench") as executor:
+        for resultado in executor.map(resumir_documento, range(documentos)):
+            checkpoint["concluidos"] += 1
+            checkpoint["tokens_estimados"] += resultado["estatisticas"]["tokens_total"]
+    checkpoint["segundos"] = round(time.perf_counter() - inicio, 2)
+    return {**checkpoint, **_vazao(checkpoint), "paginas": sum(len(d) for d in corpus)}
+
+
+def executar_em_segundo_plano(tarefa_id: int):
+    """Roda o lote numa thread, a menos que ele já esteja rodando."""
+    with _trava_execucao:
+        if tarefa_id in _em_execucao:
+            return
+        _em_execucao.add(tarefa_id)
+
+    def executar():
+        try:
+            executar_lote(tarefa_id)
+        finally:
+            with _trava_execucao:
+                _em_execucao.discard(tarefa_id)
+
+    threading.Thread(target=executar, name=f"lote-ia-{tarefa_id}", daemon=True).start()
+
+
+def retomar_lotes():
+    """Chamado na subida do servidor: continua os lotes que ficaram pela metade."""
+    with Session(engine) as session:
+        tarefas = session.exec(select(Tarefa).where(
+            Tarefa.tipo == "analise_lote",
+            Tarefa.status.in_(["pendente", "processando"])
+        )).all()
+    for tarefa in tarefas:
+        executar_em_segundo_plano(tarefa.id)
+    if tarefas:
+        print(f"🔁 {len(tarefas)} lote(s) de análise retomado(s).")
+
+
+if __name__ == "__main__":
+    # Uso: python lote_ia.py --email advogado@escritorio.com [--sem-desatualizados]
+    #      python lote_ia.py --retomar 42
+    #      LLM_PROVEDOR=local python -m lote_ia --bench [--documentos 20]
+    parser = argparse.ArgumentParser(description="Gera o resumo da IA para os processos sem resumo.")
+    parser.add_argument("--email", help="Usuário dono dos processos")
+    parser.add_argument("--sem-desatualizados", action="store_true", help="Não refaz resumos de PDFs/prompts antigos")
+    parser.add_argument("--retomar", type=int, help="Id de um lote interrompido")
+    parser.add_argument("--bench", action="store_true", help="Mede docs/min e tokens/min num corpus fixo, sem banco")
+    parser.add_argument("--documentos", type=int, default=20, help="Tamanho do corpus do --bench")
+    args = parser.parse_args()
+
+    if args.bench:
+        resultado = bench(args.documentos)
+        print(
+            f"⏱️  {resultado['concluidos']} documento(s), {resultado['paginas']} página(s) em {resultado['segundos']}s "
+            f"({obter_provedor().nome}, paralelismo {LOTE_IA_PARALELISMO}) | "
+            f"{resultado['docs_por_minuto']} docs/min, {resultado['tokens_por_minuto']} tokens/min"
+        )
+        sys.exit(0)
+
+    create_db_and_tables()
+
+    if args.retomar:
+        tarefa_id = args.retomar
+    elif args.email:
+        with Session(engine) as session:
+            usuario = session.exec(select(Usuario).where(Usuario.email == args.email)).first()
+            if not usuario:
+                sys.exit("Usuário não encontrado.")
+            em_andamento = lote_em_andamento(session, usuario.id)
+            if em_andamento:
+                sys.exit(f"Já existe um lote em andamento: use --retomar {em_andamento.id}.")
+            tarefa = criar_lote(session, usuario.id, incluir_desatualizados=not args.sem_desatualizados)
+            tarefa_id = tarefa.id
+        print(f"Lote {tarefa_id} criado (use --retomar {tarefa_id} se for interrompido).")
+    else:
+        parser.error("informe --email ou --retomar")
+
+    executar_lote(tarefa_id)
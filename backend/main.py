@@ -9,57 +9,58 @@ import io
 import base64
 import json
 import time
+import asyncio
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from apscheduler.schedulers.background import BackgroundScheduler
-from google import genai
 
 from ntpath import basename
 from fastapi import Body
 from fastapi.responses import StreamingResponse
 from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi import UploadFile, File
 from typing import Optional
-from fastapi import FastAPI, Depends, Header, status
+from fastapi import FastAPI, Depends, Header, Request, status
 from sqlmodel import Field, SQLModel, create_engine, Session, select
 from fastapi import HTTPException # Adicione isso aos seus imports
-from security import oauth2_scheme, verificar_token
+from security import oauth2_scheme
+from autenticacao import obter_usuario_atual, esquecer_usuario
 from fastapi.security import OAuth2PasswordRequestForm # Adicione este
 from datetime import date, timedelta # Adicione ao topo
 from fastapi.middleware.cors import CORSMiddleware
-from pypdf import PdfReader
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from dotenv import load_dotenv
 
 
 # Importamos nossas próprias criações:
-from ia import analisar_documento
-from models import Processo, Usuario, UsuarioCreate, Financeiro, Cliente
-from database import engine, create_db_and_tables
+from ia import analisar_documento, montar_prompt_resumo, montar_prompt_chat, completar_extracao, obter_estatisticas_extracao, TEMPLATE_RESUMO_PROCESSO, TEMPLATE_CHAT
+from models import Processo, Usuario, UsuarioAtual, UsuarioCreate, Financeiro, Cliente, Tarefa, ResumoIA, SessaoChat, MensagemChat, Documento
+from database import engine, create_db_and_tables, estatisticas_pool
 from security import criar_token_acesso, gerar_hash_senha, oauth2_scheme, verificar_senha, gerar_segredo_2fa, verificar_codigo_2fa
-import boto3
+from armazenamento import obter_armazenamento, hash_da_chave, conferir_link, link_download
+from envios import receber_arquivo, receber_fluxo, finalizar_fluxo, registrar_envio_direto, chave_envio_direto, ArquivoGrandeDemais, UPLOAD_TAMANHO_MAX, UPLOAD_LINK_VALIDADE, RE_HASH, armazenar_envio, guardar_envio, buscar_envio, dados_extraidos, salvar_dados_extraidos
+from documentos import paginas_documento, invalidar_documento, buscar_documento
+from limpeza import executar_exclusoes, reconciliar, LIMPEZA_INTERVALO, LIMPEZA_RECONCILIAR_HORAS
+from anexos import registrar_documento, listar_documentos, remover_documento, apagar_se_orfao, gerar_zip
+from resumo_longo import preparar_prompt_final
+from ingestao import enfileirar_ingestao, garantir_documento, retomar_ingestoes_pendentes
+from extracao import extrair_paginas, encerrar_pool
+from extrator_regras import extrair_campos, CAMPOS, EXTRACAO_CONFIANCA_MIN
+from busca import selecionar_contexto
+from fila_ia import enfileirar_analise, iniciar_workers, salvar_resumo, FilaCheia
+from lote_ia import criar_lote, lote_em_andamento, executar_em_segundo_plano, retomar_lotes
+from sessoes_chat import criar_sessao, obter_sessao, listar_mensagens, registrar_troca, digest_historico, janela_recente, contar_tokens_prompt
+from llm import aquecer, LLM_AQUECER
+from cache_ia import gerar_texto, gerar_texto_async, gerar_texto_stream_async, obter_estatisticas
 from botocore.exceptions import NoCredentialsError
-from botocore.config import Config
 
 # 1. Carrega as variáveis do arquivo .env
 load_dotenv()
 
-s3_client = boto3.client('s3',
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION"),
-    config=Config(signature_version='s3v4')
-)
-
-# 2. Pega a chave do ambiente seguro
-chave_secreta = os.getenv("GEMINI_API_KEY")
-
-if not chave_secreta:
-    print("ERRO: Chave API não encontrada no arquivo .env")
-else:
-    # 3. Configura o Gemini
-    genai.Client(api_key=chave_secreta)
-
 app = FastAPI()
 
 app.add_middleware(
@@ -69,21 +70,45 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.middleware("http")
+async def limitar_tamanho_corpo(request: Request, call_next):
+    # Upload acima do limite é recusado antes de ler o corpo (quando o cliente informa o tamanho)
+    tamanho = request.headers.get("content-length")
+    if tamanho and tamanho.isdigit() and int(tamanho) > UPLOAD_TAMANHO_MAX:
+        return JSONResponse(status_code=413, content={"detail": _mensagem_tamanho_max()})
+    return await call_next(request)
+
+def _mensagem_tamanho_max():
+    return f"Arquivo maior que o limite de {UPLOAD_TAMANHO_MAX // (1024 * 1024)} MB"
+
 # Isso roda quando o servidor liga
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    retomar_ingestoes_pendentes()
+    iniciar_workers()
+    retomar_lotes()
+
+@app.on_event("startup")
+async def aquecer_ia():
+    # Opcional (LLM_AQUECER=1): a primeira pergunta de usuário não paga o handshake com o Gemini
+    if LLM_AQUECER:
+        await aquecer()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    encerrar_pool()
 
 @app.get("/")
 def home():
     return {"mensagem": "Sistema conectado ao Banco de Dados!"}
 
 @app.post("/2fa/setup")
-def setup_2fa(token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def setup_2fa(usuario_atual: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
+        usuario = session.get(Usuario, usuario_atual.id)
 
         # 1. Gera um segredo aleatório se ele não tiver
         if not usuario.totp_secret:
@@ -109,11 +134,7 @@ def setup_2fa(token: str = Depends(oauth2_scheme)):
         return {"qr_code_b64": img_b64, "segredo": usuario.totp_secret}
 
 @app.post("/processos")
-def criar_processo(processo: Processo, token: str = Depends(oauth2_scheme)):
-
-    email_user = verificar_token(token)
-    if not email_user:
-        raise HTTPException(status_code=401, detail="Token inválido")
+def criar_processo(processo: Processo, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
         # 1. Verificar se o número já existe
@@ -126,7 +147,6 @@ def criar_processo(processo: Processo, token: str = Depends(oauth2_scheme)):
                 status_code=400, 
                 detail=f"Já existe um processo com este número (ID: {existente.id}).")
 
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
         processo.usuario_id = usuario.id
 
         if processo.data_prazo and isinstance(processo.data_prazo, str):
@@ -142,34 +162,24 @@ def criar_processo(processo: Processo, token: str = Depends(oauth2_scheme)):
         return processo
 
 @app.get('/processos')
-def listar_processos(token: str = Depends(oauth2_scheme)):
-
-    email = verificar_token(token)
-    if not email:
-        raise HTTPException(status_code=401, detail="Token inválido ou expirado")
+def listar_processos(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email)).first()
-
         instrucao = select(Processo).where(Processo.usuario_id == usuario.id)
         resultados = session.exec(instrucao).all()
         return resultados
 
 @app.put("/processos/{processo_id}")
-def atualizar_processos(processo_id: int, processo_atualizado: Processo, token: str = Depends(oauth2_scheme)):
-    email_usuario = verificar_token(token)
+def atualizar_processos(processo_id: int, processo_atualizado: Processo, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        # 1. Identifica quem está logado
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_usuario)).first()
-
-        # 2. Busca o processo pelo ID
+        # 1. Busca o processo pelo ID (quem está logado já vem da dependência)
         db_processo = session.get(Processo, processo_id)
 
         if not db_processo:
             return {"erro": "Processo não encontrado"}
 
-        # 3. TRAVA DE SEGURANÇA: O processo pertence a quem está logado?
+        # 2. TRAVA DE SEGURANÇA: O processo pertence a quem está logado?
         if db_processo.usuario_id != usuario.id:
             raise HTTPException(status_code=403, detail="Você não tem permissao para alterar este processo")
 
@@ -182,50 +192,281 @@ def atualizar_processos(processo_id: int, processo_atualizado: Processo, token:
         session.refresh(db_processo)
         return db_processo
 
+def _vincular_anexo(session: Session, processo: Processo, usuario: UsuarioAtual, envio, nome: str = None) -> dict:
+    """
+    Acrescenta o arquivo aos documentos do processo, faz dele o principal
+    e agenda a leitura do texto, se ainda não foi lido.
+    """
+    # O anexo anterior continua na lista de documentos do processo
+    listar_documentos(session, processo)
+    documento = registrar_documento(session, processo, envio, nome)
+
+    # Salva o caminho no banco de dados
+    processo.arquivo_pdf = envio.chave
+    session.add(processo)
+    session.commit()
+    session.refresh(processo)
+    session.refresh(documento)
+
+    # O mesmo PDF em outro processo (ou no auto preenchimento) já teve o texto lido: reaproveitamos
+    texto = buscar_documento(session, envio.chave)
+    if texto and texto.status == "erro":
+        invalidar_documento(session, envio.chave)
+        session.commit()
+        texto = None
+
+    tarefa_id = None
+    if not texto or texto.status != "pronto":
+        # A leitura do PDF acontece em segundo plano; o cliente acompanha por /tarefas/{id}
+        tarefa_id = enfileirar_ingestao(session, envio.chave, processo_id=processo.id, usuario_id=usuario.id).id
+
+    return {
+        "mensagem": "Arquivo salvo na nuvem AWS!",
+        "caminho": processo.arquivo_pdf,
+        "hash": envio.hash_conteudo,
+        "documento_id": documento.id,
+        "tarefa_id": tarefa_id
+    }
+
 @app.post("/processos/{processo_id}/anexo")
 def anexar_arquivo(
     processo_id: int,
     arquivo: UploadFile = File(...),
-    token: str = Depends(oauth2_scheme)
+    usuario: UsuarioAtual = Depends(obter_usuario_atual)
 ):
-    email_user = verificar_token(token)
 
     with Session(engine) as session:
         #Busca o processo
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
         processo = session.get(Processo, processo_id)
 
         if not processo or processo.usuario_id != usuario.id:
             raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
 
-        nome_s3 = f"{processo.id}/{arquivo.filename}"
-
+        # O hash é calculado enquanto o upload é lido; um PDF já guardado não é reenviado ao armazenamento
         try:
-            s3_client.upload_fileobj(
-                arquivo.file,
-                os.getenv("AWS_BUCKET_NAME"),
-                nome_s3
-            )
+            hash_conteudo, tamanho, temporario = receber_arquivo(arquivo.file)
+        except ArquivoGrandeDemais:
+            raise HTTPException(status_code=413, detail=_mensagem_tamanho_max())
+        try:
+            envio, _ = armazenar_envio(session, hash_conteudo, tamanho, temporario, nome_original=arquivo.filename, usuario_id=usuario.id)
         except NoCredentialsError:
             raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao enviar arquivo para S3: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Erro ao guardar o arquivo: {str(e)}")
+        finally:
+            temporario.close()
 
-        # Salva o caminho no banco de dados
-        processo.arquivo_pdf = nome_s3
-        session.add(processo)
-        session.commit()
+        return _vincular_anexo(session, processo, usuario, envio)
+
+@app.post("/processos/{processo_id}/anexo/fluxo")
+async def anexar_arquivo_fluxo(
+    processo_id: int,
+    request: Request,
+    nome: str = "documento.pdf",
+    usuario: UsuarioAtual = Depends(obter_usuario_atual)
+):
+    """
+    Anexo com o PDF cru no corpo (Content-Type: application/pdf), sem multipart.
+    O arquivo segue para o armazenamento em partes enquanto chega, sem passar inteiro pela memória ou disco da API.
+    """
+
+    def conferir_acesso():
+        with Session(engine) as session:
+            processo = session.get(Processo, processo_id)
+            return bool(processo and processo.usuario_id == usuario.id)
+
+    # Confere o dono antes de aceitar qualquer byte do arquivo
+    if not await run_in_threadpool(conferir_acesso):
+        raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
+
+    try:
+        hash_conteudo, tamanho, chave_temporaria = await receber_fluxo(request.stream())
+    except ArquivoGrandeDemais:
+        raise HTTPException(status_code=413, detail=_mensagem_tamanho_max())
+    except ClientDisconnect:
+        # receber_fluxo já cancelou o upload e apagou o objeto parcial; não há a quem responder
+        return Response(status_code=499)
+    except NoCredentialsError:
+        raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao guardar o arquivo: {str(e)}")
+
+    if not tamanho:
+        await run_in_threadpool(obter_armazenamento().apagar, chave_temporaria)
+        raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
+
+    def vincular():
+        with Session(engine) as session:
+            processo = session.get(Processo, processo_id)
+            envio, _ = finalizar_fluxo(session, hash_conteudo, tamanho, chave_temporaria, nome_original=nome, usuario_id=usuario.id)
+            return _vincular_anexo(session, processo, usuario, envio)
+
+    return await run_in_threadpool(vincular)
+
+@app.post("/processos/{processo_id}/anexo/link-envio")
+def gerar_link_envio(processo_id: int, dados: dict = Body(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """
+    Upload direto ao S3: o cliente informa hash (SHA-256), tamanho e nome, recebe uma URL pré-assinada,
+    manda o PDF para ela e chama /anexo/concluir. Os bytes não passam pela API.
+    """
+    hash_conteudo = (dados.get("hash") or "").lower()
+    tamanho = dados.get("tamanho")
+
+    if not RE_HASH.match(hash_conteudo):
+        raise HTTPException(status_code=400, detail="Hash SHA-256 inválido")
+    if not isinstance(tamanho, int) or tamanho <= 0:
+        raise HTTPException(status_code=400, detail="Tamanho inválido")
+    if tamanho > UPLOAD_TAMANHO_MAX:
+        raise HTTPException(status_code=413, detail=_mensagem_tamanho_max())
+
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+
+        if not processo or processo.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
+
+        # Só pula o upload se este usuário já mandou o mesmo conteúdo. Responder pelo que outro
+        # escritório guardou diria a qualquer um se um documento existe no servidor
+        if buscar_envio(session, hash_conteudo, usuario_id=usuario.id):
+            return {"ja_enviado": True, "hash": hash_conteudo}
+
+    try:
+        link = obter_armazenamento().link_envio(
+            chave_envio_direto(hash_conteudo, usuario.id), tamanho, hash_conteudo, expira_em=UPLOAD_LINK_VALIDADE
+        )
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=f"{e}. Use /processos/{{id}}/anexo/fluxo.")
+    except NoCredentialsError:
+        raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
+
+    return {"ja_enviado": False, "hash": hash_conteudo, "expira_em": UPLOAD_LINK_VALIDADE, **link}
+
+@app.post("/processos/{processo_id}/anexo/concluir")
+def concluir_envio_direto(processo_id: int, dados: dict = Body(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """Confere o objeto enviado pelo link (existe, tamanho e SHA-256), anexa ao processo e agenda a leitura do texto."""
+    hash_conteudo = (dados.get("hash") or "").lower()
+    if not RE_HASH.match(hash_conteudo):
+        raise HTTPException(status_code=400, detail="Hash SHA-256 inválido")
+
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+
+        if not processo or processo.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
+
+        try:
+            envio = registrar_envio_direto(session, hash_conteudo, usuario.id, nome_original=dados.get("nome"))
+        except NoCredentialsError:
+            raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
+        if not envio:
+            raise HTTPException(status_code=409, detail="Arquivo não encontrado ou diferente do declarado. Envie novamente.")
+
+        return _vincular_anexo(session, processo, usuario, envio)
+
+@app.post("/processos/{processo_id}/anexo/por-hash")
+def anexar_arquivo_por_hash(processo_id: int, dados: dict = Body(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """Anexa um PDF já enviado (ex: no auto preenchimento) sem mandar o arquivo de novo."""
+
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+
+        if not processo or processo.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
+
+        # Só o que este usuário já enviou: o hash sozinho não prova acesso ao arquivo
+        envio = buscar_envio(session, dados.get("hash"), usuario_id=usuario.id)
+        if not envio:
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado. Envie o PDF novamente.")
+
+        return _vincular_anexo(session, processo, usuario, envio)
+
+def _processo_do_usuario(session: Session, processo_id: int, usuario: UsuarioAtual):
+    processo = session.get(Processo, processo_id)
+    if not processo or processo.usuario_id != usuario.id:
+        raise HTTPException(status_code=404, detail="Processo não encontrado ou acesso negado")
+    return processo
+
+@app.get("/processos/{processo_id}/documentos")
+def listar_documentos_processo(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        processo = _processo_do_usuario(session, processo_id, usuario)
+        return [
+            {**documento.model_dump(), "principal": documento.chave == processo.arquivo_pdf}
+            for documento in listar_documentos(session, processo)
+        ]
+
+@app.post("/processos/{processo_id}/documentos")
+def adicionar_documento(processo_id: int, dados: dict = Body(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """
+    Acrescenta ao processo um PDF já guardado (pelo "hash" devolvido no upload ou no auto preenchimento).
+    O documento novo passa a ser o principal, como nas rotas de anexo.
+    """
+
+    with Session(engine) as session:
+        processo = _processo_do_usuario(session, processo_id, usuario)
+        # Só o que este usuário já enviou: o hash sozinho não prova acesso ao arquivo
+        envio = buscar_envio(session, dados.get("hash"), usuario_id=usuario.id)
+        if not envio:
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado. Envie o PDF novamente.")
+        return _vincular_anexo(session, processo, usuario, envio, nome=dados.get("nome"))
+
+@app.delete("/processos/{processo_id}/documentos/{documento_id}")
+def excluir_documento(processo_id: int, documento_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        processo = _processo_do_usuario(session, processo_id, usuario)
+        documento = session.get(Documento, documento_id)
+        if not documento or documento.processo_id != processo.id:
+            raise HTTPException(status_code=404, detail="Documento não encontrado")
+
+        remover_documento(session, processo, documento)
         session.refresh(processo)
+        return {"mensagem": "Documento removido", "arquivo_pdf": processo.arquivo_pdf}
 
-        return {"mensagem": "Arquivo salvo na nuvem AWS!", "caminho": processo.arquivo_pdf}
+@app.get("/processos/{processo_id}/documentos/zip")
+def exportar_documentos_zip(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """Todos os documentos do processo num ZIP, montado em fluxo enquanto é baixado."""
 
-@app.get("/processos/{processo_id}/download")
-def baixar_arquivo(processo_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+    with Session(engine) as session:
+        processo = _processo_do_usuario(session, processo_id, usuario)
+        itens = [(documento.nome, documento.chave) for documento in listar_documentos(session, processo)]
+        numero = processo.numero
+
+    if not itens:
+        raise HTTPException(status_code=404, detail="Processo sem documentos")
+
+    nome_zip = "".join(c if c.isalnum() or c in "-._" else "_" for c in numero) or f"processo_{processo_id}"
+    return StreamingResponse(
+        gerar_zip(itens),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nome_zip}.zip"'}
+    )
+
+@app.get("/tarefas/{tarefa_id}")
+def consultar_tarefa(tarefa_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
+        tarefa = session.get(Tarefa, tarefa_id)
+
+        if not tarefa or tarefa.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+
+        return {
+            "id": tarefa.id,
+            "tipo": tarefa.tipo,
+            "status": tarefa.status,
+            "progresso": tarefa.progresso,
+            "processo_id": tarefa.processo_id,
+            "resultado": json.loads(tarefa.resultado) if tarefa.resultado else None,
+            "erro": tarefa.erro,
+            "atualizado_em": tarefa.atualizado_em
+        }
+
+@app.get("/processos/{processo_id}/download")
+def baixar_arquivo(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
+    with Session(engine) as session:
         processo = session.get(Processo, processo_id)
 
         if not processo or processo.usuario_id != usuario.id:
@@ -235,27 +476,56 @@ def baixar_arquivo(processo_id: int, token: str = Depends(oauth2_scheme)):
              raise HTTPException(status_code=404, detail="Sem anexo")
 
         try:
-
-            url = s3_client.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": os.getenv("AWS_BUCKET_NAME"),
-                    "Key": processo.arquivo_pdf
-                },
-                ExpiresIn=3600
-            )
-            return {"url_download": url}
+            # Link já assinado para este usuário é reaproveitado enquanto tiver validade de sobra
+            url, expira_em = link_download(processo.arquivo_pdf, usuario.id)
+            return {"url_download": url, "expira_em": expira_em}
         except NoCredentialsError:
             raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao gerar URL de download: {str(e)}")
 
+@app.post("/processos/links-download")
+def links_download(dados: dict = Body(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+    """
+    Links de download de vários processos numa requisição só (para listas).
+    Recebe {"ids": [1, 2, ...]} e devolve {"links": {id: {url_download, expira_em}}};
+    processos sem anexo ou de outro usuário ficam de fora.
+    """
+    ids = [i for i in (dados.get("ids") or []) if isinstance(i, int)][:500]
+
+    with Session(engine) as session:
+        processos = session.exec(
+            select(Processo).where(Processo.id.in_(ids), Processo.usuario_id == usuario.id)
+        ).all() if ids else []
+
+        links = {}
+        try:
+            for processo in processos:
+                if processo.arquivo_pdf:
+                    url, expira_em = link_download(processo.arquivo_pdf, usuario.id)
+                    links[processo.id] = {"url_download": url, "expira_em": expira_em}
+        except NoCredentialsError:
+            raise HTTPException(status_code=500, detail="Credenciais AWS não configuradas")
+        return {"links": links}
+
+@app.get("/arquivos/{chave:path}")
+def baixar_arquivo_local(chave: str, expira: int, assinatura: str):
+    """Download do armazenamento local, pelo link assinado que /processos/{id}/download devolve."""
+    armazenamento = obter_armazenamento()
+    if armazenamento.nome != "local" or not conferir_link(chave, expira, assinatura):
+        raise HTTPException(status_code=403, detail="Link inválido ou expirado")
+
+    caminho = armazenamento.caminho_local(chave)
+    if not os.path.isfile(caminho):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+
+    # O arquivo sai direto do disco (sendfile quando o servidor suporta), sem passar pela memória
+    return FileResponse(caminho, media_type="application/pdf", filename=os.path.basename(chave))
+
 @app.delete("/processos/{processo_id}")
-def excluir_processo(processo_id: int, token: str = Depends(oauth2_scheme)):
-    email_usuario = verificar_token(token)
+def excluir_processo(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_usuario)).first()
         # 1. Busca o processo
         db_processo = session.get(Processo, processo_id)
         
@@ -270,15 +540,28 @@ def excluir_processo(processo_id: int, token: str = Depends(oauth2_scheme)):
         for item in financeiros:
             session.delete(item)
 
-        if db_processo.arquivo_pdf:
-            try:
-                s3_client.delete_object(
-                    Bucket=os.getenv("AWS_BUCKET_NAME"),
-                    Key=db_processo.arquivo_pdf
-                )
-                print(f"Arquivo {db_processo.arquivo_pdf} apagado do S3.")
-            except Exception as e:
-                print(f"Erro ao apagar do S3 (mas vamos seguir): {e}")
+        tarefas = session.exec(select(Tarefa).where(Tarefa.processo_id == processo_id)).all()
+        for item in tarefas:
+            session.delete(item)
+
+        origem_resumo = session.exec(select(ResumoIA).where(ResumoIA.processo_id == processo_id)).first()
+        if origem_resumo:
+            session.delete(origem_resumo)
+
+        sessoes = session.exec(select(SessaoChat).where(SessaoChat.processo_id == processo_id)).all()
+        for sessao in sessoes:
+            for mensagem in session.exec(select(MensagemChat).where(MensagemChat.sessao_id == sessao.id)).all():
+                session.delete(mensagem)
+            session.delete(sessao)
+
+        chaves = {db_processo.arquivo_pdf} - {None}
+        for documento in session.exec(select(Documento).where(Documento.processo_id == processo_id)).all():
+            chaves.add(documento.chave)
+            session.delete(documento)
+
+        # Arquivo compartilhado com outro processo (mesmo conteúdo) continua guardado
+        for chave in chaves:
+            apagar_se_orfao(session, chave, exceto_processo_id=processo_id)
 
         # 2. Deleta e confirma
         session.delete(db_processo)
@@ -346,18 +629,16 @@ def login_para_token(
                 raise HTTPException(status_code=401, detail="Código 2FA inválido ou expirado.")
 
         # 4. Se passou por tudo, gera o token de acesso
-        token = criar_token_acesso(dados={"sub": usuario_db.email})
+        # O id vai no token: as rotas sabem quem é o usuário sem consultar o banco pelo e-mail
+        token = criar_token_acesso(dados={"sub": usuario_db.email, "uid": usuario_db.id})
         return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/usuarios/ativar-2fa")
-def ativar_2fa(token: str = Depends(oauth2_scheme)):
-    email = verificar_token(token)
-    if not email:
-        raise HTTPException(status_code=401, detail="Token inválido")
+def ativar_2fa(usuario_atual: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email)).first()
-        
+        usuario = session.get(Usuario, usuario_atual.id)
+
         # Gera o segredo e salva no banco
         novo_segredo = gerar_segredo_2fa()
         usuario.secret_2fa = novo_segredo
@@ -365,10 +646,11 @@ def ativar_2fa(token: str = Depends(oauth2_scheme)):
         
         session.add(usuario)
         session.commit()
+        esquecer_usuario(usuario.id)
 
         # Link para o Google Authenticator (TOTP)
         link_auth = pyotp.totp.TOTP(novo_segredo).provisioning_uri(
-            name=email, 
+            name=usuario.email, 
             issuer_name="Sistema Juridico"
         )
         
@@ -379,27 +661,24 @@ def ativar_2fa(token: str = Depends(oauth2_scheme)):
         }
 
 @app.post("/usuarios/confirmar-2fa")
-def confirmar_2fa(codigo: str, token: str = Depends(oauth2_scheme)):
-    email = verificar_token(token)
+def confirmar_2fa(codigo: str, usuario_atual: UsuarioAtual = Depends(obter_usuario_atual)):
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email)).first()
-        
+        usuario = session.get(Usuario, usuario_atual.id)
+
         # Usamos a função do security.py para validar o código de 6 dígitos
         if verificar_codigo_2fa(usuario.secret_2fa, codigo):
             usuario.is_2fa_enabled = True # Agora sim, está oficialmente ativo!
             session.add(usuario)
             session.commit()
+            esquecer_usuario(usuario.id)
             return {"mensagem": "2FA ativado com sucesso! Seu sistema está protegido."}
         else:
             raise HTTPException(status_code=400, detail="Código 2FA inválido ou expirado")
 
 @app.get("/processos/urgents")
-def listar_prazos_urgentes(token: str = Depends(oauth2_scheme)):
-    email_usuario = verificar_token(token)
+def listar_prazos_urgentes(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_usuario)).first()
-
         # Define o que é "urgente": de hoje até daqui a 5 dias
         hoje = date.today()
         limite_alerta = hoje + timedelta(days=5)
@@ -414,13 +693,22 @@ def listar_prazos_urgentes(token: str = Depends(oauth2_scheme)):
         results = session.exec(statement).all()
         return results
 
-@app.post("/processos/{processo_id}/analise-ia")
-def solicitar_resumo_ia(processo_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def _documento_pronto(session, processo, usuario):
+    """O texto vem da ingestão feita no upload; o PDF nunca é lido aqui."""
+    documento = garantir_documento(session, processo.arquivo_pdf, processo_id=processo.id, usuario_id=usuario.id)
+    if documento.status == "erro":
+        raise HTTPException(status_code=500, detail="Erro ao ler o arquivo PDF. Anexe o arquivo novamente.")
+    if documento.status != "pronto":
+        raise HTTPException(status_code=409, detail="O PDF ainda está sendo processado. Tente novamente em instantes.")
+    return documento
 
+def _preparar_resumo(processo_id: int, usuario: UsuarioAtual):
+    """
+    Valida o acesso e lê o texto do documento. Devolve (páginas, hash do documento).
+    O prompt (com mapa e redução nos PDFs longos) é montado depois, já dentro do stream.
+    """
     with Session(engine) as session:
         #Busca o processo
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
         processo = session.get(Processo, processo_id)
 
         if not processo or processo.usuario_id != usuario.id:
@@ -429,57 +717,140 @@ def solicitar_resumo_ia(processo_id: int, token: str = Depends(oauth2_scheme)):
         if not processo.arquivo_pdf:
              raise HTTPException(status_code=400, detail="Este processo não tem PDF para ler.")
 
-        texto_pdf = ''
-        try:
-            response = s3_client.get_object(Bucket=os.getenv("AWS_BUCKET_NAME"), Key=processo.arquivo_pdf)
-            arquivo_memoria = io.BytesIO(response['Body'].read())
-            pdf_reader = PdfReader(arquivo_memoria)
+        documento = _documento_pronto(session, processo, usuario)
+        paginas = paginas_documento(documento)
+        hash_documento = documento.hash_conteudo
 
-            for i, page in enumerate(pdf_reader.pages):
-                if i > 20: break
-                texto_pdf += page.extract_text()
+    return paginas, hash_documento
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Erro ao ler PDF: {str(e)}")
+@app.post("/processos/{processo_id}/analise-ia", status_code=202)
+def solicitar_resumo_ia(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
-        prompt = f"""
-        Você é um assistente jurídico sênior.
-        Analise o texto do processo abaixo e gere um RESUMO EXECUTIVO em formato de texto (Markdown).
-        NÃO retorne JSON. Retorne um texto legível para um advogado ler rápido.
+    with Session(engine) as session:
+        #Busca o processo
+        processo = session.get(Processo, processo_id)
 
-        Estrutura sugerida:
-        **📝 Resumo dos Fatos:** (O que aconteceu resumidamente)
-        **⚖️ Partes:** (Quem está processando quem)
-        **💰 Pedidos e Valores:** (O que está sendo pedido)
-        **⚠️ Pontos de Atenção:** (Prazos ou riscos imediatos identificados)
+        if not processo or processo.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Processo não encontrado")
 
-        --- TEXTO DO PROCESSO ---
-        {texto_pdf}
-        """
+        if not processo.arquivo_pdf:
+             raise HTTPException(status_code=400, detail="Este processo não tem PDF para ler.")
 
+        _documento_pronto(session, processo, usuario)
+
+        # A análise entra na fila; o resultado sai em /tarefas/{id} e em Processo.resumo_ia
         try:
-            client = genai.Client(api_key=chave_secreta)
-            response = client.models.generate_content(
-                model="models/gemini-3-flash-preview",
-                contents=prompt
+            tarefa = enfileirar_analise(session, processo)
+        except FilaCheia:
+            raise HTTPException(
+                status_code=429,
+                detail="Muitas análises na fila. Tente novamente em alguns instantes.",
+                headers={"Retry-After": "30"}
             )
-            resumo = response.text
 
-            processo.resumo_ia = resumo
-            session.add(processo)
-            session.commit()
+        return {"mensagem": "Análise da IA solicitada!", "tarefa_id": tarefa.id, "status": tarefa.status}
 
-            return {"mensagem": "Resumo da IA gerado com sucesso!", "resumo": resumo}
-        except Exception as e:
-            print(f"Erro na extração: {e}")
-            raise HTTPException(status_code=500, detail="Não foi possível extrair dados do PDF.")
+@app.post("/processos/analise-ia/lote", status_code=202)
+def solicitar_resumo_ia_lote(dados: dict = Body(default={}), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        # Um lote por usuário: um segundo pedido devolve o que já está rodando
+        tarefa = lote_em_andamento(session, usuario.id)
+        if tarefa:
+            checkpoint = json.loads(tarefa.resultado)
+            return {
+                "mensagem": "Já existe uma reanálise em lote em andamento.",
+                "tarefa_id": tarefa.id,
+                "total": checkpoint["total"],
+                "em_andamento": True
+            }
+
+        # Processos com PDF e sem resumo (e, por padrão, os de resumo desatualizado)
+        tarefa = criar_lote(session, usuario.id, incluir_desatualizados=dados.get("incluir_desatualizados", True))
+        if tarefa.status == "pendente":
+            executar_em_segundo_plano(tarefa.id)
+
+        total = json.loads(tarefa.resultado)["total"]
+        return {"mensagem": f"{total} processo(s) na fila de análise.", "tarefa_id": tarefa.id, "total": total}
+
+def _evento_sse(evento: str, dados: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+async def _transmitir_resposta(request: Request, partes, ao_terminar=None):
+    """
+    Repassa ao navegador, como Server-Sent Events, cada pedaço de texto que chega da IA.
+    Se o cliente desconectar, paramos de ler o stream (e a IA para de gerar, poupando cota).
+    """
+    texto_completo = ""
+    try:
+        async for parte in partes:
+            if await request.is_disconnected():
+                print("Cliente desconectou; stream da IA interrompido.")
+                return
+            texto_completo += parte
+            yield _evento_sse("parte", {"texto": parte})
+
+        if ao_terminar:
+            await run_in_threadpool(ao_terminar, texto_completo)
+        yield _evento_sse("fim", {"resposta": texto_completo})
+    except Exception as e:
+        print(f"Erro no stream da IA: {e}")
+        yield _evento_sse("erro", {"detail": "Erro ao processar resposta da IA."})
+    finally:
+        await partes.aclose()
+
+async def _transmitir_resumo(request: Request, processo_id: int, paginas: list, hash_documento: str):
+    """
+    Stream do resumo: um evento de progresso logo no início e a cada bloco resumido
+    (PDFs longos passam pelo mapa e redução antes do resumo final), depois o texto da IA.
+    """
+    loop = asyncio.get_running_loop()
+    progresso = asyncio.Queue()
+
+    def ao_progredir(etapa, feitas, total):
+        loop.call_soon_threadsafe(progresso.put_nowait, {"etapa": etapa, "feitas": feitas, "total": total})
+
+    yield _evento_sse("progresso", {"etapa": "preparando", "feitas": 0, "total": 0})
+
+    preparo = asyncio.ensure_future(run_in_threadpool(preparar_prompt_final, paginas, montar_prompt_resumo, ao_progredir))
+    while not preparo.done():
+        proximo = asyncio.ensure_future(progresso.get())
+        await asyncio.wait({preparo, proximo}, return_when=asyncio.FIRST_COMPLETED)
+        if not proximo.done():
+            proximo.cancel()
+            break
+        if await request.is_disconnected():
+            # Os resumos dos blocos já feitos ficam no cache para a próxima tentativa
+            print("Cliente desconectou; stream da IA interrompido.")
+            return
+        yield _evento_sse("progresso", proximo.result())
+
+    try:
+        prompt, _ = await preparo
+    except Exception as e:
+        print(f"Erro ao preparar o resumo do processo {processo_id}: {e}")
+        yield _evento_sse("erro", {"detail": "Erro ao processar resposta da IA."})
+        return
+
+    partes = gerar_texto_stream_async(prompt, template=TEMPLATE_RESUMO_PROCESSO, hash_documento=hash_documento)
+    async for evento in _transmitir_resposta(request, partes, ao_terminar=lambda resumo: salvar_resumo(processo_id, resumo, hash_documento)):
+        yield evento
+
+@app.post("/processos/{processo_id}/analise-ia/stream")
+async def solicitar_resumo_ia_stream(processo_id: int, request: Request, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    paginas, hash_documento = await run_in_threadpool(_preparar_resumo, processo_id, usuario)
+
+    return StreamingResponse(
+        _transmitir_resumo(request, processo_id, paginas, hash_documento),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/dashboard/geral")
-def dados_dashboard(token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def dados_dashboard(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
         processos = session.exec(select(Processo).where(Processo.usuario_id == usuario.id)).all()
 
         financeiro = session.exec(select(Financeiro).where(Financeiro.usuario_id == usuario.id)).all()
@@ -528,62 +899,82 @@ def dados_dashboard(token: str = Depends(oauth2_scheme)):
         }
 
 @app.post("/ia/extrair-dados")
-async def extrair_dados_pdf(arquivo: UploadFile = File(...)):
+async def extrair_dados_pdf(arquivo: UploadFile = File(...), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     """
-    Recebe um PDF, extrai o texto e pede ao Gemini para formatar como JSON
-    para preenchimento automático de formulário.
+    Recebe um PDF e devolve os dados para preenchimento automático de formulário.
+    Número CNJ, partes e prazo são procurados primeiro por regras locais;
+    o Gemini só é chamado para os campos que elas não resolveram.
+    O PDF fica guardado: devolvemos o "hash" para anexá-lo ao processo sem reenviar.
     """
     try:
-        #Ler o PDF
-        pdf_reader = PdfReader(arquivo.file)
-        texto_completo = ""
-        # Lê apenas as primeiras 5 páginas para economizar tokens e ser mais rápido
-        for i, page in enumerate(pdf_reader.pages):
-            if i > 5: break
-            texto_completo += page.extract_text()
-
-        prompt = f"""
-        Aja como um assistente jurídico. Analise o texto abaixo extraído de um processo judicial.
-        Extraia as seguintes informações e retorne APENAS um objeto JSON (sem ```json no inicio):
-        
-        1. "numero_processo": O número do processo (formato CNJ se houver).
-        2. "cliente": O nome da parte que parece ser o nosso cliente (ou Autor).
-        3. "contra_parte": O nome da outra parte (Réu).
-        4. "data_prazo": Uma data sugerida para o próximo prazo no formato YYYY-MM-DD. Se não achar, use a data de hoje.
-        
-        Texto do processo:
-        {texto_completo}
-        """
+        # O hash sai junto com a leitura do upload
+        hash_conteudo, tamanho, temporario = await run_in_threadpool(receber_arquivo, arquivo.file)
+        with temporario:
+            conteudo = temporario.read()
+
+        # O mesmo PDF já passou por aqui: devolve o resultado guardado
+        anteriores = await run_in_threadpool(dados_extraidos, hash_conteudo)
+        if anteriores:
+            # Os bytes vieram nesta requisição: o usuário passa a poder anexar pelo hash (não sobe de novo)
+            await run_in_threadpool(guardar_envio, hash_conteudo, tamanho, io.BytesIO(conteudo), arquivo.filename, usuario.id)
+            return {**anteriores, "hash": hash_conteudo}
 
-        # 3. Chamar a IA (SINTAXE NOVA CORRIGIDA)
-        client = genai.Client(api_key=chave_secreta)
-
-        # Na biblioteca nova, chamamos client.models.generate_content
-        response = client.models.generate_content(
-            model="models/gemini-3-flash-preview", 
-            contents=prompt
+        #Ler o PDF
+        # Lê apenas as primeiras páginas para economizar tokens e ser mais rápido.
+        # A extração espera o pool de processos, então vai para uma thread e não trava o event loop.
+        # Enquanto isso o arquivo é guardado no armazenamento para o anexo por hash.
+        paginas, envio = await asyncio.gather(
+            run_in_threadpool(extrair_paginas, conteudo, limite_paginas=6),
+            run_in_threadpool(guardar_envio, hash_conteudo, tamanho, io.BytesIO(conteudo), arquivo.filename, usuario.id)
         )
-
-        resposta_texto = response.text.replace("```json", "").replace("```", "").strip()
-        dados_json = json.loads(resposta_texto)
-
-        return dados_json
-    
+        texto_completo = "".join(paginas)
+    except ArquivoGrandeDemais:
+        raise HTTPException(status_code=413, detail=_mensagem_tamanho_max())
     except Exception as e:
         print(f"Erro na extração: {e}")
         raise HTTPException(status_code=500, detail="Não foi possível extrair dados do PDF.")
 
-@app.post("/processos/{processo_id}/chat")
-def chat_com_processo(
-    processo_id: int,
-    dados: dict = (Body(...)),
-    token: str = Depends(oauth2_scheme)
-):
-    email_user = verificar_token(token)
+    # O texto completo é lido em segundo plano com os bytes que já temos: ao anexar, já está pronto
+    await run_in_threadpool(_preparar_texto_envio, envio.chave, conteudo)
+
+    # 1. Caminho rápido: regex e heurísticas, sem IA
+    dados, confianca, origem = {}, {}, {}
+    for campo, (valor, nota) in extrair_campos(texto_completo).items():
+        if nota >= EXTRACAO_CONFIANCA_MIN:
+            dados[campo], confianca[campo], origem[campo] = valor, nota, "regras"
 
+    # 2. A IA só completa o que faltou
+    faltando = [campo for campo in CAMPOS if campo not in dados]
+    completo = True
+    if faltando:
+        try:
+            # JSON validado; se vier inválido, só a chamada à IA é repetida (o PDF não é lido de novo)
+            for campo, valor in (await completar_extracao(texto_completo, faltando, hash_conteudo)).items():
+                dados[campo], origem[campo] = valor, "ia"
+        except Exception as e:
+            print(f"Erro na extração pela IA: {e}")
+            completo = False
+            if not dados:
+                raise HTTPException(status_code=500, detail="Não foi possível extrair dados do PDF.")
+
+    resultado = {**dados, "confianca": confianca, "origem": origem}
+    if completo:
+        await run_in_threadpool(salvar_dados_extraidos, hash_conteudo, resultado)
+
+    return {**resultado, "hash": hash_conteudo}
+
+def _preparar_texto_envio(chave: str, conteudo: bytes):
+    with Session(engine) as session:
+        if not buscar_documento(session, chave):
+            enfileirar_ingestao(session, chave, conteudo=conteudo)
+
+def _preparar_chat(processo_id: int, usuario: UsuarioAtual, pergunta: str, sessao_id: Optional[int] = None) -> dict:
+    """
+    Valida o acesso e monta o prompt do chat.
+    Com sessao_id, o prompt inclui o resumo da conversa e as últimas mensagens da sessão.
+    """
     with Session(engine) as session:
-        # 1. Busca usuário e processo
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
+        # 1. Busca o processo
         processo = session.get(Processo, processo_id)
 
         # 2. Validações de Segurança
@@ -596,51 +987,169 @@ def chat_com_processo(
         if not processo.arquivo_pdf:
             raise HTTPException(status_code=400, detail="Este processo não tem PDF anexado para ler.")
 
-        texto_pdf = ''
-        try:
-            
-            response = s3_client.get_object(Bucket=os.getenv("AWS_BUCKET_NAME"), Key=processo.arquivo_pdf)
+        sessao, recentes = None, []
+        if sessao_id:
+            sessao = obter_sessao(session, sessao_id, usuario.id)
+            if not sessao or sessao.processo_id != processo.id:
+                raise HTTPException(status_code=404, detail="Sessão de chat não encontrada")
+            recentes = listar_mensagens(session, sessao.id, apenas_recentes=True)
+            # Se a condensação falhou (erro ou limite da IA), as mensagens não resumidas se acumulam:
+            # o prompt leva só as últimas que cabem na janela, para o tamanho continuar limitado
+            recentes = janela_recente(recentes)
+
+        documento = _documento_pronto(session, processo, usuario)
+
+        # Em vez das primeiras páginas, vão para a IA só os trechos mais relevantes à pergunta.
+        # Numa conversa, a última pergunta ajuda na busca de perguntas curtas ("e o valor?")
+        consulta = pergunta
+        anteriores = [m.conteudo for m in recentes if m.papel == "user"]
+        if anteriores:
+            consulta = f"{anteriores[-1]} {pergunta}"
+        contexto = selecionar_contexto(documento, consulta)
+
+        prompt = montar_prompt_chat(
+            contexto["texto"],
+            pergunta,
+            resumo_conversa=sessao.resumo if sessao else None,
+            mensagens_recentes=recentes
+        )
 
-            arquivo_memoria = io.BytesIO(response['Body'].read())
+        return {
+            "prompt": prompt,
+            "hash_documento": documento.hash_conteudo,
+            "paginas": contexto["paginas"],
+            "sessao_id": sessao.id if sessao else None,
+            # A mesma pergunta em outro ponto da conversa é outra pergunta para o cache
+            "chave_pergunta": f"{pergunta}|{digest_historico(sessao, recentes)}" if sessao else pergunta,
+            "tokens_prompt": contar_tokens_prompt(prompt),
+        }
 
-            pdf_reader = PdfReader(arquivo_memoria)
+@app.post("/processos/{processo_id}/chat")
+def chat_com_processo(
+    processo_id: int,
+    dados: dict = (Body(...)),
+    usuario: UsuarioAtual = Depends(obter_usuario_atual)
+):
 
-            for i, page in enumerate(pdf_reader.pages):
-                if i > 20: break
-                texto_pdf += page.extract_text()
+    pergunta = dados.get("pergunta")
+    chat = _preparar_chat(processo_id, usuario, pergunta, sessao_id=dados.get("sessao_id"))
 
-        except Exception as e:
-            print(f"Erro ao ler PDF: {e}")
-            raise HTTPException(status_code=500, detail="Erro ao baixar ou ler o arquivo PDF da nuvem.")
-        
-        pergunta = dados.get("pergunta")
-        prompt_sistema = f"""
-        Você é um assistente jurídico. Responda com base no texto abaixo.
-        --- TEXTO DO PROCESSO ---
-        {texto_pdf}
-        --- FIM ---
-        Pergunta: {pergunta}
-        """
+    try:
+        resposta = gerar_texto(chat["prompt"], template=TEMPLATE_CHAT, hash_documento=chat["hash_documento"], pergunta=chat["chave_pergunta"])
+    except Exception as e:
+        print(f"Erro na IA: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao processar resposta da IA.")
 
-        try:
+    if chat["sessao_id"]:
+        registrar_troca(chat["sessao_id"], pergunta, resposta, chat["tokens_prompt"])
 
-            client = genai.Client(api_key=chave_secreta)
-            response = client.models.generate_content(
-                model="models/gemini-3-flash-preview",
-                contents=prompt_sistema
-            )
-            return {"resposta": response.text}
-        except Exception as e:
-            print(f"Erro na IA: {e}")
-            raise HTTPException(status_code=500, detail="Erro ao processar resposta da IA.")
+    return {
+        "resposta": resposta,
+        "paginas_consultadas": chat["paginas"],
+        "sessao_id": chat["sessao_id"],
+        "tokens_prompt": chat["tokens_prompt"]
+    }
+
+@app.post("/processos/{processo_id}/chat/stream")
+async def chat_com_processo_stream(
+    processo_id: int,
+    request: Request,
+    dados: dict = (Body(...)),
+    usuario: UsuarioAtual = Depends(obter_usuario_atual)
+):
+
+    pergunta = dados.get("pergunta")
+    chat = await run_in_threadpool(_preparar_chat, processo_id, usuario, pergunta, dados.get("sessao_id"))
+    partes = gerar_texto_stream_async(chat["prompt"], template=TEMPLATE_CHAT, hash_documento=chat["hash_documento"], pergunta=chat["chave_pergunta"])
+
+    ao_terminar = None
+    if chat["sessao_id"]:
+        ao_terminar = lambda resposta: registrar_troca(chat["sessao_id"], pergunta, resposta, chat["tokens_prompt"])
+
+    async def eventos():
+        yield _evento_sse("inicio", {
+            "paginas_consultadas": chat["paginas"],
+            "sessao_id": chat["sessao_id"],
+            "tokens_prompt": chat["tokens_prompt"]
+        })
+        async for evento in _transmitir_resposta(request, partes, ao_terminar=ao_terminar):
+            yield evento
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/processos/{processo_id}/chat/sessoes")
+def criar_sessao_chat(processo_id: int, dados: dict = Body(default={}), usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        processo = session.get(Processo, processo_id)
+
+        if not processo or processo.usuario_id != usuario.id:
+            raise HTTPException(status_code=404, detail="Processo não encontrado")
+
+        return criar_sessao(session, processo.id, usuario.id, titulo=dados.get("titulo"))
+
+@app.get("/processos/{processo_id}/chat/sessoes")
+def listar_sessoes_chat(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        return session.exec(select(SessaoChat).where(
+            SessaoChat.processo_id == processo_id,
+            SessaoChat.usuario_id == usuario.id
+        ).order_by(SessaoChat.atualizado_em.desc())).all()
+
+@app.get("/chat/sessoes/{sessao_id}")
+def obter_sessao_chat(sessao_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        sessao = obter_sessao(session, sessao_id, usuario.id)
+
+        if not sessao:
+            raise HTTPException(status_code=404, detail="Sessão de chat não encontrada")
+
+        # Para retomar a conversa: o histórico completo, inclusive o que já foi condensado no resumo
+        return {"sessao": sessao, "mensagens": listar_mensagens(session, sessao.id)}
+
+@app.delete("/chat/sessoes/{sessao_id}")
+def excluir_sessao_chat(sessao_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    with Session(engine) as session:
+        sessao = obter_sessao(session, sessao_id, usuario.id)
+
+        if not sessao:
+            raise HTTPException(status_code=404, detail="Sessão de chat não encontrada")
+
+        for mensagem in listar_mensagens(session, sessao.id):
+            session.delete(mensagem)
+        session.delete(sessao)
+        session.commit()
+        return {"mensagem": "Sessão de chat excluída"}
+
+@app.get("/ia/cache/estatisticas")
+def estatisticas_cache_ia(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    # Acertos, falhas e quanto tempo de IA o cache já poupou desde que o servidor subiu
+    return obter_estatisticas()
+
+@app.get("/banco/estatisticas")
+def estatisticas_banco(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    # Conexões do pool em uso, livres e extras (para dimensionar DB_POOL_TAMANHO / DB_POOL_EXTRA)
+    return estatisticas_pool()
+
+@app.get("/ia/extracao/estatisticas")
+def estatisticas_extracao_ia(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
+
+    # Extrações pela IA desde que o servidor subiu: reparos locais, novas tentativas e falhas
+    return obter_estatisticas_extracao()
 
 @app.get("/processos/{processo_id}/financeiro")
-def listar_financeiro_processo(processo_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def listar_financeiro_processo(processo_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-
         statement = select(Financeiro).where(
             Financeiro.processo_id == processo_id, 
             Financeiro.usuario_id == usuario.id
@@ -718,6 +1227,10 @@ def iniciar_agendador():
     # Dica: O servidor do Render usa horário UTC (então 11:00 UTC = 08:00 Brasil)
     scheduler.add_job(verificar_prazos_diarios, 'cron', hour=11, minute=0)
 
+    # Exclusões pendentes no armazenamento (outbox) e busca de arquivos sem dono
+    scheduler.add_job(executar_exclusoes, 'interval', seconds=LIMPEZA_INTERVALO, max_instances=1, coalesce=True)
+    scheduler.add_job(reconciliar, 'interval', hours=LIMPEZA_RECONCILIAR_HORAS, max_instances=1, coalesce=True)
+
     scheduler.start()
     print("🤖 Robô de Prazos ativado e agendado!")
 
@@ -728,11 +1241,8 @@ def teste_email_manual():
     return {"mensagem": "Robô forçado manualmente! Verifique o console do Render e seu e-mail."}
 
 @app.post('/clientes')
-def criar_cliente(cliente: Cliente, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def criar_cliente(cliente: Cliente, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-
         # Verifica se já existe cliente com esse CPF/CNPJ para esse usuário
         if cliente.cpf_cnpj:
             existente = session.exec(select(Cliente).where(
@@ -749,23 +1259,18 @@ def criar_cliente(cliente: Cliente, token: str = Depends(oauth2_scheme)):
         return cliente
 
 @app.get('/clientes')
-def listar_clientes(token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def listar_clientes(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-
         # Retorna apenas os clientes deste advogado
         return session.exec(select(Cliente).where(
             Cliente.usuario_id == usuario.id
         )).all()
 
 @app.delete('/clientes/{cliente_id}')
-def excluir_cliente(cliente_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def excluir_cliente(cliente_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
 
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
         cliente = session.get(Cliente, cliente_id)
 
         if not cliente or cliente.usuario_id != usuario.id:
@@ -777,8 +1282,7 @@ def excluir_cliente(cliente_id: int, token: str = Depends(oauth2_scheme)):
 
 
 @app.get("/clientes/{cliente_id}/dossie")
-def obter_dossie_cliente(cliente_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def obter_dossie_cliente(cliente_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     with Session(engine) as session:
         # 1. Pega os dados do cliente
         cliente = session.get(Cliente, cliente_id)
@@ -818,6 +1322,7 @@ def resetar_banco_de_dados():
     try:
         SQLModel.metadata.drop_all(engine) # Apaga tabelas antigas
         SQLModel.metadata.create_all(engine) # Cria as novas com colunas certas
+        esquecer_usuario()
         
         # Cria um usuário padrão para você não ficar trancado fora
         with Session(engine) as session:
@@ -833,24 +1338,18 @@ def resetar_banco_de_dados():
 # --- ROTAS FINANCEIRAS CORRIGIDAS (Substitua as antigas /financeiro por estas) ---
 
 @app.get("/pagamentos")
-def listar_pagamentos_geral(token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def listar_pagamentos_geral(usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-
         # Busca TUDO que é desse usuário (seja vinculado a processo ou não)
         statement = select(Financeiro).where(Financeiro.usuario_id == usuario.id)
         results = session.exec(statement).all()
         return results
 
 @app.post("/pagamentos")
-def criar_pagamento(lancamento: Financeiro, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def criar_pagamento(lancamento: Financeiro, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-        
         # Vincula ao usuário logado
         lancamento.usuario_id = usuario.id
 
@@ -879,12 +1378,9 @@ def criar_pagamento(lancamento: Financeiro, token: str = Depends(oauth2_scheme))
         return lancamento
 
 @app.delete("/pagamentos/{pagamento_id}")
-def deletar_pagamento(pagamento_id: int, token: str = Depends(oauth2_scheme)):
-    email_user = verificar_token(token)
+def deletar_pagamento(pagamento_id: int, usuario: UsuarioAtual = Depends(obter_usuario_atual)):
     
     with Session(engine) as session:
-        usuario = session.exec(select(Usuario).where(Usuario.email == email_user)).first()
-        
         # Busca o pagamento garantindo que pertence ao usuário
         pagamento = session.exec(select(Financeiro).where(
             Financeiro.id == pagamento_id, 
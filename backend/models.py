@@ -1,12 +1,18 @@
 from typing import Optional
 from sqlmodel import Field, SQLModel
-from datetime import date
-from sqlalchemy import Text
+from datetime import date, datetime
+from sqlalchemy import Text, UniqueConstraint
 
 class UsuarioCreate(SQLModel):
     email: str
     senha: str
 
+class UsuarioAtual(SQLModel):
+    """Quem fez a requisição: só o que as rotas usam, sem hash de senha nem segredos do 2FA."""
+    id: int
+    email: str
+    is_2fa_enabled: bool = False
+
 class Processo(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     numero: str = Field(index=True, unique=True) # Adicionamos unique aqui também no nível do banco!
@@ -48,4 +54,120 @@ class Cliente(SQLModel, table=True):
     telefone: Optional[str] = None
     cpf_cnpj: Optional[str] = None
     data_cadastro: date = Field(default_factory=date.today)
-    observacoes: Optional[str] = None
\ No newline at end of file
+    observacoes: Optional[str] = None
+
+class DocumentoTexto(SQLModel, table=True):
+    """Texto já extraído do PDF anexado, para não baixar e ler o arquivo a cada pergunta."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chave: str = Field(index=True, unique=True)  # Mesmo valor de Processo.arquivo_pdf
+    status: str = "pendente"  # pendente -> pronto (ou erro), controlado pela ingestão
+    etag: Optional[str] = None
+    hash_conteudo: Optional[str] = Field(default=None, index=True)  # SHA-256 dos bytes do PDF
+    total_paginas: int = 0
+    paginas: str = Field(default="[]", sa_type=Text)  # Lista JSON com o texto de cada página
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ArquivoEnviado(SQLModel, table=True):
+    """PDF recebido pela API, guardado uma única vez por conteúdo e compartilhado entre processos."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    hash_conteudo: str = Field(index=True, unique=True)  # SHA-256 calculado durante o upload
+    chave: str  # conteudo/<hash>.pdf no armazenamento
+    nome_original: Optional[str] = None
+    tamanho: int = 0
+    dados_extraidos: Optional[str] = Field(default=None, sa_type=Text)  # JSON do auto preenchimento
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class EnvioUsuario(SQLModel, table=True):
+    """Quem já mandou os bytes de cada conteúdo. Anexar só pelo hash é permitido a quem enviou."""
+    __table_args__ = (UniqueConstraint("usuario_id", "hash_conteudo"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    usuario_id: int = Field(foreign_key="usuario.id", index=True)
+    hash_conteudo: str = Field(index=True)
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Documento(SQLModel, table=True):
+    """Cada PDF de um processo. Processo.arquivo_pdf aponta para o mais recente (o que a IA lê)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    processo_id: int = Field(foreign_key="processo.id", index=True)
+    chave: str = Field(index=True)  # chave no armazenamento (conteudo/<hash>.pdf)
+    nome: Optional[str] = None
+    hash_conteudo: Optional[str] = Field(default=None, index=True)
+    tamanho: Optional[int] = None
+    total_paginas: Optional[int] = None  # preenchido quando a leitura do texto termina
+    enviado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class OperacaoArmazenamento(SQLModel, table=True):
+    """
+    Efeito no armazenamento (por enquanto, apagar um objeto) gravado na mesma transação que o causou.
+    Um worker executa depois, em lote; se a transação não for confirmada, a operação nem existe.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    operacao: str = "apagar"
+    chave: str = Field(index=True)
+    status: str = Field(default="pendente", index=True)  # pendente, executando, feita, cancelada, erro
+    tentativas: int = 0
+    proxima_tentativa: datetime = Field(default_factory=datetime.utcnow)
+    erro: Optional[str] = Field(default=None, sa_type=Text)
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+    atualizado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Tarefa(SQLModel, table=True):
+    """Trabalho executado em segundo plano (ex: ingestão de PDF). O cliente acompanha pelo id."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tipo: str = Field(index=True)
+    status: str = Field(default="pendente", index=True)  # pendente, processando, concluida, erro
+    progresso: int = 0  # 0 a 100
+    processo_id: Optional[int] = Field(default=None, foreign_key="processo.id")
+    usuario_id: Optional[int] = Field(default=None, foreign_key="usuario.id")
+    referencia: Optional[str] = None  # Ex: chave do arquivo no S3
+    resultado: Optional[str] = Field(default=None, sa_type=Text)
+    erro: Optional[str] = Field(default=None, sa_type=Text)
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+    atualizado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class RespostaIACache(SQLModel, table=True):
+    """Segunda camada (opcional) do cache de respostas da IA, compartilhada entre workers."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chave: str = Field(index=True, unique=True)  # SHA-256 de (modelo, template, hash do documento, pergunta)
+    hash_documento: Optional[str] = Field(default=None, index=True)
+    template: str
+    modelo: str
+    resposta: str = Field(sa_type=Text)
+    latencia: float = 0  # segundos que a chamada original levou
+    expira_em: datetime
+
+
+class ResumoIA(SQLModel, table=True):
+    """De qual documento (hash) e prompt saiu o Processo.resumo_ia atual; serve para achar resumos desatualizados."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    processo_id: int = Field(foreign_key="processo.id", index=True, unique=True)
+    hash_documento: Optional[str] = None
+    template: str
+    gerado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SessaoChat(SQLModel, table=True):
+    """Conversa com a IA sobre um processo. `resumo` condensa as mensagens antigas."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    processo_id: int = Field(foreign_key="processo.id", index=True)
+    usuario_id: int = Field(foreign_key="usuario.id", index=True)
+    titulo: Optional[str] = None
+    resumo: Optional[str] = Field(default=None, sa_type=Text)
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
+    atualizado_em: datetime = Field(default_factory=datetime.utcnow)
+
+
+class MensagemChat(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sessao_id: int = Field(foreign_key="sessaochat.id", index=True)
+    papel: str  # "user" ou "assistant"
+    conteudo: str = Field(sa_type=Text)
+    tokens_prompt: Optional[int] = None  # Tamanho estimado do prompt montado para esta pergunta
+    resumida: bool = False  # Já entrou no resumo da sessão (não vai mais inteira para o prompt)
+    criado_em: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,181 @@
+import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache_ia import gerar_texto_com_origem
+from llm import estimar_tokens
+
+# Resumo de PDFs longos em etapas (map-reduce), para não cortar o processo na página 21:
+#   mapa    - cada bloco de páginas é resumido em paralelo (cache pelo hash do bloco)
+#   redução - os resumos parciais são juntados em grupos até caberem num prompt só
+#   final   - o prompt de sempre (resumo executivo / triagem) recebe os resumos parciais
+# Os blocos seguem as páginas: anexar páginas novas só muda o último bloco, e o resto sai do cache.
+
+RESUMO_TAMANHO_BLOCO = int(os.getenv("RESUMO_TAMANHO_BLOCO", "12000"))  # caracteres por bloco
+RESUMO_LIMITE_DIRETO = int(os.getenv("RESUMO_LIMITE_DIRETO", "15000"))  # até aqui o texto vai inteiro no prompt final
+RESUMO_LIMITE_REDUCAO = int(os.getenv("RESUMO_LIMITE_REDUCAO", "24000"))  # resumos parciais juntos num prompt, no máximo
+RESUMO_PARALELISMO = int(os.getenv("RESUMO_PARALELISMO", "4"))  # chamadas simultâneas à IA no servidor todo
+
+TEMPLATE_RESUMO_BLOCO = "resumo_bloco:v1"
+TEMPLATE_RESUMO_GRUPO = "resumo_grupo:v1"
+
+# Um executor só para o servidor: o limite vale para todos os resumos em andamento
+_executor = ThreadPoolExecutor(max_workers=RESUMO_PARALELISMO, thread_name_prefix="resumo-bloco")
+
+
+def montar_prompt_bloco(texto, pagina_inicial, pagina_final):
+    return f"""
+        Você está lendo um trecho (páginas {pagina_inicial} a {pagina_final}) de um processo judicial longo.
+        Resuma em tópicos curtos o que aparece neste trecho: fatos, partes, pedidos, valores, decisões, datas e prazos.
+        Não invente nada que não esteja no trecho.
+        Se o trecho só tiver documentos acessórios (procurações, guias, comprovantes), responda apenas "Sem conteúdo relevante."
+
+        --- TRECHO ---
+        {texto}
+        """
+
+
+def montar_prompt_grupo(parciais):
+    return f"""
+        Abaixo estão resumos de partes consecutivas de um mesmo processo judicial, em ordem.
+        Junte-os num único resumo em tópicos, sem repetir informações e sem perder datas, valores, decisões e prazos.
+
+        {parciais}
+        """
+
+
+def dividir_blocos(paginas: list, tamanho: int = RESUMO_TAMANHO_BLOCO) -> list:
+    """Agrupa páginas inteiras em blocos de até `tamanho` caracteres (páginas maiores são partidas)."""
+    blocos = []
+    atual, tamanho_atual, inicio = [], 0, 1
+
+    for numero, pagina in enumerate(paginas, 1):
+        for i in range(0, max(len(pagina), 1), tamanho):
+            pedaco = pagina[i:i + tamanho]
+            if atual and tamanho_atual + len(pedaco) > tamanho:
+                blocos.append({"texto": "".join(atual), "pagina_inicial": inicio, "pagina_final": numero_anterior})
+                atual, tamanho_atual = [], 0
+            if not atual:
+                inicio = numero
+            atual.append(pedaco)
+            tamanho_atual += len(pedaco)
+            numero_anterior = numero
+
+    if atual:
+        blocos.append({"texto": "".join(atual), "pagina_inicial": inicio, "pagina_final": numero_anterior})
+    return [b for b in blocos if b["texto"].strip()]
+
+
+def _formatar_parciais(parciais: list) -> str:
+    return "\n\n".join(f"[Páginas {inicio} a {fim}]\n{texto}" for inicio, fim, texto in parciais)
+
+
+def _hash(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _chamar(prompt: str, template: str, chave: str) -> dict:
+    texto, do_cache = gerar_texto_com_origem(prompt, template=template, hash_documento=chave)
+    # Só conta tokens do que foi de fato enviado à IA
+    tokens = 0 if do_cache else estimar_tokens(prompt) + estimar_tokens(texto or "")
+    return {"texto": texto or "", "do_cache": do_cache, "tokens": tokens}
+
+
+def _nova_etapa() -> dict:
+    return {"chamadas": 0, "do_cache": 0, "tokens": 0, "segundos": 0.0}
+
+
+def _executar_etapa(etapa: dict, chamadas: list, ao_progredir=None) -> list:
+    """
+    Roda as chamadas (prompt, template, chave) em paralelo, somando tokens e tempo na etapa.
+    ao_progredir(feitas, total) é chamado a cada chamada concluída.
+    """
+    inicio = time.perf_counter()
+    futuros = [_executor.submit(_chamar, *c) for c in chamadas]
+    if ao_progredir:
+        for feitas, _ in enumerate(as_completed(futuros), 1):
+            ao_progredir(feitas, len(futuros))
+    resultados = [f.result() for f in futuros]
+    etapa["chamadas"] += len(resultados)
+    etapa["do_cache"] += sum(1 for r in resultados if r["do_cache"])
+    etapa["tokens"] += sum(r["tokens"] for r in resultados)
+    etapa["segundos"] = round(etapa["segundos"] + time.perf_counter() - inicio, 2)
+    return [r["texto"] for r in resultados]
+
+
+def _agrupar(parciais: list) -> list:
+    """Grupos consecutivos que cabem no limite da redução, com pelo menos dois resumos cada."""
+    grupos, atual, tamanho = [], [], 0
+    for parcial in parciais:
+        custo = len(parcial[2])
+        if len(atual) >= 2 and tamanho + custo > RESUMO_LIMITE_REDUCAO:
+            grupos.append(atual)
+            atual, tamanho = [], 0
+        atual.append(parcial)
+        tamanho += custo
+    if len(atual) == 1 and grupos:
+        grupos[-1].append(atual[0])
+    elif atual:
+        grupos.append(atual)
+    return grupos
+
+
+def preparar_prompt_final(paginas: list, montar_prompt_final, ao_progredir=None):
+    """
+    Faz as etapas de mapa e redução e devolve (prompt final, estatísticas).
+    Textos curtos vão direto para o prompt final, como antes.
+    ao_progredir(etapa, feitas, total) acompanha as chamadas de cada etapa (ex: para o stream).
+    """
+    def progresso(nome):
+        return (lambda feitas, total: ao_progredir(nome, feitas, total)) if ao_progredir else None
+
+    estatisticas = {"blocos": 0, "etapas": {"mapa": _nova_etapa(), "reducao": _nova_etapa()}}
+    texto = "".join(paginas)
+    if len(texto) <= RESUMO_LIMITE_DIRETO:
+        return montar_prompt_final(texto), estatisticas
+
+    # 1. Mapa: um resumo por bloco de páginas
+    blocos = dividir_blocos(paginas)
+    estatisticas["blocos"] = len(blocos)
+    resumos = _executar_etapa(estatisticas["etapas"]["mapa"], [
+        (montar_prompt_bloco(b["texto"], b["pagina_inicial"], b["pagina_final"]), TEMPLATE_RESUMO_BLOCO, _hash(b["texto"]))
+        for b in blocos
+    ], progresso("mapa"))
+    parciais = [(b["pagina_inicial"], b["pagina_final"], r) for b, r in zip(blocos, resumos)]
+
+    # 2. Redução: junta os resumos em níveis até caberem no prompt final
+    while len(parciais) > 1 and len(_formatar_parciais(parciais)) > RESUMO_LIMITE_REDUCAO:
+        grupos = _agrupar(parciais)
+        prompts = [montar_prompt_grupo(_formatar_parciais(g)) for g in grupos]
+        resumos = _executar_etapa(estatisticas["etapas"]["reducao"], [
+            (prompt, TEMPLATE_RESUMO_GRUPO, _hash(prompt)) for prompt in prompts
+        ], progresso("reducao"))
+        parciais = [(g[0][0], g[-1][1], r) for g, r in zip(grupos, resumos)]
+
+    texto_final = "(O processo é longo: abaixo estão os resumos de cada parte, em ordem.)\n\n" + _formatar_parciais(parciais)
+    return montar_prompt_final(texto_final), estatisticas
+
+
+def resumir(paginas: list, montar_prompt_final, template: str, hash_documento: str) -> dict:
+    """
+    Resumo completo do documento, com o prompt final de quem chamou.
+    Devolve {"resumo", "estatisticas"} com tokens e segundos de cada etapa.
+    """
+    inicio = time.perf_counter()
+    prompt, estatisticas = preparar_prompt_final(paginas, montar_prompt_final)
+
+    final = _nova_etapa()
+    estatisticas["etapas"]["final"] = final
+    inicio_final = time.perf_counter()
+    resultado = _chamar(prompt, template, hash_documento)
+    final.update(
+        chamadas=1,
+        do_cache=int(resultado["do_cache"]),
+        tokens=resultado["tokens"],
+        segundos=round(time.perf_counter() - inicio_final, 2)
+    )
+
+    estatisticas["tokens_total"] = sum(e["tokens"] for e in estatisticas["etapas"].values())
+    estatisticas["segundos_total"] = round(time.perf_counter() - inicio, 2)
+    return {"resumo": resultado["texto"], "estatisticas": estatisticas}
@@ -34,18 +34,18 @@ def verificar_senha(senha_pura: str, senha_hash: str) -> bool:
 # Isso diz ao FastAPI onde o usuário deve ir para se autenticar
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def verificar_token(token: str):
-
+def decodificar_token(token: str):
+    """Conteúdo do JWT (sub = e-mail, uid = id do usuário), ou None se for inválido ou expirado."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        return email
-    except JWTError:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
         print(f"Erro na validação do token: {e}") # Isso vai aparecer no seu terminal!
         return None
 
+def verificar_token(token: str):
+    payload = decodificar_token(token)
+    return payload.get("sub") if payload else None
+
 import pyotp
 
 def gerar_segredo_2fa():
@@ -0,0 +1,153 @@
+import os
+import hashlib
+import threading
+from datetime import datetime
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlmodel import Session, select
+
+from database import engine
+from models import SessaoChat, MensagemChat
+from ia import montar_prompt_resumo_conversa, TEMPLATE_RESUMO_CONVERSA
+from cache_ia import gerar_texto
+from llm import contar_tokens, estimar_tokens
+
+# Sessões de chat guardadas no servidor. O prompt leva só o resumo das mensagens antigas
+# e uma janela com as últimas mensagens, então o tamanho fica estável em conversas longas.
+
+CHAT_JANELA_MENSAGENS = int(os.getenv("CHAT_JANELA_MENSAGENS", "6"))
+CHAT_HISTORICO_MAX_TOKENS = int(os.getenv("CHAT_HISTORICO_MAX_TOKENS", "2000"))  # mensagens recentes no prompt, no máximo
+
+# O resumo é atualizado depois da resposta, fora da requisição
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resumo-chat")
+_travas = {}  # sessao_id -> (trava, quantos estão usando); sai do dicionário quando ninguém usa
+_trava_travas = threading.Lock()
+
+
+@contextmanager
+def _trava_da_sessao(sessao_id: int):
+    with _trava_travas:
+        trava, usos = _travas.get(sessao_id, (None, 0))
+        trava = trava or threading.Lock()
+        _travas[sessao_id] = (trava, usos + 1)
+    try:
+        with trava:
+            yield
+    finally:
+        with _trava_travas:
+            trava, usos = _travas[sessao_id]
+            if usos == 1:
+                del _travas[sessao_id]
+            else:
+                _travas[sessao_id] = (trava, usos - 1)
+
+
+def contar_tokens_prompt(texto: str) -> int:
+    """Tokens pelo tokenizador do provedor de IA; a estimativa por caracteres só se ele não estiver disponível."""
+    try:
+        return contar_tokens(texto)
+    except Exception as e:
+        print(f"Erro ao contar tokens, usando estimativa: {e}")
+        return estimar_tokens(texto)
+
+
+@lru_cache(maxsize=4096)
+def _tokens_mensagem(conteudo: str) -> int:
+    # Mensagens não mudam: cada uma é contada uma vez por processo
+    return contar_tokens_prompt(conteudo)
+
+
+def janela_recente(recentes: list) -> list:
+    """As últimas mensagens que cabem na janela: até CHAT_JANELA_MENSAGENS e até CHAT_HISTORICO_MAX_TOKENS."""
+    janela = recentes[-CHAT_JANELA_MENSAGENS:]
+    tokens = sum(_tokens_mensagem(m.conteudo) for m in janela)
+    while len(janela) > 1 and tokens > CHAT_HISTORICO_MAX_TOKENS:
+        tokens -= _tokens_mensagem(janela[0].conteudo)
+        janela = janela[1:]
+    return janela
+
+
+def criar_sessao(session: Session, processo_id: int, usuario_id: int, titulo: str = None) -> SessaoChat:
+    sessao = SessaoChat(processo_id=processo_id, usuario_id=usuario_id, titulo=titulo)
+    session.add(sessao)
+    session.commit()
+    session.refresh(sessao)
+    return sessao
+
+
+def obter_sessao(session: Session, sessao_id: int, usuario_id: int):
+    sessao = session.get(SessaoChat, sessao_id)
+    if not sessao or sessao.usuario_id != usuario_id:
+        return None
+    return sessao
+
+
+def listar_mensagens(session: Session, sessao_id: int, apenas_recentes: bool = False) -> list:
+    """Todas as mensagens da sessão, ou só as que ainda não entraram no resumo."""
+    instrucao = select(MensagemChat).where(MensagemChat.sessao_id == sessao_id)
+    if apenas_recentes:
+        instrucao = instrucao.where(MensagemChat.resumida == False)  # noqa: E712
+    return session.exec(instrucao.order_by(MensagemChat.id)).all()
+
+
+def digest_historico(sessao: SessaoChat, recentes: list) -> str:
+    """Identifica o estado da conversa para o cache de respostas (mesma pergunta, histórico diferente = outra resposta)."""
+    bruto = (sessao.resumo or "") + "".join(f"{m.papel}:{m.conteudo}" for m in recentes)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+def registrar_troca(sessao_id: int, pergunta: str, resposta: str, tokens_prompt: int):
+    """Grava pergunta e resposta e agenda a condensação do histórico."""
+    with Session(engine) as session:
+        sessao = session.get(SessaoChat, sessao_id)
+        if not sessao:
+            return
+        session.add(MensagemChat(sessao_id=sessao_id, papel="user", conteudo=pergunta, tokens_prompt=tokens_prompt))
+        session.add(MensagemChat(sessao_id=sessao_id, papel="assistant", conteudo=resposta))
+        if not sessao.titulo:
+            sessao.titulo = pergunta[:80]
+        sessao.atualizado_em = datetime.utcnow()
+        session.add(sessao)
+        session.commit()
+
+    _executor.submit(condensar_historico, sessao_id)
+
+
+def condensar_historico(sessao_id: int):
+    """Move para o resumo as mensagens que saíram da janela das mais recentes (por quantidade ou por tokens)."""
+    with _trava_da_sessao(sessao_id):
+        try:
+            with Session(engine) as session:
+                sessao = session.get(SessaoChat, sessao_id)
+                if not sessao:
+                    return
+                recentes = listar_mensagens(session, sessao_id, apenas_recentes=True)
+                excedentes = recentes[:len(recentes) - len(janela_recente(recentes))]
+                if not excedentes:
+                    return
+
+                prompt = montar_prompt_resumo_conversa(sessao.resumo, excedentes)
+                resumo_atual = sessao.resumo
+                ids = [m.id for m in excedentes]
+
+            novo_resumo = gerar_texto(
+                prompt,
+                template=TEMPLATE_RESUMO_CONVERSA,
+                hash_documento=None,
+                pergunta=hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            )
+
+            with Session(engine) as session:
+                sessao = session.get(SessaoChat, sessao_id)
+                if not sessao or sessao.resumo != resumo_atual:
+                    return
+                sessao.resumo = novo_resumo
+                session.add(sessao)
+                for mensagem in session.exec(select(MensagemChat).where(MensagemChat.id.in_(ids))).all():
+                    mensagem.resumida = True
+                    session.add(mensagem)
+                session.commit()
+        except Exception as e:
+            # Sem resumo novo a conversa continua funcionando, só com um prompt um pouco maior
+            print(f"Erro ao condensar o histórico da sessão {sessao_id}: {e}")
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+# Banco, armazenamento e IA locais: o teste não sai da máquina
+_pasta = tempfile.mkdtemp(prefix="teste-concorrencia-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_pasta, 'teste.db')}")
+os.environ.setdefault("ARMAZENAMENTO", "local")
+os.environ.setdefault("ARMAZENAMENTO_PASTA", os.path.join(_pasta, "arquivos"))
+os.environ.setdefault("LLM_PROVEDOR", "local")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ia  # noqa: E402
+import main  # noqa: E402
+from autenticacao import obter_usuario_atual  # noqa: E402
+from models import UsuarioAtual  # noqa: E402
+
+LATENCIA_IA = 2.0  # segundos que a "IA" leva para responder
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def extracao_lenta(monkeypatch):
+    """Extração de PDF cuja chamada à IA demora LATENCIA_IA; avisa quando a chamada começou."""
+    em_andamento = asyncio.Event()
+
+    async def gerar_texto_async(prompt, **_):
+        em_andamento.set()
+        await asyncio.sleep(LATENCIA_IA)
+        return json.dumps({"numero_processo": "0000000-00.0000.0.00.0000", "cliente": "A", "contra_parte": "B"})
+
+    monkeypatch.setattr(ia, "gerar_texto_async", gerar_texto_async)
+    # Sem regras encontrando nada, todos os campos vão para a IA
+    monkeypatch.setattr(main, "extrair_paginas", lambda conteudo, limite_paginas=None: ["Petição sem dados."])
+    monkeypatch.setattr(main, "extrair_campos", lambda texto: {})
+    monkeypatch.setattr(main, "dados_extraidos", lambda hash_conteudo: None)
+    monkeypatch.setattr(main, "salvar_dados_extraidos", lambda hash_conteudo, resultado: None)
+    monkeypatch.setattr(main, "guardar_envio", lambda *args: SimpleNamespace(chave="conteudo/teste.pdf"))
+    monkeypatch.setattr(main, "_preparar_texto_envio", lambda chave, conteudo: None)
+    main.app.dependency_overrides[obter_usuario_atual] = lambda: UsuarioAtual(id=1, email="teste@teste.com")
+    yield em_andamento
+    main.app.dependency_overrides.clear()
+
+
+@pytest.mark.anyio
+async def test_home_responde_durante_extracao(extracao_lenta):
+    """Com a IA ocupada em /ia/extrair-dados, o event loop continua livre para atender /."""
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+        extracao = asyncio.create_task(cliente.post(
+            "/ia/extrair-dados",
+            files={"arquivo": ("peticao.pdf", b"%PDF-1.4 teste", "application/pdf")}
+        ))
+        await asyncio.wait_for(extracao_lenta.wait(), timeout=LATENCIA_IA)
+
+        inicio = asyncio.get_running_loop().time()
+        for _ in range(5):
+            resposta = await cliente.get("/")
+            assert resposta.status_code == 200
+        assert asyncio.get_running_loop().time() - inicio < LATENCIA_IA / 4
+        assert not extracao.done()
+
+        resposta = await extracao
+        assert resposta.status_code == 200
+        assert resposta.json()["origem"]["cliente"] == "ia"
@@ -23,6 +23,7 @@ function Processos() {
     numero: '', cliente: '', contra_parte: '', tipo_acao: 'Cível', data_prazo: ''
   })
   const [extracting, setExtracting] = useState(false) 
+  const [hashPdf, setHashPdf] = useState(null) // PDF do auto preenchimento, já guardado no servidor
   const hiddenFileInput = useRef(null) 
 
   // DRAWER DA IA
@@ -76,7 +77,10 @@ function Processos() {
     formData.append('arquivo', file)
 
     try {
-        const response = await axios.post(`${import.meta.env.VITE_API_URL}/ia/extrair-dados`, formData)
+        const token = localStorage.getItem('token')
+        const response = await axios.post(`${import.meta.env.VITE_API_URL}/ia/extrair-dados`, formData, {
+            headers: { Authorization: `Bearer ${token}` }
+        })
         const dados = response.data
 
         setNovoProcesso({
@@ -86,6 +90,7 @@ function Processos() {
             contra_parte: dados.contra_parte || '',
             data_prazo: dados.data_prazo || ''
         })
+        setHashPdf(dados.hash || null)
         toast({ title: 'Dados extraídos!', status: 'success' })
     } catch (error) {
         toast({ title: 'Erro na leitura', status: 'error' })
@@ -101,11 +106,18 @@ function Processos() {
     try {
         const token = localStorage.getItem('token')
         const payload = { ...novoProcesso, status: 'Em Andamento' }
-        await axios.post(`${import.meta.env.VITE_API_URL}/processos`, payload, {
+        const response = await axios.post(`${import.meta.env.VITE_API_URL}/processos`, payload, {
             headers: { Authorization: `Bearer ${token}` }
         })
+        // Anexa o PDF lido no auto preenchimento sem enviá-lo de novo
+        if (hashPdf) {
+            await axios.post(`${import.meta.env.VITE_API_URL}/processos/${response.data.id}/anexo/por-hash`, { hash: hashPdf }, {
+                headers: { Authorization: `Bearer ${token}` }
+            })
+        }
         toast({ title: 'Processo criado!', status: 'success' })
         setNovoProcesso({ numero: '', cliente: '', contra_parte: '', tipo_acao: 'Cível', data_prazo: '' })
+        setHashPdf(null)
         onClose()
         fetchData()
     } catch (error) {
@@ -139,13 +151,32 @@ function Processos() {
   const handleUploadPDFDrawer = async (event) => {
     const file = event.target.files[0]
     if (!file) return
-    const formData = new FormData()
-    formData.append('arquivo', file)
     try {
         const token = localStorage.getItem('token')
-        await axios.post(`${import.meta.env.VITE_API_URL}/processos/${processoSelecionado.id}/anexo`, formData, {
-            headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'multipart/form-data' }
-        })
+        const base = `${import.meta.env.VITE_API_URL}/processos/${processoSelecionado.id}`
+        const auth = { headers: { Authorization: `Bearer ${token}` } }
+
+        // Upload direto ao S3 por link pré-assinado; os bytes não passam pela API
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+        const hash = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+        let direto = true
+        try {
+            const link = await axios.post(`${base}/anexo/link-envio`, { hash, tamanho: file.size, nome: file.name }, auth)
+            if (!link.data.ja_enviado) {
+                await axios.put(link.data.url, file, { headers: link.data.cabecalhos })
+            }
+        } catch (error) {
+            // Armazenamento local (501): o PDF vai cru no corpo e a API repassa enquanto recebe
+            if (error.response?.status !== 501) throw error
+            direto = false
+            await axios.post(`${base}/anexo/fluxo`, file, {
+                params: { nome: file.name },
+                headers: { ...auth.headers, 'Content-Type': 'application/pdf' }
+            })
+        }
+        if (direto) {
+            await axios.post(`${base}/anexo/concluir`, { hash, nome: file.name }, auth)
+        }
         toast({ title: 'PDF Enviado!', status: 'success' })
         setProcessoSelecionado({...processoSelecionado, arquivo_pdf: 'sim'})
         fetchData()
@@ -156,10 +187,19 @@ function Processos() {
     setLoadingIA(true)
     try {
         const token = localStorage.getItem('token')
-        const response = await axios.post(`${import.meta.env.VITE_API_URL}/processos/${processoSelecionado.id}/analise-ia`, {}, {
-            headers: { Authorization: `Bearer ${token}` }
-        })
-        setResumoIA(response.data.resumo)
+        const headers = { Authorization: `Bearer ${token}` }
+        const response = await axios.post(`${import.meta.env.VITE_API_URL}/processos/${processoSelecionado.id}/analise-ia`, {}, { headers })
+
+        // A análise roda na fila do servidor: consultamos a tarefa até terminar
+        let tarefa = { status: response.data.status }
+        while (tarefa.status === 'pendente' || tarefa.status === 'processando') {
+            await new Promise((resolve) => setTimeout(resolve, 2000))
+            const res = await axios.get(`${import.meta.env.VITE_API_URL}/tarefas/${response.data.tarefa_id}`, { headers })
+            tarefa = res.data
+        }
+        if (tarefa.status !== 'concluida') throw new Error(tarefa.erro)
+
+        setResumoIA(tarefa.resultado.resumo)
         fetchData()
     } catch (error) { toast({ title: 'Erro na IA', status: 'error' }) } finally { setLoadingIA(false) }
   }